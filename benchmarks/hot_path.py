@@ -0,0 +1,108 @@
+"""
+Microbenchmark of the per-call overhead of ``PostgresCrud`` methods, without a database.
+
+The connection is replaced by an in-memory fake so only the Python work around ``cursor.execute`` is measured. The
+``legacy`` variant replays the previous call path (``locals()`` copied in the public method and again in
+``_execute``, plus a throw-away ``conn.cursor()`` in the public method).
+
+    python benchmarks/hot_path.py --calls 100000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.nice_crud import PostgresCrud
+
+
+class FakeCursor:
+    closed = False
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchall(self):
+        return [(1, 'john', 'doe', 20)]
+
+
+class FakeConnection:
+    closed = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def make_crud() -> PostgresCrud:
+    crud = PostgresCrud(dbname='bench', user='bench', password='bench', host='localhost', port=5432)
+    crud._conn = FakeConnection()
+    crud._conn_pid = os.getpid()
+    return crud
+
+
+def legacy_execute(crud, func_name, sql, type_, func_params, params=None):
+    __locals__ = locals()
+    __locals__.pop('crud')
+
+    conn = crud._connect()
+    cur = conn.cursor()
+
+    crud._begin_statement()
+    try:
+        cur.execute(sql, params)
+        return cur.fetchall()
+    finally:
+        crud._end_statement()
+
+
+def legacy_select(crud, table_name, columns, condition=None, limit=None, offset=None, order_by=None):
+    __locals__ = locals()
+    __locals__.pop('crud')
+    conn = crud._connect()
+    cur = conn.cursor()
+
+    sql = f'SELECT {columns} FROM "{table_name}"'
+    if condition:
+        sql += crud._process_condition(condition)
+    if limit:
+        sql += f' LIMIT {limit}'
+
+    return legacy_execute(crud, 'select', sql, 'READ', __locals__)
+
+
+def run(label: str, func, calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        func()
+    seconds = time.perf_counter() - started
+
+    print(f'{label:>8}: {seconds / calls * 1e6:7.2f} us/call  {calls / seconds:12,.0f} calls/sec')
+    return seconds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=100000)
+    args = parser.parse_args()
+
+    crud = make_crud()
+    condition = "name = 'john'"
+
+    legacy = run('legacy', lambda: legacy_select(crud, 'users', '*', condition, limit=10), args.calls)
+    current = run('current', lambda: crud.select('users', '*', condition, limit=10), args.calls)
+
+    print(f'overhead reduction: {(1 - current / legacy) * 100:.1f}%')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Throughput benchmark of the ``SKIP LOCKED`` job queue: producers enqueue jobs in batches while consumer threads,
+each on its own connection, dequeue, ``ack`` and report end-to-end latency (enqueue to ack).
+
+    python benchmarks/job_queue.py --jobs 50000 --consumers 16 --batch 50
+
+Connection settings come from ``--host``/``--port``/... or the ``DB_*`` environment variables.
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.nice_crud import PostgresCrud
+from src.nice_crud.bench import percentile
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=os.getenv('DB_HOST', 'localhost'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('DB_PORT', '5432')))
+    parser.add_argument('--dbname', default=os.getenv('DB_NAME', 'postgres'))
+    parser.add_argument('--user', default=os.getenv('DB_USER', 'postgres'))
+    parser.add_argument('--password', default=os.getenv('DB_PASSWORD', ''))
+    parser.add_argument('--queue', default='nice_crud_bench_jobs')
+    parser.add_argument('--jobs', type=int, default=50000)
+    parser.add_argument('--producers', type=int, default=2)
+    parser.add_argument('--enqueue-batch', type=int, default=500)
+    parser.add_argument('--consumers', type=int, default=16)
+    parser.add_argument('--batch', type=int, default=50, help='jobs leased per dequeue')
+    args = parser.parse_args()
+
+    def connect() -> PostgresCrud:
+        return PostgresCrud(dbname=args.dbname, user=args.user, password=args.password, host=args.host, port=args.port)
+
+    admin = connect()
+    admin.drop_table(args.queue)
+    admin.create_queue(args.queue)
+
+    latencies = []
+    consumed = [0]
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def produce(count: int) -> None:
+        crud = connect()
+        for start in range(0, count, args.enqueue_batch):
+            size = min(args.enqueue_batch, count - start)
+            crud.enqueue_many(args.queue, [time.time()] * size)
+        crud.close()
+
+    def consume() -> None:
+        crud = connect()
+        while not done.is_set():
+            jobs = crud.dequeue(args.queue, batch=args.batch, wait=0.5)
+            if not jobs:
+                continue
+            crud.ack(args.queue, jobs)
+            now = time.time()
+            with lock:
+                latencies.extend(now - job['payload'] for job in jobs)
+                consumed[0] += len(jobs)
+                if consumed[0] >= args.jobs:
+                    done.set()
+        crud.close()
+
+    share = -(-args.jobs // args.producers)
+    producers = [
+        threading.Thread(target=produce, args=(min(share, args.jobs - i * share),)) for i in range(args.producers)
+    ]
+    consumers = [threading.Thread(target=consume) for _ in range(args.consumers)]
+
+    started = time.perf_counter()
+    for thread in consumers + producers:
+        thread.start()
+    for thread in producers:
+        thread.join()
+    enqueued = time.perf_counter() - started
+    for thread in consumers:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    latencies.sort()
+    print(f'enqueued {args.jobs:,} jobs in {enqueued:.2f}s ({args.jobs / enqueued:,.0f} jobs/sec)')
+    print(f'consumed {consumed[0]:,} jobs in {seconds:.2f}s ({consumed[0] / seconds:,.0f} jobs/sec) '
+          f'with {args.consumers} consumers, batch {args.batch}')
+    print('latency p50 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms'.format(
+        percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, latencies[-1] * 1000
+    ))
+
+    admin.drop_table(args.queue)
+    admin.close()
+
+
+if __name__ == '__main__':
+    main()
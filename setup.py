@@ -14,6 +14,9 @@ setup(
     install_requires=[
         'psycopg2-binary',
     ],
+    extras_require={
+        'arrow': ['pyarrow'],
+    },
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
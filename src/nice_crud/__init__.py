@@ -1,7 +1,11 @@
 from .psql import PostgresCrud
+from .partitions import PartitionManager
+from .cancel import CancelHandle
+from .dataloader import DataLoader
+from .sharded import ShardedPostgresCrud
 
 
-__all__ = ['PostgresCrud']
+__all__ = ['PostgresCrud', 'PartitionManager', 'CancelHandle', 'DataLoader', 'ShardedPostgresCrud']
 
 __name__ = 'nice_crud'
 __version__ = '0.0.2'
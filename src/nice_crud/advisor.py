@@ -0,0 +1,247 @@
+import math
+import re
+import typing as t
+
+from .catalog import CatalogSnapshot
+from .constants import IndexTypes
+
+
+PAGE_SIZE = 8192
+
+TABLE_STATS_SQL = '''
+    SELECT s.relname, s.seq_scan, s.seq_tup_read, coalesce(s.idx_scan, 0), s.n_live_tup,
+           s.n_tup_ins, s.n_tup_upd, s.n_tup_del, pg_catalog.pg_relation_size(s.relid)
+    FROM pg_catalog.pg_stat_user_tables s
+    WHERE s.schemaname = current_schema()
+'''
+
+UNUSED_INDEXES_SQL = '''
+    SELECT s.relname, s.indexrelname, pg_catalog.pg_relation_size(s.indexrelid)
+    FROM pg_catalog.pg_stat_user_indexes s
+    JOIN pg_catalog.pg_index i ON i.indexrelid = s.indexrelid
+    WHERE s.schemaname = current_schema() AND s.idx_scan = 0
+      AND NOT i.indisunique AND NOT i.indisprimary
+      AND NOT EXISTS (SELECT 1 FROM pg_catalog.pg_constraint c WHERE c.conindid = s.indexrelid)
+'''
+
+COLUMN_STATS_SQL = '''
+    SELECT tablename, attname, avg_width, n_distinct, coalesce(correlation, 0)
+    FROM pg_catalog.pg_stats
+    WHERE schemaname = current_schema()
+'''
+
+STATEMENTS_COLUMN_SQL = '''
+    SELECT attname FROM pg_catalog.pg_attribute
+    WHERE attrelid = to_regclass('pg_stat_statements') AND attname IN ('total_exec_time', 'total_time')
+'''
+
+STATEMENTS_SQL = '''
+    SELECT query, calls, {total_time}
+    FROM pg_stat_statements
+    WHERE dbid = (SELECT oid FROM pg_catalog.pg_database WHERE datname = current_database())
+      AND query ~* '\\mwhere\\M'
+    ORDER BY {total_time} DESC
+    LIMIT %s
+'''
+
+_PREDICATE = re.compile(
+    r'"?([A-Za-z_][A-Za-z0-9_]*)"?\s*(=|<>|<=|>=|<|>|@>|\?\||\?&|\?|\bIN\b|\bBETWEEN\b|\bLIKE\b|\bILIKE\b)',
+    re.IGNORECASE
+)
+
+_TIME_TYPES = ('timestamp', 'date')
+_GIST_TYPES = ('point', 'box', 'polygon', 'circle', 'tsrange', 'tstzrange', 'daterange', 'int4range', 'int8range',
+               'numrange', 'geometry', 'geography')
+
+
+def statement_columns(query: str, table_name: str, columns: t.Iterable[str]) -> t.Dict[str, t.Set[str]]:
+    """
+    Extracts the columns of ``table_name`` used in the predicates of a normalized statement.
+
+    :param query: A statement text as found in ``pg_stat_statements``.
+    :type query: str
+
+    :param table_name: The table whose columns should be picked up.
+    :type table_name: str
+
+    :param columns: The known columns of the table.
+    :type columns: t.Iterable[str]
+
+    :return: Column names mapped to the operators they were compared with.
+    :rtype: t.Dict[str, t.Set[str]]
+    """
+
+    if not re.search(rf'\b(from|join|update)\s+"?{re.escape(table_name)}"?(\s|$|,)', query, re.IGNORECASE):
+        return {}
+
+    parts = re.split(r'\bwhere\b', query, maxsplit=1, flags=re.IGNORECASE)
+    where = parts[1] if len(parts) > 1 else ''
+    where = re.split(r'\b(order\s+by|group\s+by|limit|returning)\b', where, flags=re.IGNORECASE)[0]
+
+    known = set(columns)
+    found: t.Dict[str, t.Set[str]] = {}
+    for column, operator in _PREDICATE.findall(where):
+        if column in known:
+            found.setdefault(column, set()).add(operator.upper())
+
+    return found
+
+
+def choose_index_type(
+        column_type: str, operators: t.Iterable[str] = (), append_only: bool = False, correlation: float = 0.0
+) -> str:
+    """
+    Picks the ``constants.IndexTypes`` access method for a column.
+
+    :param column_type: The formatted column type (``format_type`` output).
+    :type column_type: str
+
+    :param operators: The operators the column is queried with.
+    :type operators: t.Iterable[str]
+
+    :param append_only: Whether the table is insert-mostly.
+    :type append_only: bool
+
+    :param correlation: The ``pg_stats.correlation`` of the column.
+    :type correlation: float
+
+    :return: The index type.
+    :rtype: str
+    """
+
+    column_type = column_type.lower()
+    operators = set(operators)
+
+    if column_type in ('jsonb', 'tsvector') or column_type.endswith('[]'):
+        return IndexTypes.Gin
+    if column_type.startswith(_GIST_TYPES):
+        return IndexTypes.Gist
+    if column_type.startswith(_TIME_TYPES) and append_only and abs(correlation) >= 0.9:
+        return IndexTypes.BRin
+    if operators & {'@>', '?', '?|', '?&'}:
+        return IndexTypes.Gin
+
+    return IndexTypes.BTree
+
+
+def estimate_index_size(index_type: str, rows: float, avg_width: float, table_bytes: int) -> int:
+    """
+    Roughly estimates the on-disk size of a single-column index, in bytes.
+    """
+
+    if index_type == IndexTypes.BRin:
+        return max(PAGE_SIZE * 2, int(math.ceil(table_bytes / PAGE_SIZE / 128.0)) * 32)
+    if index_type == IndexTypes.Hash:
+        return int(rows * 20)
+    if index_type == IndexTypes.Gin:
+        return int(rows * max(avg_width, 8) * 0.5)
+
+    # btree: tuple header (8) + line pointer (4) + key, at the default 90% fill factor
+    return int(rows * (12 + max(avg_width, 4)) / 0.9)
+
+
+def _has_leading_index(catalog: CatalogSnapshot, table_name: str, column: str) -> bool:
+    for index in catalog.indexes(table_name).values():
+        definition = index.get('definition') or ''
+        match = re.search(r'\(\s*"?([A-Za-z0-9_]+)"?', definition)
+        if match and match.group(1) == column:
+            return True
+
+    return False
+
+
+def rank_recommendations(
+        catalog: CatalogSnapshot,
+        table_stats: t.Iterable[t.Tuple],
+        unused_indexes: t.Iterable[t.Tuple],
+        column_stats: t.Iterable[t.Tuple],
+        statements: t.Iterable[t.Tuple] = (),
+        min_seq_scans: int = 50,
+        min_table_rows: int = 10000,
+) -> t.List[t.Dict[str, t.Any]]:
+    """
+    Builds ranked ``create_index``/``drop_index`` recommendations from the statistics views.
+
+    Benefits are expressed in page accesses avoided so both kinds of recommendation can be ranked together: for a
+    new index, the heap pages read by sequential scans that the index would skip; for an unused index, its pages plus
+    one index page per write that no longer has to be maintained.
+
+    :return: Recommendations sorted by descending ``benefit``. ``action`` and ``kwargs`` can be passed straight to
+        the matching ``PostgresCrud`` method.
+    :rtype: t.List[t.Dict[str, t.Any]]
+    """
+
+    stats_by_column = {(row[0], row[1]): row[2:] for row in column_stats}
+    statements = list(statements)
+    recommendations = []
+    writes_by_table = {}
+
+    for table_name, seq_scan, seq_tup_read, idx_scan, live, ins, upd, dele, table_bytes in table_stats:
+        writes_by_table[table_name] = ins + upd + dele
+
+        if seq_scan < min_seq_scans or live < min_table_rows or seq_scan <= idx_scan:
+            continue
+
+        columns = catalog.columns(table_name)
+        append_only = ins > 0 and (upd + dele) <= 0.05 * ins
+
+        candidates: t.Dict[str, t.Dict[str, t.Any]] = {}
+        for query, calls, exec_time in statements:
+            for column, operators in statement_columns(query, table_name, columns).items():
+                candidate = candidates.setdefault(column, {'operators': set(), 'time': 0.0, 'calls': 0})
+                candidate['operators'] |= operators
+                candidate['time'] += float(exec_time)
+                candidate['calls'] += calls
+
+        if not statements:
+            for column, column_type in columns.items():
+                correlation = (stats_by_column.get((table_name, column)) or (0, 0, 0))[2]
+                if choose_index_type(column_type, (), append_only, correlation) in (IndexTypes.Gin, IndexTypes.BRin):
+                    candidates[column] = {'operators': set(), 'time': 0.0, 'calls': 0}
+
+        total_time = sum(candidate['time'] for candidate in candidates.values()) or 1.0
+        table_pages = max(table_bytes / PAGE_SIZE, 1.0)
+
+        for column, candidate in candidates.items():
+            if _has_leading_index(catalog, table_name, column):
+                continue
+
+            avg_width, n_distinct, correlation = stats_by_column.get((table_name, column), (8, 0, 0))
+            distinct = abs(n_distinct) * live if n_distinct < 0 else max(n_distinct, 1)
+            selectivity = 1.0 / max(distinct, 1)
+
+            index_type = choose_index_type(columns[column], candidate['operators'], append_only, correlation)
+            share = candidate['time'] / total_time if candidate['time'] else 1.0 / len(candidates)
+            benefit = seq_scan * table_pages * (1 - selectivity) * share
+            if index_type == IndexTypes.BRin:
+                benefit *= abs(correlation)
+
+            recommendations.append({
+                'action': 'create_index',
+                'kwargs': {
+                    'table_name': table_name,
+                    'columns': [column],
+                    'index_name': f'{table_name}_{column}_{index_type}_index',
+                    'index_type': index_type,
+                },
+                'benefit': round(benefit, 2),
+                'estimated_size': estimate_index_size(index_type, live, avg_width, table_bytes),
+                'reason': (
+                    f'{seq_scan} sequential scans read {seq_tup_read} rows of "{table_name}"'
+                    + (f'; {candidate["calls"]} statements filter on "{column}"' if candidate['calls'] else '')
+                ),
+            })
+
+    for table_name, index_name, index_bytes in unused_indexes:
+        index_pages = index_bytes / PAGE_SIZE
+        recommendations.append({
+            'action': 'drop_index',
+            'kwargs': {'index_name': index_name, 'if_exists': True},
+            'benefit': round(index_pages + writes_by_table.get(table_name, 0), 2),
+            'estimated_size': index_bytes,
+            'reason': f'"{index_name}" on "{table_name}" has never been scanned',
+        })
+
+    recommendations.sort(key=lambda rec: rec['benefit'], reverse=True)
+
+    return recommendations
@@ -0,0 +1,515 @@
+"""
+Load generator for ``PostgresCrud``: drives a weighted mix of operations, or replays a statement log, at a target
+rate or concurrency and reports throughput, latency percentiles, error rate and connection wait time per interval.
+
+    nice-crud-bench --setup --mix select=80,update_via_dict=15,insert_from_dict=5 --concurrency 16 --duration 60
+    nice-crud-bench --replay statements.jsonl --mode asyncio --concurrency 64 --connections 16 --rate 2000
+
+Connection settings default to the ``DB_HOST``, ``DB_PORT``, ``DB_NAME``, ``DB_USER`` and ``DB_PASSWORD``
+environment variables.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import math
+import multiprocessing
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import typing as t
+
+from .psql import PostgresCrud
+
+
+OPERATIONS = ('select', 'count', 'insert_from_dict', 'update_via_dict', 'delete')
+
+_PLACEHOLDER = re.compile(r'\$\d+')
+
+
+def percentile(values: t.Sequence[float], q: float) -> t.Optional[float]:
+    """ Nearest-rank percentile of ``values`` (``q`` in ``[0, 100]``) """
+
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100.0 * len(ordered)) - 1))
+
+    return ordered[index]
+
+
+def parse_mix(mix: str) -> t.List[t.Tuple[str, float]]:
+    """ Parses ``'select=80,insert_from_dict=20'`` into ``[('select', 80.0), ('insert_from_dict', 20.0)]`` """
+
+    weights = []
+    for item in mix.split(','):
+        name, _, weight = item.strip().partition('=')
+        if name not in OPERATIONS:
+            raise ValueError(f'unknown operation {name!r}, expected one of {OPERATIONS}')
+        weights.append((name, float(weight or 1)))
+
+    return weights
+
+
+def load_replay(path: str) -> t.List[t.Tuple[str, t.Optional[t.Dict], str]]:
+    """
+    Reads a statement log: one statement per line, either plain SQL or a JSON object with ``query`` (or ``sql``),
+    optional ``params`` and optional ``calls`` (the statement is repeated that many times in the replay cycle, e.g. for
+    ``pg_stat_statements`` exports). ``$n`` placeholders of fingerprinted statements are bound to ``params``.
+
+    :return: ``(sql, params, type_)`` tuples.
+    :rtype: t.List[t.Tuple[str, t.Optional[t.Dict], str]]
+    """
+
+    statements = []
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('--'):
+                continue
+
+            if line.startswith('{'):
+                entry = json.loads(line)
+                sql = entry.get('query') or entry['sql']
+                params = entry.get('params')
+                calls = int(entry.get('calls', 1))
+            else:
+                sql, params, calls = line.rstrip(';'), None, 1
+
+            if params is not None:
+                sql = _PLACEHOLDER.sub(lambda match: f'%(p{match.group()[1:]})s', sql.replace('%', '%%'))
+                params = {f'p{position}': value for position, value in enumerate(params, 1)}
+
+            verb = sql.lstrip().split(None, 1)[0].upper()
+            type_ = 'READ' if verb in ('SELECT', 'WITH', 'SHOW', 'VALUES', 'EXPLAIN') else 'WRITE'
+            statements.extend([(sql, params, type_)] * max(calls, 1))
+
+    return statements
+
+
+def setup_table(crud: PostgresCrud, table_name: str, rows: int) -> None:
+    """ (Re)creates the table used by the built-in operation mix and seeds it with ``rows`` rows """
+
+    crud.drop_table(table_name)
+    crud.create_table(
+        table_name=table_name,
+        columns={'id': 'serial', 'name': 'text NOT NULL', 'value': 'double precision NOT NULL'},
+        primary_key='id',
+    )
+    crud.copy_from(table_name, ((f'name{i}', random.random()) for i in range(rows)), columns=['name', 'value'])
+
+
+class Workload:
+    """
+    Picks and runs the next operation, either from the weighted mix or, in replay mode, the next logged statement.
+    """
+
+    def __init__(self, config: t.Dict[str, t.Any], worker: int):
+        self._rng = random.Random(config['seed'] + worker)
+        self._table = config['table']
+        self._rows = config['rows']
+        self._replay = load_replay(config['replay']) if config['replay'] else None
+        self._position = worker
+        self._stride = config['workers']
+
+        if self._replay is None:
+            mix = parse_mix(config['mix'])
+            self._names = [name for name, _ in mix]
+            self._weights = [weight for _, weight in mix]
+
+    def next(self) -> t.Tuple[str, t.Callable[[PostgresCrud], t.Any]]:
+        if self._replay is not None:
+            sql, params, type_ = self._replay[self._position % len(self._replay)]
+            self._position += self._stride
+            return type_.lower(), lambda crud: crud._execute(
+                func_name='replay', sql=sql, type_=type_, params=params
+            )
+
+        name = self._rng.choices(self._names, self._weights)[0]
+        key = self._rng.randint(1, max(self._rows, 1))
+        table = self._table
+
+        if name == 'select':
+            return name, lambda crud: crud.select(table, '*', condition=f'id = {key}', use_cache=False)
+        if name == 'count':
+            return name, lambda crud: crud.count(table, condition=f'id <= {key}')
+        if name == 'insert_from_dict':
+            data = {'name': f'name{key}', 'value': self._rng.random()}
+            return name, lambda crud: crud.insert_from_dict(table, data)
+        if name == 'update_via_dict':
+            data = {'value': self._rng.random()}
+            return name, lambda crud: crud.update_via_dict(table, data, condition=f'id = {key}')
+
+        return name, lambda crud: crud.delete(table, condition=f'id = {key}')
+
+
+class Recorder:
+    """
+    Thread-safe aggregation of samples ``(elapsed, operation, latency, ok, wait)`` into per-interval buckets.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._buckets: t.Dict[int, t.Dict[str, t.Any]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, samples: t.Iterable[t.Tuple[float, str, float, bool, float]]) -> None:
+        with self._lock:
+            for elapsed, operation, latency, ok, wait in samples:
+                bucket = self._buckets.setdefault(
+                    int(elapsed // self.interval), {'latencies': [], 'errors': 0, 'waits': [], 'operations': {}}
+                )
+                bucket['latencies'].append(latency)
+                bucket['waits'].append(wait)
+                bucket['errors'] += not ok
+                stats = bucket['operations'].setdefault(operation, [0, 0])
+                stats[0] += 1
+                stats[1] += not ok
+
+    @staticmethod
+    def summarize(latencies: t.List[float], errors: int, waits: t.List[float], seconds: float) -> t.Dict[str, t.Any]:
+        ops = len(latencies)
+        return {
+            'ops': ops,
+            'ops_per_sec': ops / seconds if seconds else 0.0,
+            'error_rate': errors / ops if ops else 0.0,
+            'p50_ms': _ms(percentile(latencies, 50)),
+            'p95_ms': _ms(percentile(latencies, 95)),
+            'p99_ms': _ms(percentile(latencies, 99)),
+            'max_ms': _ms(max(latencies) if latencies else None),
+            'wait_avg_ms': _ms(sum(waits) / len(waits) if waits else None),
+            'wait_p99_ms': _ms(percentile(waits, 99)),
+        }
+
+    def intervals(self) -> t.List[t.Dict[str, t.Any]]:
+        with self._lock:
+            buckets = sorted(self._buckets.items())
+
+        return [
+            dict(
+                self.summarize(bucket['latencies'], bucket['errors'], bucket['waits'], self.interval),
+                start=index * self.interval
+            ) for index, bucket in buckets
+        ]
+
+    def total(self, seconds: float) -> t.Dict[str, t.Any]:
+        with self._lock:
+            buckets = list(self._buckets.values())
+
+        latencies = [latency for bucket in buckets for latency in bucket['latencies']]
+        waits = [wait for bucket in buckets for wait in bucket['waits']]
+        errors = sum(bucket['errors'] for bucket in buckets)
+        operations: t.Dict[str, t.Dict[str, int]] = {}
+        for bucket in buckets:
+            for name, (count, failed) in bucket['operations'].items():
+                stats = operations.setdefault(name, {'ops': 0, 'errors': 0})
+                stats['ops'] += count
+                stats['errors'] += failed
+
+        return dict(self.summarize(latencies, errors, waits, seconds), operations=operations)
+
+
+def _ms(seconds: t.Optional[float]) -> t.Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def _new_crud(config: t.Dict[str, t.Any]) -> PostgresCrud:
+    crud = PostgresCrud(**config['connection'])
+    crud._connect()
+    return crud
+
+
+def _pacer(config: t.Dict[str, t.Any]) -> t.Optional[float]:
+    """ Seconds between two operations of one worker for the target rate, ``None`` for a closed loop """
+
+    return config['workers'] / config['rate'] if config['rate'] else None
+
+
+def _call(config, worker, started, deadline, acquire, release, emit) -> None:
+    """
+    Runs one worker until ``deadline`` (``time.time()`` based). With a target rate operations are scheduled on a
+    fixed timetable and latency is measured from the scheduled start, so a saturated server shows up as growing
+    latency rather than as a silently lower request rate.
+    """
+
+    workload = Workload(config, worker)
+    step = _pacer(config)
+    scheduled = time.time() + (random.random() * step if step else 0)
+
+    while True:
+        if step:
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        start = scheduled if step else time.time()
+        if start >= deadline:
+            return
+
+        name, operation = workload.next()
+        waiting = time.time()
+        crud = acquire()
+        wait = time.time() - waiting
+        ok = True
+        try:
+            operation(crud)
+        except Exception:
+            ok = False
+        finally:
+            release(crud)
+
+        finished = time.time()
+        emit((finished - started, name, finished - start, ok, wait))
+        scheduled += step or 0
+
+
+def run_threads(config: t.Dict[str, t.Any], recorder: Recorder, started: float, deadline: float) -> None:
+    pool: queue.Queue = queue.Queue()
+    for _ in range(config['connections']):
+        pool.put(_new_crud(config))
+
+    def acquire():
+        return pool.get()
+
+    threads = [
+        threading.Thread(
+            target=_call, args=(config, worker, started, deadline, acquire, pool.put, lambda s: recorder.add((s,))),
+            name=f'nice_crud-bench-{worker}', daemon=True
+        ) for worker in range(config['workers'])
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    while not pool.empty():
+        pool.get().close()
+
+
+def _process_worker(config, worker, started, deadline, results) -> None:
+    crud = _new_crud(config)
+    pending = []
+    flushed = time.time()
+
+    def emit(sample):
+        nonlocal flushed
+        pending.append(sample)
+        if time.time() - flushed >= 0.5:
+            results.put(list(pending))
+            pending.clear()
+            flushed = time.time()
+
+    try:
+        _call(config, worker, started, deadline, lambda: crud, lambda _: None, emit)
+    finally:
+        results.put(list(pending))
+        results.put(None)
+        crud.close()
+
+
+def run_processes(config: t.Dict[str, t.Any], recorder: Recorder, started: float, deadline: float) -> None:
+    """ One connection per process; ``connections`` is ignored """
+
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=_process_worker, args=(config, worker, started, deadline, results), daemon=True)
+        for worker in range(config['workers'])
+    ]
+    for process in processes:
+        process.start()
+
+    running = len(processes)
+    while running:
+        samples = results.get()
+        if samples is None:
+            running -= 1
+        else:
+            recorder.add(samples)
+
+    for process in processes:
+        process.join()
+
+
+async def _async_worker(config, worker, started, deadline, pool, executor, recorder) -> None:
+    loop = asyncio.get_event_loop()
+    workload = Workload(config, worker)
+    step = _pacer(config)
+    scheduled = time.time() + (random.random() * step if step else 0)
+
+    while True:
+        if step:
+            delay = scheduled - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        start = scheduled if step else time.time()
+        if start >= deadline:
+            return
+
+        name, operation = workload.next()
+        waiting = time.time()
+        crud = await pool.get()
+        wait = time.time() - waiting
+        ok = True
+        try:
+            await loop.run_in_executor(executor, operation, crud)
+        except Exception:
+            ok = False
+        finally:
+            pool.put_nowait(crud)
+
+        finished = time.time()
+        recorder.add(((finished - started, name, finished - start, ok, wait),))
+        scheduled += step or 0
+
+
+async def _run_asyncio(config, recorder, started, deadline) -> None:
+    pool: asyncio.Queue = asyncio.Queue()
+    for _ in range(config['connections']):
+        pool.put_nowait(_new_crud(config))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=config['connections']) as executor:
+        await asyncio.gather(*(
+            _async_worker(config, worker, started, deadline, pool, executor, recorder)
+            for worker in range(config['workers'])
+        ))
+
+    while not pool.empty():
+        pool.get_nowait().close()
+
+
+def run_asyncio(config: t.Dict[str, t.Any], recorder: Recorder, started: float, deadline: float) -> None:
+    """ ``workers`` tasks sharing ``connections`` connections; blocking calls run in a thread per connection """
+
+    asyncio.run(_run_asyncio(config, recorder, started, deadline))
+
+
+MODES = {'threads': run_threads, 'processes': run_processes, 'asyncio': run_asyncio}
+
+
+def run(config: t.Dict[str, t.Any], on_interval: t.Optional[t.Callable[[t.Dict[str, t.Any]], None]] = None):
+    """
+    Runs a benchmark described by ``config`` (see ``main`` for the keys) and returns the report with ``intervals``
+    and ``total`` statistics.
+
+    :param on_interval: Called with every completed interval while the benchmark runs.
+    :type on_interval: t.Optional[t.Callable[[t.Dict[str, t.Any]], None]]
+    """
+
+    recorder = Recorder(config['interval'])
+    started = time.time()
+    deadline = started + config['duration']
+
+    runner = threading.Thread(
+        target=MODES[config['mode']], args=(config, recorder, started, deadline), name='nice_crud-bench', daemon=True
+    )
+    runner.start()
+
+    reported = set()
+
+    def report(completed: int) -> None:
+        for interval in recorder.intervals():
+            index = int(round(interval['start'] / config['interval']))
+            if index < completed and index not in reported:
+                reported.add(index)
+                on_interval(interval)
+
+    while runner.is_alive():
+        runner.join(config['interval'] / 4)
+        if on_interval is not None:
+            report(int((time.time() - started) // config['interval']))
+
+    seconds = min(time.time(), deadline) - started
+    intervals = recorder.intervals()
+    if on_interval is not None:
+        report(sys.maxsize)
+
+    return {'config': config, 'intervals': intervals, 'total': recorder.total(seconds)}
+
+
+def _format(stats: t.Dict[str, t.Any]) -> str:
+    def value(key):
+        return '-' if stats[key] is None else f'{stats[key]:.2f}'
+
+    return (
+        f'{stats["ops_per_sec"]:10.1f} ops/s  err {stats["error_rate"] * 100:5.1f}%  '
+        f'p50 {value("p50_ms")}  p95 {value("p95_ms")}  p99 {value("p99_ms")}  max {value("max_ms")} ms  '
+        f'wait avg {value("wait_avg_ms")}  p99 {value("wait_p99_ms")} ms'
+    )
+
+
+def main(argv: t.Optional[t.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='nice-crud-bench', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--host', default=os.getenv('DB_HOST', 'localhost'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('DB_PORT', '5432')))
+    parser.add_argument('--dbname', default=os.getenv('DB_NAME', 'postgres'))
+    parser.add_argument('--user', default=os.getenv('DB_USER', 'postgres'))
+    parser.add_argument('--password', default=os.getenv('DB_PASSWORD', ''))
+
+    parser.add_argument('--mode', choices=sorted(MODES), default='threads')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent workers')
+    parser.add_argument('--connections', type=int, help='connections shared by the workers (threads/asyncio)')
+    parser.add_argument('--rate', type=float, help='target operations per second over all workers (open loop)')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds per report line')
+
+    parser.add_argument('--mix', default='select=80,update_via_dict=15,insert_from_dict=5',
+                        help=f'weighted operations, from {", ".join(OPERATIONS)}')
+    parser.add_argument('--replay', help='statement log to replay instead of the operation mix')
+    parser.add_argument('--table', default='nice_crud_bench')
+    parser.add_argument('--rows', type=int, default=10000, help='rows of the benchmark table')
+    parser.add_argument('--setup', action='store_true', help='(re)create and seed the benchmark table first')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the full report as JSON')
+
+    args = parser.parse_args(argv)
+
+    config = {
+        'connection': {
+            'host': args.host, 'port': args.port, 'dbname': args.dbname, 'user': args.user, 'password': args.password,
+        },
+        'mode': args.mode,
+        'workers': args.concurrency,
+        'connections': args.connections or args.concurrency,
+        'rate': args.rate,
+        'duration': args.duration,
+        'interval': args.interval,
+        'mix': args.mix,
+        'replay': args.replay,
+        'table': args.table,
+        'rows': args.rows,
+        'seed': args.seed,
+    }
+
+    if args.setup:
+        crud = PostgresCrud(**config['connection'])
+        try:
+            setup_table(crud, args.table, args.rows)
+        finally:
+            crud.close()
+
+    def on_interval(interval):
+        if not args.json:
+            print(f'{interval["start"]:7.1f}s {_format(interval)}', flush=True)
+
+    report = run(config, on_interval)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f'  total {_format(report["total"])}')
+        for name, stats in sorted(report['total']['operations'].items()):
+            print(f'    {name:<18} {stats["ops"]:>10} ops  {stats["errors"]:>8} errors')
+
+    return 1 if report['total']['ops'] == 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,379 @@
+import atexit
+import collections
+import threading
+import time
+import typing as t
+
+import psycopg2.extras
+
+from . import exceptions, invalidation
+
+
+# Delay before the background thread retries a flush that failed as a whole (e.g. lost connection), doubled after
+# every further failure up to the maximum.
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 30.0
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer that batches inserts and updates and flushes them from a background thread.
+
+    Writes are queued in memory and flushed on a dedicated connection in one transaction when ``max_rows`` rows or
+    ``max_bytes`` bytes are pending, or ``flush_interval`` seconds after the previous flush. Inserts are sent as
+    multi-row ``INSERT ... VALUES (...), (...)`` statements (one per table/column set), updates as batched ``UPDATE``
+    statements. Repeated updates of the same key are coalesced into one update carrying the latest value of every
+    column. Within one flush inserts are applied before updates.
+
+    When ``max_queue_rows`` rows are pending, writers block until a flush makes room (backpressure), and raise
+    ``WriteException`` after ``block_timeout`` seconds. ``close()`` - also registered with ``atexit`` - flushes
+    everything that is still queued.
+
+    With ``notify_channel`` every flush also sends a ``data`` notification on ``notify_channel`` for each written
+    table, delivered when the flush commits (see ``PostgresCrud.enable_invalidation``). ``on_flush`` is called with
+    the set of written tables after every committed flush, e.g. to evict them from a local cache.
+
+    When a batched statement fails, the flush is rolled back and its writes are sent again one by one, each under a
+    savepoint, so the others are committed and only the failing ones are isolated. Those are retried by the next
+    flushes; after ``max_attempts`` failures (or when ``close()`` gives up on them) they are moved to
+    ``dead_letters``, with their error. The error of a failed write is raised by the next ``insert``, ``update``,
+    ``flush`` or ``close`` call. A flush that fails as a whole (e.g. on a lost connection) is rolled back and its
+    writes are queued again, ahead of (and merged under) the writes queued since; the background thread then waits
+    before retrying, longer after every further failure.
+    """
+
+    def __init__(
+            self, connect: t.Callable, max_rows: int = 1000, max_bytes: int = 1 << 20, flush_interval: float = 1.0,
+            max_queue_rows: int = 100000, block_timeout: t.Optional[float] = None,
+            notify_channel: t.Optional[str] = None, on_flush: t.Optional[t.Callable[[t.Set[str]], None]] = None,
+            max_attempts: int = 3
+    ):
+        self._connect = connect
+        self.notify_channel = notify_channel
+        self._on_flush = on_flush
+        self._conn = None
+
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.max_queue_rows = max_queue_rows
+        self.block_timeout = block_timeout
+        self.max_attempts = max_attempts
+
+        self._inserts: t.Dict[t.Tuple, t.List[t.Tuple]] = collections.defaultdict(list)
+        self._updates: t.Dict[t.Tuple, t.Dict[t.Tuple, t.Dict[str, t.Any]]] = collections.defaultdict(dict)
+        self._rows = 0
+        self._bytes = 0
+        # Writes that failed on their own: ``((kind, group, payload), attempts)``, retried one by one.
+        self._retries: t.List[t.Tuple[t.Tuple, int]] = []
+        self.dead_letters: t.List[t.Dict[str, t.Any]] = []
+
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._error: t.Optional[Exception] = None
+
+        self.flushed_rows = 0
+        self.flush_count = 0
+
+        self._thread = threading.Thread(target=self._run, name='nice_crud-write-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _size(values: t.Iterable[t.Any]) -> int:
+        return sum(len(v) if isinstance(v, (str, bytes)) else 8 for v in values)
+
+    def _raise_pending_error(self, func_name: str) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise exceptions.WriteException(func_name=func_name, message=f'Buffered flush failed: {error}')
+
+    def _reserve(self, func_name: str, size: int, new_row: bool) -> None:
+        """ Blocks while the queue is full, then accounts for the new write. Must hold ``_cond``. """
+
+        if self._closed:
+            raise exceptions.WriteException(func_name=func_name, message='Write buffer is closed')
+
+        deadline = None if self.block_timeout is None else time.monotonic() + self.block_timeout
+        while new_row and self._rows >= self.max_queue_rows:
+            self._cond.notify_all()
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise exceptions.WriteException(
+                    func_name=func_name, message=f'Write buffer full ({self._rows} rows pending)'
+                )
+            self._cond.wait(remaining)
+
+        self._rows += int(new_row)
+        self._bytes += size
+
+        if self._rows >= self.max_rows or self._bytes >= self.max_bytes:
+            self._cond.notify_all()
+
+    def insert(self, table_name: str, data: t.Dict[str, t.Any], on_conflict: t.Optional[str] = None) -> None:
+        """
+        Queues ``INSERT INTO table_name (data keys) VALUES (data values) [ON CONFLICT on_conflict]``.
+        """
+
+        self._raise_pending_error('buffered_insert')
+
+        key = (table_name, tuple(data), on_conflict)
+        with self._cond:
+            self._reserve('buffered_insert', self._size(data.values()), True)
+            self._inserts[key].append(tuple(data.values()))
+
+    def update(self, table_name: str, data: t.Dict[str, t.Any], key: t.Dict[str, t.Any]) -> None:
+        """
+        Queues ``UPDATE table_name SET data WHERE key``, merging it with a pending update of the same key.
+
+        :param key: Column/value pairs identifying one row, e.g. ``{'id': 42}``.
+        :type key: t.Dict[str, t.Any]
+        """
+
+        self._raise_pending_error('buffered_update')
+
+        group = (table_name, tuple(key))
+        with self._cond:
+            pending = self._updates[group].get(tuple(key.values()))
+            self._reserve('buffered_update', self._size(data.values()), pending is None)
+            if pending is None:
+                self._updates[group][tuple(key.values())] = dict(data)
+            else:
+                pending.update(data)
+
+    def _run(self) -> None:
+        delay = 0.0
+        while True:
+            with self._cond:
+                started = time.monotonic()
+                deadline, retry_at = started + self.flush_interval, started + delay
+                while not self._closed:
+                    now = time.monotonic()
+                    if now < retry_at:
+                        self._cond.wait(retry_at - now)
+                    elif now < deadline and self._rows < self.max_rows and self._bytes < self.max_bytes:
+                        self._cond.wait(deadline - now)
+                    else:
+                        break
+
+                if self._closed:
+                    return
+
+            try:
+                self._flush()
+                delay = 0.0
+            except Exception as e:
+                self._error = e
+                delay = min(max(2 * delay, RETRY_DELAY), MAX_RETRY_DELAY)
+
+    def _take(self) -> t.Tuple[t.Dict, t.Dict, int]:
+        with self._cond:
+            inserts, updates, rows = self._inserts, self._updates, self._rows
+            self._inserts = collections.defaultdict(list)
+            self._updates = collections.defaultdict(dict)
+            self._rows = 0
+            self._bytes = 0
+            self._cond.notify_all()
+
+        return inserts, updates, rows
+
+    def _requeue(self, inserts: t.Dict, updates: t.Dict) -> None:
+        """ Puts the writes of a failed flush back in front of the queue; updates queued since are applied over them """
+
+        with self._cond:
+            for key, values in self._inserts.items():
+                inserts[key].extend(values)
+            for group, pending in self._updates.items():
+                for key_values, data in pending.items():
+                    if key_values in updates[group]:
+                        updates[group][key_values].update(data)
+                    else:
+                        updates[group][key_values] = data
+
+            self._inserts, self._updates = inserts, updates
+            self._rows = sum(len(values) for values in inserts.values()) + sum(map(len, updates.values()))
+            self._bytes = sum(self._size(row) for values in inserts.values() for row in values) + sum(
+                self._size(data.values()) for pending in updates.values() for data in pending.values()
+            )
+
+    def _write_batch(self, cur, inserts: t.Dict, updates: t.Dict) -> None:
+        for (table_name, columns, on_conflict), values in inserts.items():
+            sql = f'INSERT INTO "{table_name}" ({", ".join(columns)}) VALUES %s'
+            if on_conflict:
+                sql += f' ON CONFLICT {on_conflict}'
+            psycopg2.extras.execute_values(cur, sql, values, page_size=self.max_rows)
+
+        for (table_name, key_columns), pending in updates.items():
+            by_columns: t.Dict[t.Tuple, t.List[t.Tuple]] = collections.defaultdict(list)
+            for key_values, data in pending.items():
+                by_columns[tuple(data)].append(tuple(data.values()) + key_values)
+
+            for columns, params in by_columns.items():
+                assignments = ', '.join(f'"{c}" = %s' for c in columns)
+                condition = ' AND '.join(f'"{k}" = %s' for k in key_columns)
+                sql = f'UPDATE "{table_name}" SET {assignments} WHERE {condition}'
+                psycopg2.extras.execute_batch(cur, sql, params, page_size=self.max_rows)
+
+    @staticmethod
+    def _write_one(cur, kind: str, group: t.Tuple, payload: t.Any) -> t.Optional[Exception]:
+        """ Sends one write under a savepoint; returns its error, after rolling it back, instead of raising it """
+
+        if kind == 'insert':
+            table_name, columns, on_conflict = group
+            sql = f'INSERT INTO "{table_name}" ({", ".join(columns)}) VALUES ({", ".join(["%s"] * len(columns))})'
+            if on_conflict:
+                sql += f' ON CONFLICT {on_conflict}'
+            params = payload
+        else:
+            (table_name, key_columns), (key_values, data) = group, payload
+            assignments = ', '.join(f'"{c}" = %s' for c in data)
+            condition = ' AND '.join(f'"{k}" = %s' for k in key_columns)
+            sql = f'UPDATE "{table_name}" SET {assignments} WHERE {condition}'
+            params = tuple(data.values()) + key_values
+
+        cur.execute('SAVEPOINT nice_crud_write')
+        try:
+            cur.execute(sql, params)
+        except psycopg2.Error as e:
+            cur.execute('ROLLBACK TO SAVEPOINT nice_crud_write')
+            return e
+        cur.execute('RELEASE SAVEPOINT nice_crud_write')
+
+        return None
+
+    @staticmethod
+    def _dead_letter(kind: str, group: t.Tuple, payload: t.Any, attempts: int, error: Exception) -> t.Dict[str, t.Any]:
+        if kind == 'insert':
+            table_name, columns, _ = group
+            data, key = dict(zip(columns, payload)), None
+        else:
+            (table_name, key_columns), (key_values, data) = group, payload
+            key = dict(zip(key_columns, key_values))
+
+        return {
+            'table_name': table_name, 'kind': kind, 'data': data, 'key': key, 'attempts': attempts,
+            'error': f'{error}'.strip(),
+        }
+
+    def _settle(self, failed: t.List[t.Tuple[t.Tuple, int, Exception]], give_up: bool = False) -> None:
+        """ Queues failed writes for another attempt, or moves them to ``dead_letters``, and records the error """
+
+        if not failed:
+            return
+
+        dropped = 0
+        for unit, attempts, error in failed:
+            if give_up or attempts >= self.max_attempts:
+                self.dead_letters.append(self._dead_letter(*unit, attempts, error))
+                dropped += 1
+            else:
+                self._retries.append((unit, attempts))
+
+        error = f'{failed[-1][2]}'.strip()
+        self._error = Exception(
+            f'{len(failed)} writes failed, {dropped} of them moved to dead_letters; last error: {error}'
+        )
+
+    def _flush(self, give_up: bool = False) -> int:
+        with self._flush_lock:
+            inserts, updates, rows = self._take()
+            retries, self._retries = self._retries, []
+            if not rows and not retries:
+                return 0
+
+            failed = []
+            try:
+                if self._conn is None or self._conn.closed:
+                    self._conn = self._connect()
+                cur = self._conn.cursor()
+
+                units = []
+                try:
+                    self._write_batch(cur, inserts, updates)
+                except psycopg2.Error:
+                    # One failing write fails its whole statement: send them one by one to isolate it.
+                    self._conn.rollback()
+                    units = [(('insert', group, values), 0) for group, rows_ in inserts.items() for values in rows_]
+                    units += [
+                        (('update', group, item), 0) for group, pending in updates.items() for item in pending.items()
+                    ]
+
+                for unit, attempts in units + retries:
+                    error = self._write_one(cur, *unit)
+                    if error is not None:
+                        failed.append((unit, attempts + 1, error))
+
+                tables = {key[0] for key in inserts} | {key[0] for key in updates} | {unit[1][0] for unit, _ in retries}
+                if self.notify_channel is not None:
+                    for table_name in sorted(tables):
+                        cur.execute(
+                            'SELECT pg_notify(%s, %s)', (self.notify_channel, invalidation.payload('data', table_name))
+                        )
+
+                self._conn.commit()
+            except Exception:
+                self._requeue(inserts, updates)
+                self._retries = retries + self._retries
+                if self._conn is not None and not self._conn.closed:
+                    self._conn.rollback()
+                raise
+
+            self._settle(failed, give_up)
+
+            if self._on_flush is not None:
+                self._on_flush(tables)
+
+            written = rows + len(retries) - len(failed)
+            self.flushed_rows += written
+            self.flush_count += 1
+
+            return written
+
+    def flush(self) -> int:
+        """
+        Flushes everything that is queued, in the calling thread.
+
+        :return: The number of rows written.
+        :rtype: int
+        """
+
+        try:
+            written = self._flush()
+        except Exception as e:
+            raise exceptions.WriteException(func_name='flush', message=f'{e}')
+
+        self._raise_pending_error('flush')
+
+        return written
+
+    def close(self) -> None:
+        """
+        Stops the background thread, flushes the remaining writes and closes the buffer's connection.
+
+        Writes that keep failing are retried up to ``max_attempts`` times, then moved to ``dead_letters``. The
+        connection is closed in any case before an error is raised; if the flush fails as a whole, the writes still
+        queued are lost.
+        """
+
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+
+        atexit.unregister(self.close)
+        self._thread.join()
+
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                self._flush(give_up=attempt == self.max_attempts)
+                if not self._retries:
+                    break
+        except Exception as e:
+            raise exceptions.WriteException(func_name='close', message=f'Buffered flush failed: {e}')
+        finally:
+            if self._conn is not None:
+                self._conn.close()
+
+        self._raise_pending_error('close')
@@ -0,0 +1,217 @@
+import collections
+import csv
+import io
+import itertools
+import multiprocessing
+import multiprocessing.util
+import os
+import time
+import typing as t
+
+
+class RowStream(io.RawIOBase):
+    """
+    Read-only file object producing CSV text from an iterable of rows, for ``COPY ... FROM STDIN``.
+
+    Rows are serialized lazily as ``COPY`` reads, so only about one read buffer of rows is held in memory.
+    ``None`` values are written as unquoted empty fields, which ``COPY ... (FORMAT csv)`` reads as NULL.
+    """
+
+    def __init__(self, rows: t.Iterable[t.Sequence[t.Any]]):
+        super().__init__()
+        self._rows = iter(rows)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator='\n')
+        self._pending = b''
+        self.rows = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        size = 1 << 16 if size is None or size < 0 else size
+
+        while len(self._pending) < size:
+            chunk = list(itertools.islice(self._rows, 512))
+            if not chunk:
+                break
+            self._writer.writerows(chunk)
+            self.rows += len(chunk)
+            self._pending += self._buffer.getvalue().encode()
+            self._buffer.seek(0)
+            self._buffer.truncate()
+
+        data, self._pending = self._pending[:size], self._pending[size:]
+
+        return data
+
+
+class RangeReader(io.RawIOBase):
+    """
+    Read-only view of the byte range ``[start, end)`` of a file.
+    """
+
+    def __init__(self, path: str, start: int, end: int):
+        super().__init__()
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._remaining = end - start
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+
+        data = self._file.read(size)
+        self._remaining -= len(data)
+
+        return data
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+
+def split_file(path: str, parts: int, header: bool = False) -> t.List[t.Tuple[int, int]]:
+    """
+    Splits a file into at most ``parts`` byte ranges whose boundaries fall right after a newline.
+
+    Records are assumed to be one per line (no quoted newlines in CSV fields).
+
+    :param header: Skip the first line of the file.
+    :type header: bool
+
+    :return: ``(start, end)`` byte offsets.
+    :rtype: t.List[t.Tuple[int, int]]
+    """
+
+    size = os.path.getsize(path)
+
+    with open(path, 'rb') as file:
+        start = len(file.readline()) if header else 0
+        step = max((size - start) // max(parts, 1), 1)
+        bounds = [start]
+
+        while bounds[-1] < size and len(bounds) < parts:
+            file.seek(min(bounds[-1] + step, size))
+            if file.tell() < size:
+                file.readline()
+            if file.tell() >= size:
+                break
+            bounds.append(file.tell())
+
+    bounds.append(size)
+
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1) if bounds[i] < bounds[i + 1]]
+
+
+def chunked(rows: t.Iterable[t.Any], size: int) -> t.Iterator[t.List[t.Any]]:
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+_worker_crud = None
+
+
+def _init_worker(connection_kwargs: t.Dict[str, t.Any]) -> None:
+    # Every worker process opens its own connection; nothing connection-related is inherited from the parent.
+    from .psql import PostgresCrud
+
+    global _worker_crud
+    _worker_crud = PostgresCrud(**connection_kwargs)
+    # Run when the worker exits after ``Pool.close()``, not when the pool is terminated.
+    multiprocessing.util.Finalize(None, _worker_crud.close, exitpriority=10)
+
+
+def _load_task(task: t.Tuple) -> t.Dict[str, t.Any]:
+    kind, table_name, payload, columns, copy_options = task
+    started = time.perf_counter()
+    result = {'pid': os.getpid(), 'rows': 0, 'seconds': 0.0, 'error': None}
+
+    try:
+        if kind == 'file':
+            path, start, end = payload
+            reader = RangeReader(path, start, end)
+            try:
+                result['rows'] = _worker_crud.copy_from(table_name, reader, columns=columns, **copy_options)
+            finally:
+                reader.close()
+        else:
+            result['rows'] = _worker_crud.copy_from(table_name, payload, columns=columns)
+    except Exception as e:
+        result['error'] = str(e)
+
+    result['seconds'] = time.perf_counter() - started
+
+    return result
+
+
+def run_parallel_load(
+        connection_kwargs: t.Dict[str, t.Any], table_name: str, source: t.Union[str, t.Iterable[t.Sequence]],
+        workers: int, columns: t.Optional[t.Sequence[str]], chunk_rows: int, copy_options: t.Dict[str, t.Any],
+        mp_context: str, max_pending: t.Optional[int] = None
+) -> t.Dict[str, t.Any]:
+    """
+    Shards ``source`` across a process pool and COPYs every shard on the worker's own connection.
+
+    At most ``max_pending`` tasks (by default two per worker) are submitted and not finished yet, so an iterable
+    source is read only as fast as the workers load it.
+
+    :return: The aggregated report, see ``PostgresCrud.parallel_load``.
+    :rtype: t.Dict[str, t.Any]
+    """
+
+    if isinstance(source, (str, os.PathLike)):
+        ranges = split_file(os.fspath(source), workers, header=copy_options.get('header', False))
+        options = dict(copy_options, header=False)
+        tasks = (('file', table_name, (os.fspath(source), start, end), columns, options) for start, end in ranges)
+    else:
+        tasks = (('rows', table_name, chunk, columns, {}) for chunk in chunked(source, chunk_rows))
+
+    max_pending = max_pending or 2 * workers
+    started = time.perf_counter()
+    per_worker: t.Dict[int, t.Dict[str, t.Any]] = {}
+    errors = []
+
+    def collect(result: t.Dict[str, t.Any]) -> None:
+        stats = per_worker.setdefault(result['pid'], {'rows': 0, 'seconds': 0.0, 'tasks': 0, 'errors': []})
+        stats['rows'] += result['rows']
+        stats['seconds'] += result['seconds']
+        stats['tasks'] += 1
+        if result['error'] is not None:
+            stats['errors'].append(result['error'])
+            errors.append({'pid': result['pid'], 'error': result['error']})
+
+    ctx = multiprocessing.get_context(mp_context)
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(connection_kwargs,)) as pool:
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(pool.apply_async(_load_task, (task,)))
+            if len(pending) >= max_pending:
+                collect(pending.popleft().get())
+        while pending:
+            collect(pending.popleft().get())
+
+        # Let the workers exit normally, which closes their connections.
+        pool.close()
+        pool.join()
+
+    for stats in per_worker.values():
+        stats['rows_per_sec'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+
+    seconds = time.perf_counter() - started
+    rows = sum(stats['rows'] for stats in per_worker.values())
+
+    return {
+        'rows': rows,
+        'seconds': seconds,
+        'rows_per_sec': rows / seconds if seconds else 0.0,
+        'workers': per_worker,
+        'errors': errors,
+    }
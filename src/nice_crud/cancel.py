@@ -0,0 +1,48 @@
+import asyncio
+import threading
+import typing as t
+
+
+class CancelHandle:
+    """
+    Cancels the statement running on a ``PostgresCrud`` instance from another thread or an asyncio task.
+
+    Usage::
+
+        handle = crud.cancel_handle()
+        threading.Timer(5, handle.cancel).start()
+        crud.select('big_table')  # raises ReadCancelledException if still running after 5 seconds
+    """
+
+    def __init__(self, crud):
+        self._crud = crud
+
+    def cancel(self) -> bool:
+        """
+        Sends a cancel request for the running statement.
+
+        :return: ``True`` if a statement was running.
+        :rtype: bool
+        """
+
+        return self._crud.cancel()
+
+    def cancel_after(self, seconds: float) -> threading.Timer:
+        """
+        Cancels the statement running ``seconds`` from now; call ``cancel()`` on the returned timer to disarm it.
+        """
+
+        timer = threading.Timer(seconds, self.cancel)
+        timer.daemon = True
+        timer.start()
+
+        return timer
+
+    async def cancel_async(self, loop: t.Optional[asyncio.AbstractEventLoop] = None) -> bool:
+        """
+        Sends the cancel request from a worker thread, so the event loop is not blocked by the cancel round trip.
+        """
+
+        loop = loop or asyncio.get_event_loop()
+
+        return await loop.run_in_executor(None, self.cancel)
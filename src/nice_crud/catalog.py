@@ -0,0 +1,271 @@
+import typing as t
+
+
+_CONSTRAINT_KEYWORDS = ('primary', 'unique', 'constraint', 'check', 'foreign', 'exclude', 'like')
+
+
+def split_top_level(text: str, sep: str = ',') -> t.List[str]:
+    """
+    Splits a string on ``sep`` while ignoring separators nested in parentheses or quotes.
+
+    :param text: The string to split.
+    :type text: str
+
+    :param sep: The separator character.
+    :type sep: str
+
+    :return: The stripped, non-empty parts.
+    :rtype: t.List[str]
+    """
+
+    parts, depth, quote, current = [], 0, None, []
+
+    for char in text:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ('"', "'"):
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == sep and depth == 0:
+            parts.append(''.join(current).strip())
+            current = []
+            continue
+        current.append(char)
+
+    parts.append(''.join(current).strip())
+
+    return [part for part in parts if part]
+
+
+def fold_identifier(name: str) -> str:
+    """
+    Applies the Postgres identifier rules to a name: ``"Quoted"`` names keep their case, unquoted ones are lower-cased.
+
+    :param name: The identifier as written in SQL.
+    :type name: str
+
+    :return: The name as stored in ``pg_catalog``.
+    :rtype: str
+    """
+
+    name = name.strip()
+    if len(name) > 1 and name[0] == '"' and name[-1] == '"':
+        return name[1:-1].replace('""', '"')
+
+    return name.lower()
+
+
+def column_spec_to_dict(columns: t.Any) -> t.Dict[str, str]:
+    """
+    Normalizes every column form accepted by ``PostgresCrud.create_table`` to a ``{name: type}`` dict.
+
+    Table constraints written inline in the string form (``PRIMARY KEY (...)``, ``UNIQUE (...)``, ...) are skipped.
+
+    :param columns: The columns as passed to ``create_table``.
+    :type columns: t.Any
+
+    :return: Column names (case-folded like Postgres does) mapped to their lower-cased type name (first word of the
+             definition).
+    :rtype: t.Dict[str, str]
+    """
+
+    pairs = []
+
+    if type(columns) == str:
+        for part in split_top_level(columns):
+            name, _, definition = part.partition(' ')
+            if name.lower() in _CONSTRAINT_KEYWORDS:
+                continue
+            pairs.append((name, definition))
+    elif type(columns) == dict:
+        pairs = list(columns.items())
+    elif type(columns) == list or type(columns) == tuple:
+        for col in columns:
+            if type(col) == dict:
+                pairs.extend(col.items())
+            else:
+                pairs.append((col[0], col[1]))
+    else:
+        raise TypeError(f'columns must be str, list or dict: {type(columns)}')
+
+    return {
+        fold_identifier(name): (definition.strip().split(' ')[0].lower() if definition.strip() else '')
+        for name, definition in pairs
+    }
+
+
+# The type of one column, without modifiers (``character varying``, not ``character varying(20)``), for casts.
+COLUMN_TYPE_SQL = '''
+    SELECT pg_catalog.format_type(atttypid, NULL)
+    FROM pg_catalog.pg_attribute
+    WHERE attrelid = to_regclass(%s) AND attname = %s AND attnum > 0 AND NOT attisdropped
+'''
+
+
+class CatalogSnapshot:
+    """
+    In-memory snapshot of the tables, columns, constraints and indexes of the current schema.
+
+    The whole snapshot is loaded from ``pg_catalog`` with a single query (:attr:`SQL`) and is then kept up to date
+    by ``PostgresCrud`` as it runs DDL, so repeated ``create_table``/``create_index`` calls can be answered locally.
+    """
+
+    SQL = '''
+        SELECT 'column', c.relname, a.attname, format_type(a.atttypid, a.atttypmod), a.attnum::int,
+               a.attnotnull::text
+        FROM pg_catalog.pg_attribute a
+        JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind IN ('r', 'p') AND a.attnum > 0 AND NOT a.attisdropped AND n.nspname = current_schema()
+        UNION ALL
+        SELECT 'constraint', c.relname, con.conname, con.contype::text, 0, pg_catalog.pg_get_constraintdef(con.oid)
+        FROM pg_catalog.pg_constraint con
+        JOIN pg_catalog.pg_class c ON c.oid = con.conrelid
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema()
+        UNION ALL
+        SELECT 'index', c.relname, i.relname, am.amname, x.indisvalid::int, pg_catalog.pg_get_indexdef(i.oid)
+        FROM pg_catalog.pg_index x
+        JOIN pg_catalog.pg_class c ON c.oid = x.indrelid
+        JOIN pg_catalog.pg_class i ON i.oid = x.indexrelid
+        JOIN pg_catalog.pg_am am ON am.oid = i.relam
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema()
+        ORDER BY 1, 2, 5
+    '''
+
+    def __init__(self, rows: t.Iterable[t.Tuple] = ()):
+        self._tables: t.Dict[str, t.Dict[str, t.Any]] = {}
+        self._index_owner: t.Dict[str, str] = {}
+
+        for kind, table_name, name, type_, position, extra in rows:
+            table = self._table(table_name)
+            if kind == 'column':
+                table['columns'][name] = type_
+            elif kind == 'constraint':
+                table['constraints'][name] = {'type': type_, 'definition': extra}
+            elif kind == 'index':
+                table['indexes'][name] = {'type': type_, 'valid': bool(position), 'definition': extra}
+                self._index_owner[name] = table_name
+
+    def _table(self, table_name: str) -> t.Dict[str, t.Any]:
+        return self._tables.setdefault(table_name, {'columns': {}, 'constraints': {}, 'indexes': {}})
+
+    @staticmethod
+    def _resolve(names: t.Dict[str, t.Any], name: str) -> t.Optional[str]:
+        """
+        Finds the key a name refers to. ``PostgresCrud`` quotes some identifiers and not others, so the name is tried
+        as written (without surrounding quotes) and then case-folded.
+        """
+
+        for candidate in (name.strip().strip('"'), fold_identifier(name)):
+            if candidate in names:
+                return candidate
+
+        return None
+
+    def _get(self, table_name: str) -> t.Dict[str, t.Any]:
+        key = self._resolve(self._tables, table_name)
+
+        return self._tables[key] if key is not None else {}
+
+    @property
+    def tables(self) -> t.List[str]:
+        return list(self._tables)
+
+    def has_table(self, table_name: str) -> bool:
+        return self._resolve(self._tables, table_name) is not None
+
+    def columns(self, table_name: str) -> t.Dict[str, str]:
+        """
+        Returns the columns of a table in attribute order.
+
+        :param table_name: The table name.
+        :type table_name: str
+
+        :return: Column names mapped to their formatted type (empty if the table is unknown).
+        :rtype: t.Dict[str, str]
+        """
+
+        return dict(self._get(table_name).get('columns', {}))
+
+    def column_type(self, table_name: str, column: str) -> t.Optional[str]:
+        columns = self._get(table_name).get('columns', {})
+        key = self._resolve(columns, column)
+
+        return columns[key] if key is not None else None
+
+    def constraints(self, table_name: str) -> t.Dict[str, t.Dict[str, str]]:
+        return dict(self._get(table_name).get('constraints', {}))
+
+    def indexes(self, table_name: str) -> t.Dict[str, t.Dict[str, t.Any]]:
+        return dict(self._get(table_name).get('indexes', {}))
+
+    def has_columns(self, table_name: str, columns: t.Iterable[str]) -> bool:
+        """
+        Checks that a table exists and already has every given column.
+
+        :param table_name: The table name.
+        :type table_name: str
+
+        :param columns: The column names to look for.
+        :type columns: t.Iterable[str]
+
+        :return: True if the table and all of the columns exist.
+        :rtype: bool
+        """
+
+        if not self.has_table(table_name):
+            return False
+
+        existing = self._get(table_name)['columns']
+
+        return all(self._resolve(existing, column) is not None for column in columns)
+
+    def has_index(self, index_name: str) -> bool:
+        """ True if a *valid* index with this name exists in the schema """
+
+        table_name = self._index_owner.get(index_name)
+        if table_name is None:
+            return False
+
+        return self._tables[table_name]['indexes'][index_name]['valid']
+
+    def add_table(self, table_name: str, columns: t.Dict[str, str]) -> None:
+        """
+        Records a table that was just created. A table that is already known is left as is: ``CREATE TABLE IF NOT
+        EXISTS`` ignores the requested columns in that case, so they say nothing about what the server has.
+
+        :param table_name: The table name.
+        :type table_name: str
+
+        :param columns: Column names mapped to their types, see ``column_spec_to_dict``.
+        :type columns: t.Dict[str, str]
+        """
+
+        if self.has_table(table_name):
+            return
+
+        self._table(table_name)['columns'].update(columns)
+
+    def add_index(self, table_name: str, index_name: str, index_type: t.Optional[str] = None) -> None:
+        self._table(table_name)['indexes'][index_name] = {
+            'type': (index_type or 'btree').lower(), 'valid': True, 'definition': None
+        }
+        self._index_owner[index_name] = table_name
+
+    def discard_table(self, table_name: str) -> None:
+        key = self._resolve(self._tables, table_name)
+        table = self._tables.pop(key) if key is not None else None
+        if table is not None:
+            for index_name in table['indexes']:
+                self._index_owner.pop(index_name, None)
+
+    def discard_index(self, index_name: str) -> None:
+        table_name = self._index_owner.pop(index_name, None)
+        if table_name is not None:
+            self._tables[table_name]['indexes'].pop(index_name, None)
@@ -0,0 +1,239 @@
+import json
+import re
+import struct
+import typing as t
+
+
+PLUGINS = ('pgoutput', 'wal2json', 'test_decoding')
+
+OPERATIONS = {'I': 'insert', 'U': 'update', 'D': 'delete', 'T': 'truncate'}
+
+SLOT_SQL = 'SELECT plugin FROM pg_catalog.pg_replication_slots WHERE slot_name = %s'
+PUBLICATION_SQL = 'SELECT 1 FROM pg_catalog.pg_publication WHERE pubname = %s'
+
+
+def format_lsn(lsn: int) -> str:
+    """ ``pg_lsn`` text form of a WAL position, e.g. ``'0/16B3748'`` """
+
+    return f'{lsn >> 32:X}/{lsn & 0xFFFFFFFF:X}'
+
+
+def publication_name(slot_name: str) -> str:
+    return f'{slot_name}_pub'
+
+
+def acknowledgeable(decoder, data_start: int) -> t.Optional[int]:
+    """
+    The position to acknowledge once a message has been fully consumed. Only commits are acknowledged: the server
+    stamps their messages with the end of the commit record, so a restarted slot skips the whole transaction, while
+    a transaction interrupted midway is decoded again from its start anyway.
+    """
+
+    return None if decoder.in_transaction else data_start
+
+
+def event(
+        operation: str, schema: str, table: str, new: t.Optional[t.Dict[str, t.Any]] = None,
+        old: t.Optional[t.Dict[str, t.Any]] = None, xid: t.Optional[int] = None
+) -> t.Dict[str, t.Any]:
+    return {'operation': operation, 'schema': schema, 'table': table, 'new': new, 'old': old, 'xid': xid, 'lsn': None}
+
+
+class PgOutputDecoder:
+    """
+    Decodes the binary messages of the built-in ``pgoutput`` plugin (protocol version 1).
+
+    Column values are returned in their text representation; TOASTed values an update did not change are omitted.
+    Relation messages, sent before the first change of a table in a session, are kept to name the columns.
+    """
+
+    plugin = 'pgoutput'
+
+    def __init__(self):
+        self._relations: t.Dict[int, t.Tuple[str, str, t.List[str]]] = {}
+        self._xid: t.Optional[int] = None
+        self.in_transaction = False
+
+    def options(self, tables: t.Sequence[str], publication: str) -> t.Dict[str, str]:
+        return {'proto_version': '1', 'publication_names': publication}
+
+    @staticmethod
+    def _string(data: bytes, offset: int) -> t.Tuple[str, int]:
+        end = data.index(b'\x00', offset)
+        return data[offset:end].decode(), end + 1
+
+    def _tuple(self, data: bytes, offset: int, columns: t.List[str]) -> t.Tuple[t.Dict[str, t.Any], int]:
+        count, = struct.unpack_from('>h', data, offset)
+        offset += 2
+        values = {}
+        for i in range(count):
+            kind = data[offset:offset + 1]
+            offset += 1
+            if kind == b'n':
+                values[columns[i]] = None
+            elif kind == b't':
+                length, = struct.unpack_from('>i', data, offset)
+                offset += 4
+                values[columns[i]] = data[offset:offset + length].decode()
+                offset += length
+            # b'u': unchanged TOAST value, not sent
+
+        return values, offset
+
+    def decode(self, data: bytes) -> t.List[t.Dict[str, t.Any]]:
+        kind = data[:1]
+
+        if kind == b'B':
+            self._xid, = struct.unpack_from('>I', data, 17)
+            self.in_transaction = True
+        elif kind == b'C':
+            self._xid, self.in_transaction = None, False
+        elif kind == b'R':
+            relation_id, = struct.unpack_from('>I', data, 1)
+            schema, offset = self._string(data, 5)
+            table, offset = self._string(data, offset)
+            count, = struct.unpack_from('>h', data, offset + 1)
+            offset += 3
+            columns = []
+            for _ in range(count):
+                name, offset = self._string(data, offset + 1)
+                columns.append(name)
+                offset += 8
+            self._relations[relation_id] = (schema, table, columns)
+        elif kind in (b'I', b'U', b'D'):
+            relation_id, = struct.unpack_from('>I', data, 1)
+            schema, table, columns = self._relations[relation_id]
+            offset, old, new = 5, None, None
+            if data[offset:offset + 1] in (b'K', b'O'):
+                old, offset = self._tuple(data, offset + 1, columns)
+            if data[offset:offset + 1] == b'N':
+                new, offset = self._tuple(data, offset + 1, columns)
+            return [event(OPERATIONS[kind.decode()], schema, table, new=new, old=old, xid=self._xid)]
+        elif kind == b'T':
+            count, = struct.unpack_from('>i', data, 1)
+            relation_ids = struct.unpack_from(f'>{count}I', data, 6)
+            return [
+                event('truncate', self._relations[relation_id][0], self._relations[relation_id][1], xid=self._xid)
+                for relation_id in relation_ids
+            ]
+
+        return []
+
+
+class Wal2JsonDecoder:
+    """
+    Decodes ``wal2json`` output (format version 2, one JSON document per change). Values keep the JSON types
+    ``wal2json`` gives them.
+    """
+
+    plugin = 'wal2json'
+
+    def __init__(self):
+        self._xid: t.Optional[int] = None
+        self.in_transaction = False
+
+    def options(self, tables: t.Sequence[str], publication: str) -> t.Dict[str, str]:
+        options = {'format-version': '2', 'include-xids': '1', 'include-transaction': '1'}
+        if tables:
+            options['add-tables'] = ','.join(f'*.{table}' for table in tables)
+        return options
+
+    @staticmethod
+    def _columns(columns: t.Optional[t.List[t.Dict[str, t.Any]]]) -> t.Optional[t.Dict[str, t.Any]]:
+        return None if columns is None else {column['name']: column.get('value') for column in columns}
+
+    def decode(self, data: t.Union[bytes, str]) -> t.List[t.Dict[str, t.Any]]:
+        change = json.loads(data)
+        action = change.get('action')
+
+        if action == 'B':
+            self._xid, self.in_transaction = change.get('xid'), True
+        elif action == 'C':
+            self._xid, self.in_transaction = None, False
+        elif action in OPERATIONS:
+            return [event(
+                OPERATIONS[action], change['schema'], change['table'], new=self._columns(change.get('columns')),
+                old=self._columns(change.get('identity')), xid=self._xid
+            )]
+
+        return []
+
+
+_TEST_DECODING_CHANGE = re.compile(r'^table (?P<schema>[^.]+)\.(?P<table>\S+): (?P<operation>INSERT|UPDATE|DELETE|'
+                                   r'TRUNCATE):(?P<rest>.*)$', re.DOTALL)
+_TEST_DECODING_COLUMN = re.compile(
+    r'\s*(?P<name>"(?:[^"]|"")*"|[^\s\[]+)\[(?P<type>.+?)\]:(?P<value>\'(?:[^\']|\'\')*\'|\S+)'
+)
+
+
+class TestDecodingDecoder:
+    """
+    Decodes the text output of the ``test_decoding`` contrib plugin. Values are returned as text; the plugin
+    decodes every table, so the requested tables are filtered here.
+    """
+
+    plugin = 'test_decoding'
+
+    def __init__(self):
+        self._xid: t.Optional[int] = None
+        self._tables: t.Optional[t.Set[str]] = None
+        self.in_transaction = False
+
+    def options(self, tables: t.Sequence[str], publication: str) -> t.Dict[str, str]:
+        self._tables = set(tables) if tables else None
+        return {'include-xids': '1', 'skip-empty-xacts': '1'}
+
+    @staticmethod
+    def _name(name: str) -> str:
+        return name[1:-1].replace('""', '"') if name.startswith('"') else name
+
+    def _values(self, text: str) -> t.Dict[str, t.Any]:
+        values = {}
+        for match in _TEST_DECODING_COLUMN.finditer(text):
+            value = match.group('value')
+            if value == 'null':
+                value = None
+            elif value == 'unchanged-toast-datum':
+                continue
+            elif value.startswith("'"):
+                value = value[1:-1].replace("''", "'")
+            values[self._name(match.group('name'))] = value
+
+        return values
+
+    def decode(self, data: t.Union[bytes, str]) -> t.List[t.Dict[str, t.Any]]:
+        text = data.decode() if isinstance(data, bytes) else data
+
+        if text.startswith('BEGIN'):
+            self._xid = int(text.split()[1]) if len(text.split()) > 1 else None
+            self.in_transaction = True
+            return []
+        if text.startswith('COMMIT'):
+            self._xid, self.in_transaction = None, False
+            return []
+
+        match = _TEST_DECODING_CHANGE.match(text)
+        if match is None:
+            return []
+
+        schema, table = self._name(match.group('schema')), self._name(match.group('table'))
+        if self._tables is not None and table not in self._tables:
+            return []
+
+        operation, rest = match.group('operation').lower(), match.group('rest')
+        old, new = None, None
+        if operation == 'insert':
+            new = self._values(rest)
+        elif operation == 'update':
+            if ' new-tuple:' in rest:
+                old_text, new_text = rest.split(' new-tuple:', 1)
+                old, new = self._values(old_text.replace(' old-key:', '', 1)), self._values(new_text)
+            else:
+                new = self._values(rest)
+        elif operation == 'delete':
+            old = self._values(rest) if '(no-tuple-data)' not in rest else None
+
+        return [event(operation, schema, table, new=new, old=old, xid=self._xid)]
+
+
+DECODERS = {decoder.plugin: decoder for decoder in (PgOutputDecoder, Wal2JsonDecoder, TestDecodingDecoder)}
@@ -9,3 +9,13 @@ class IndexTypes:
     Gin = "gin"
     SpGist = "spgist"
     BRin = "brin"
+
+
+class PartitionTypes:
+    """
+    This class contains the constants for the partitioning strategies.
+    """
+
+    Range = "range"
+    List = "list"
+    Hash = "hash"
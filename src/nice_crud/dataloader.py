@@ -0,0 +1,152 @@
+import asyncio
+import concurrent.futures
+import typing as t
+
+
+class DataLoader:
+    """
+    Coalesces single-row lookups issued concurrently by asyncio tasks into one ``select_many`` query per table.
+
+    ``get`` calls made in the same event-loop iteration (or, with ``window > 0``, within ``window`` seconds of the
+    first one) are merged into a single call, whose rows are handed back to each caller. Every
+    key is fetched at most once per loader: results are memoized, so create one loader per request (page render,
+    resolver run) and let it go afterwards, or call ``clear``.
+
+    Usage::
+
+        async with DataLoader(crud) as loader:
+            author, editor = await asyncio.gather(loader.get('users', 7), loader.get('users', 9))  # one query
+
+    ``psycopg2`` is blocking, so the queries run on ``executor``; by default the loader owns a single-thread
+    executor, which keeps its queries on the instance's connection serialized. Loaders sharing a ``PostgresCrud``
+    concurrently should share one single-thread executor too.
+    """
+
+    def __init__(
+            self, crud, window: float = 0.0, max_batch_size: int = 1000,
+            executor: t.Optional[concurrent.futures.Executor] = None
+    ):
+        """
+        :param crud: The ``PostgresCrud`` instance to query.
+
+        :param window: Seconds to wait for more keys after the first one of a batch, e.g. ``0.0005``; ``0`` dispatches
+            at the end of the current event-loop iteration.
+        :type window: float
+
+        :param max_batch_size: The most keys sent in one query; larger batches are split.
+        :type max_batch_size: int
+        """
+
+        self._crud = crud
+        self._window = window
+        self._max_batch_size = max_batch_size
+        self._executor = executor or concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='nice_crud-dataloader'
+        )
+        self._owns_executor = executor is None
+
+        self._memo: t.Dict[t.Tuple, asyncio.Future] = {}
+        self._pending: t.Dict[t.Tuple, t.Dict[t.Any, asyncio.Future]] = {}
+
+        self.batches = 0
+        self.keys_loaded = 0
+
+    @staticmethod
+    def _group(table_name: str, key_column: str, columns: t.Union[t.List[str], t.Tuple, str]) -> t.Tuple:
+        return table_name, key_column, columns if type(columns) == str else tuple(columns)
+
+    def get(
+            self, table_name: str, key: t.Any, key_column: str = 'id',
+            columns: t.Union[t.List[str], t.Tuple, str] = '*'
+    ) -> 'asyncio.Future[t.Optional[t.Tuple]]':
+        """
+        Returns an awaitable resolving to the row whose ``key_column`` equals ``key``, or ``None`` if there is none.
+        """
+
+        group = self._group(table_name, key_column, columns)
+        memo_key = group + (key,)
+
+        future = self._memo.get(memo_key)
+        if future is not None:
+            return future
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._memo[memo_key] = future
+
+        pending = self._pending.get(group)
+        if pending is None:
+            pending = self._pending[group] = {}
+            if self._window > 0:
+                loop.call_later(self._window, self._dispatch, group)
+            else:
+                loop.call_soon(self._dispatch, group)
+
+        pending[key] = future
+
+        return future
+
+    async def get_many(
+            self, table_name: str, keys: t.Iterable[t.Any], key_column: str = 'id',
+            columns: t.Union[t.List[str], t.Tuple, str] = '*'
+    ) -> t.List[t.Optional[t.Tuple]]:
+        """ The rows of ``keys``, in order (``None`` for missing keys) """
+
+        return list(await asyncio.gather(*[self.get(table_name, key, key_column, columns) for key in keys]))
+
+    def prime(
+            self, table_name: str, key: t.Any, row: t.Optional[t.Tuple], key_column: str = 'id',
+            columns: t.Union[t.List[str], t.Tuple, str] = '*'
+    ) -> None:
+        """ Memoizes a row fetched elsewhere, so ``get`` does not query it again """
+
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(row)
+        self._memo[self._group(table_name, key_column, columns) + (key,)] = future
+
+    def clear(self, table_name: t.Optional[str] = None) -> None:
+        """ Forgets memoized rows, of one table or all of them, e.g. after writing to it """
+
+        self._memo = {
+            memo_key: future for memo_key, future in self._memo.items()
+            if table_name is not None and memo_key[0] != table_name
+        }
+
+    def _dispatch(self, group: t.Tuple) -> None:
+        pending = self._pending.pop(group, None)
+        if pending:
+            asyncio.ensure_future(self._load(group, pending))
+
+    async def _load(self, group: t.Tuple, pending: t.Dict[t.Any, asyncio.Future]) -> None:
+        table_name, key_column, columns = group
+        self.batches += 1
+        self.keys_loaded += len(pending)
+
+        try:
+            rows = await asyncio.get_running_loop().run_in_executor(
+                self._executor, lambda: self._crud.select_many(
+                    table_name, key_column, list(pending), columns=columns, chunk_size=self._max_batch_size,
+                    missing='none'
+                )
+            )
+        except Exception as e:
+            for key, future in pending.items():
+                # Failed keys are not memoized, so a later get retries them.
+                self._memo.pop(group + (key,), None)
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for key, future in pending.items():
+            if not future.done():
+                future.set_result(rows.get(key))
+
+    def close(self) -> None:
+        if self._owns_executor:
+            self._executor.shutdown(wait=True)
+
+    async def __aenter__(self) -> 'DataLoader':
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        self.close()
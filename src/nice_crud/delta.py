@@ -0,0 +1,90 @@
+import datetime
+import typing as t
+
+
+STRATEGIES = ('xmin', 'column')
+
+# Transaction ids are 32 bit on disk and compared modulo 2^32; only the last 2^31 of them are comparable.
+XID_MODULO = 1 << 32
+XID_HORIZON = 1 << 31
+
+SNAPSHOT_SQL = '''
+    SELECT pg_catalog.pg_snapshot_xmin(pg_catalog.pg_current_snapshot())::text::bigint,
+           pg_catalog.pg_snapshot_xmax(pg_catalog.pg_current_snapshot())::text::bigint
+'''
+
+# Read before the snapshot is taken: the start of the oldest transaction that has written something and may not be
+# committed yet, or now if there is none. Rows written later are stamped (``clock_timestamp()``) after this bound.
+HOLDBACK_SQL = '''
+    SELECT least(min(xact_start), statement_timestamp())
+    FROM pg_catalog.pg_stat_activity WHERE backend_xid IS NOT NULL AND pid <> pg_backend_pid()
+'''
+
+
+def xmin_condition(watermark: int, xmax: int) -> str:
+    """
+    Rows last written by a transaction whose 64 bit id is at least ``watermark``.
+
+    ``xmin`` is a 32 bit id; its distance to the snapshot's ``xmax`` (a 64 bit id) is taken modulo 2^32, which is
+    exact for every row not frozen yet, since those are never more than 2^31 transactions old. A frozen row keeps its
+    original ``xmin``, which may alias a recent id after a wraparound: such rows can be returned again, never missed.
+    """
+
+    return f'mod({xmax % XID_MODULO} - xmin::text::bigint + {XID_MODULO}, {XID_MODULO}) <= {xmax - watermark}'
+
+
+def column_watermark(maximum: t.Any, bound: t.Optional[datetime.datetime]) -> t.Any:
+    """
+    The next watermark of the column strategy: the greatest value read, held back for timestamps to just before
+    ``bound`` (read by ``HOLDBACK_SQL``), since transactions running at that time may commit rows with earlier
+    timestamps than the ones read, after the snapshot.
+    """
+
+    if bound is not None and isinstance(maximum, datetime.datetime):
+        if maximum.tzinfo is None:
+            bound = bound.replace(tzinfo=None)
+        if bound <= maximum:
+            return bound - datetime.timedelta(microseconds=1)
+
+    return maximum
+
+
+class ChangedRows:
+    """
+    The rows returned by ``PostgresCrud.select_changed_since``: iterate it for lists of up to ``batch_size`` rows.
+
+    ``watermark`` is the value to persist and pass to the next call; ``full`` tells whether the whole table is
+    returned (first run, or a watermark too old to compare). The rows are read through a server-side cursor on a
+    dedicated connection, closed once exhausted; use it as a context manager (or call ``close``) when stopping early.
+    """
+
+    def __init__(self, conn, cursor, watermark: t.Any, full: bool, batch_size: int):
+        self._conn = conn
+        self._cursor = cursor
+        self._batch_size = batch_size
+
+        self.watermark = watermark
+        self.full = full
+        self.rows = 0
+
+    def __iter__(self) -> t.Iterator[t.List[t.Tuple]]:
+        try:
+            while self._cursor is not None:
+                batch = self._cursor.fetchmany(self._batch_size)
+                if not batch:
+                    break
+                self.rows += len(batch)
+                yield batch
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = self._cursor = None
+
+    def __enter__(self) -> 'ChangedRows':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
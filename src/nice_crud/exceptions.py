@@ -40,3 +40,19 @@ class WrongMethodException(NiceCRUDException):
 
 class WrongTypeException(NiceCRUDException):
     """ Exception for wrong type """
+
+
+class ReadTimeoutException(ReadException):
+    """ Exception for read operations stopped by `statement_timeout` or `lock_timeout` """
+
+
+class WriteTimeoutException(WriteException):
+    """ Exception for write operations stopped by `statement_timeout` or `lock_timeout` """
+
+
+class ReadCancelledException(ReadException):
+    """ Exception for read operations cancelled through a `CancelHandle` """
+
+
+class WriteCancelledException(WriteException):
+    """ Exception for write operations cancelled through a `CancelHandle` """
@@ -0,0 +1,211 @@
+import collections
+import select
+import threading
+import time
+import typing as t
+
+
+# Notification kinds: ``data`` for row changes, ``ddl`` for schema changes, which also invalidate the catalog.
+KINDS = ('data', 'ddl')
+
+# Statements notified as ``ddl``.
+DDL_KEYWORDS = ('CREATE', 'ALTER', 'DROP', 'COMMENT')
+
+
+def statement_kind(sql: str) -> str:
+    """ The notification kind of a write, from the first keyword of its first statement other than ``SET`` """
+
+    for statement in sql.split(';'):
+        words = statement.lstrip(' \t\n(').split(None, 1)
+        if words and words[0].upper() != 'SET':
+            return 'ddl' if words[0].upper() in DDL_KEYWORDS else 'data'
+
+    return 'data'
+
+
+def payload(kind: str, table_name: str) -> str:
+    return f'{kind}:{table_name}'
+
+
+def parse_payload(text: str) -> t.Tuple[str, str]:
+    """ ``(kind, table_name)`` of a notification; payloads without a known kind are read as ``data`` """
+
+    kind, separator, table_name = text.partition(':')
+
+    return (kind, table_name) if separator and kind in KINDS else ('data', text)
+
+
+class SelectCache:
+    """
+    In-process LRU cache of ``select`` results, grouped by table so a write to a table evicts all of its entries.
+
+    Every table has a generation counter that is bumped on invalidation. A result is only stored if the generation
+    did not change while the query ran, so a select racing with an invalidation can not re-insert stale rows.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: t.Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._entries: t.Dict[t.Tuple, t.Tuple[float, t.Any]] = collections.OrderedDict()
+        self._by_table: t.Dict[str, t.Set[t.Tuple]] = collections.defaultdict(set)
+        self._generations: t.Dict[str, int] = collections.defaultdict(int)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def generation(self, table_name: str) -> int:
+        with self._lock:
+            return self._generations[table_name]
+
+    def get(self, table_name: str, key: t.Hashable) -> t.Tuple[bool, t.Any]:
+        """
+        :return: ``(True, rows)`` on a hit, ``(False, None)`` otherwise.
+        :rtype: t.Tuple[bool, t.Any]
+        """
+
+        entry_key = (table_name, key)
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[0] < self.ttl):
+                self._entries.move_to_end(entry_key)
+                self.hits += 1
+                return True, entry[1]
+
+            if entry is not None:
+                self._remove(entry_key)
+            self.misses += 1
+
+        return False, None
+
+    def put(self, table_name: str, key: t.Hashable, value: t.Any, generation: int) -> None:
+        entry_key = (table_name, key)
+        with self._lock:
+            if self._generations[table_name] != generation:
+                return
+
+            self._entries[entry_key] = (time.monotonic(), value)
+            self._entries.move_to_end(entry_key)
+            self._by_table[table_name].add(entry_key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_key: t.Tuple) -> None:
+        del self._entries[entry_key]
+        keys = self._by_table.get(entry_key[0])
+        if keys is not None:
+            keys.discard(entry_key)
+            if not keys:
+                del self._by_table[entry_key[0]]
+        self.evictions += 1
+
+    def invalidate(self, tables: t.Optional[t.Iterable[str]] = None) -> int:
+        """
+        Evicts the entries of ``tables``, or everything if ``tables`` is ``None``.
+
+        :return: The number of evicted entries.
+        :rtype: int
+        """
+
+        with self._lock:
+            if tables is None:
+                tables = list(self._generations) + list(self._by_table)
+
+            evicted = 0
+            for table_name in set(tables):
+                self._generations[table_name] += 1
+                for entry_key in list(self._by_table.get(table_name, ())):
+                    self._remove(entry_key)
+                    evicted += 1
+
+        return evicted
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class InvalidationListener(threading.Thread):
+    """
+    Background thread that ``LISTEN``s on ``channel`` and reports the notified ``(kind, table_name)`` pairs through
+    ``callback``.
+
+    Notifications are collected for ``batch_interval`` seconds after the first one arrives and delivered as one set,
+    so a burst of writes to the same table causes a single eviction. If the listening connection is lost,
+    notifications may have been missed: ``callback(None)`` is called (meaning "invalidate everything") and the
+    listener reconnects.
+    """
+
+    def __init__(
+            self, connect: t.Callable, channel: str, callback: t.Callable[[t.Optional[t.Set[t.Tuple[str, str]]]], None],
+            batch_interval: float = 0.05, poll_interval: float = 1.0, reconnect_interval: float = 1.0
+    ):
+        super().__init__(name=f'nice_crud-invalidation-{channel}', daemon=True)
+        self._connect = connect
+        self._channel = channel
+        self._callback = callback
+        self._batch_interval = batch_interval
+        self._poll_interval = poll_interval
+        self._reconnect_interval = reconnect_interval
+        self._stopped = threading.Event()
+        self._listening = threading.Event()
+
+        self.error: t.Optional[Exception] = None
+        self.received = 0
+        self.batches = 0
+
+    def wait_listening(self, timeout: t.Optional[float] = None) -> bool:
+        """ Blocks until the ``LISTEN`` is active """
+
+        return self._listening.wait(timeout)
+
+    def _drain(self, conn, pending: t.Set[t.Tuple[str, str]]) -> None:
+        conn.poll()
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            pending.add(parse_payload(notify.payload))
+            self.received += 1
+
+    def _listen(self) -> None:
+        conn = self._connect()
+        try:
+            conn.autocommit = True
+            conn.cursor().execute(f'LISTEN "{self._channel}"')
+            self._listening.set()
+
+            while not self._stopped.is_set():
+                if select.select([conn], [], [], self._poll_interval) == ([], [], []):
+                    continue
+
+                pending: t.Set[t.Tuple[str, str]] = set()
+                self._drain(conn, pending)
+
+                deadline = time.monotonic() + self._batch_interval
+                while not self._stopped.is_set():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    if select.select([conn], [], [], remaining) != ([], [], []):
+                        self._drain(conn, pending)
+
+                if pending:
+                    self.batches += 1
+                    self._callback(pending)
+        finally:
+            self._listening.clear()
+            conn.close()
+
+    def run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                self.error = e
+                self._callback(None)
+                self._stopped.wait(self._reconnect_interval)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
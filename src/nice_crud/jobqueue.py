@@ -0,0 +1,86 @@
+import json
+import typing as t
+
+
+def channel(queue_name: str) -> str:
+    """ The ``LISTEN``/``NOTIFY`` channel waking up consumers of a queue """
+
+    return f'{queue_name[:58]}_jobs'
+
+
+def create_sql(queue_name: str) -> str:
+    return f'''
+        CREATE TABLE IF NOT EXISTS "{queue_name}" (
+            id bigserial PRIMARY KEY,
+            payload jsonb NOT NULL,
+            attempts integer NOT NULL DEFAULT 0,
+            enqueued_at timestamptz NOT NULL DEFAULT now(),
+            visible_at timestamptz NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS "{queue_name}_visible_idx" ON "{queue_name}" (visible_at, id)
+    '''
+
+
+def enqueue_sql(queue_name: str) -> str:
+    return f'''
+        SELECT pg_catalog.pg_notify(%(channel)s, '');
+        INSERT INTO "{queue_name}" (payload, visible_at)
+        SELECT payload, now() + %(delay)s * interval '1 second'
+        FROM unnest(%(payloads)s::jsonb[]) WITH ORDINALITY AS u(payload, n)
+        ORDER BY n
+        RETURNING id
+    '''
+
+
+# Locked rows are skipped, not waited for: concurrent consumers each lease a different batch.
+def dequeue_sql(queue_name: str) -> str:
+    return f'''
+        WITH next AS (
+            SELECT id FROM "{queue_name}"
+            WHERE visible_at <= now()
+            ORDER BY visible_at, id
+            LIMIT %(batch)s
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE "{queue_name}" job
+        SET visible_at = now() + %(visibility_timeout)s * interval '1 second', attempts = job.attempts + 1
+        FROM next
+        WHERE job.id = next.id
+        RETURNING job.id, job.payload, job.attempts, job.enqueued_at
+    '''
+
+
+# A job is identified by (id, attempts): once its lease expired and another consumer took it, the first consumer's
+# ack or nack no longer matches.
+def ack_sql(queue_name: str) -> str:
+    return f'''
+        DELETE FROM "{queue_name}"
+        WHERE (id, attempts) IN (SELECT * FROM unnest(%(ids)s::bigint[], %(attempts)s::integer[]))
+        RETURNING id
+    '''
+
+
+def nack_sql(queue_name: str) -> str:
+    return f'''
+        UPDATE "{queue_name}" SET visible_at = now() + %(delay)s * interval '1 second'
+        WHERE (id, attempts) IN (SELECT * FROM unnest(%(ids)s::bigint[], %(attempts)s::integer[]))
+        RETURNING id
+    '''
+
+
+def next_visible_sql(queue_name: str) -> str:
+    return f'SELECT extract(epoch FROM min(visible_at) - now()) FROM "{queue_name}"'
+
+
+def encode(payloads: t.Iterable[t.Any]) -> t.List[str]:
+    return [json.dumps(payload, default=str) for payload in payloads]
+
+
+def job_to_dict(row: t.Tuple) -> t.Dict[str, t.Any]:
+    job_id, payload, attempts, enqueued_at = row
+    return {'id': job_id, 'payload': payload, 'attempts': attempts, 'enqueued_at': enqueued_at}
+
+
+def receipts(jobs: t.Iterable[t.Dict[str, t.Any]]) -> t.Dict[str, t.List[int]]:
+    jobs = list(jobs)
+    return {'ids': [job['id'] for job in jobs], 'attempts': [job['attempts'] for job in jobs]}
@@ -0,0 +1,63 @@
+import json
+import typing as t
+
+
+JsonPath = t.Union[str, t.Sequence[t.Union[str, int]]]
+
+
+def literal(value: t.Any) -> str:
+    """ Quotes a JSON-serializable value as a ``jsonb`` literal """
+
+    return _quote(json.dumps(value, separators=(',', ':'), default=str)) + '::jsonb'
+
+
+def _quote(text: str) -> str:
+    return "'" + text.replace("'", "''") + "'"
+
+
+def _column(column: str) -> str:
+    return column if column.startswith('"') or '(' in column or '->' in column else f'"{column}"'
+
+
+def _keys(path: JsonPath) -> t.List[t.Union[str, int]]:
+    return path.split('.') if type(path) == str else list(path)
+
+
+def contains(column: str, value: t.Any) -> str:
+    """
+    ``column @> value``: the jsonb document contains ``value`` (a dict, list or scalar) at its top level.
+
+    Served by a GIN index with either ``jsonb_ops`` or ``jsonb_path_ops``.
+    """
+
+    return f'{_column(column)} @> {literal(value)}'
+
+
+def has_key(column: str, key: str, path_ops: bool = False) -> str:
+    """
+    The jsonb document has the top-level key ``key``.
+
+    Emits ``column ? key``, which a default (``jsonb_ops``) GIN index serves. A ``jsonb_path_ops`` index does not
+    support ``?``; with ``path_ops=True`` the equivalent jsonpath test ``column @? '$."key"'`` is emitted instead.
+    """
+
+    if path_ops:
+        return f'{_column(column)} @? {_quote("$." + json.dumps(key))}'
+
+    return f'{_column(column)} ? {_quote(key)}'
+
+
+def path_equals(column: str, path: JsonPath, value: t.Any) -> str:
+    """
+    The value at ``path`` (``'a.b.c'`` or a sequence of keys) equals ``value``.
+
+    Written as a containment test on the nested document (``column @> '{"a": {"b": {"c": value}}}'``) instead of
+    ``column #>> '{a,b,c}' = ...``, so both GIN opclasses can serve it. Integer path elements index into arrays; as
+    containment, ``[value]`` matches when any element of the array equals ``value``.
+    """
+
+    document = value
+    for key in reversed(_keys(path)):
+        document = [document] if type(key) == int else {key: document}
+
+    return contains(column, document)
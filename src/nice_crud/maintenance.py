@@ -0,0 +1,85 @@
+import typing as t
+
+
+HEALTH_SQL = '''
+    WITH widths AS (
+        SELECT s.tablename, sum(s.avg_width) AS row_width
+        FROM pg_catalog.pg_stats s
+        WHERE s.schemaname = current_schema()
+        GROUP BY s.tablename
+    )
+    SELECT t.relname,
+           t.n_live_tup,
+           t.n_dead_tup,
+           t.n_mod_since_analyze,
+           c.relpages::bigint,
+           c.reltuples::bigint,
+           w.row_width,
+           current_setting('block_size')::int,
+           pg_catalog.pg_relation_size(t.relid),
+           pg_catalog.pg_total_relation_size(t.relid),
+           t.last_vacuum,
+           t.last_autovacuum,
+           t.last_analyze,
+           t.last_autoanalyze,
+           coalesce((
+               SELECT json_object_agg(i.indexrelname, pg_catalog.pg_relation_size(i.indexrelid))
+               FROM pg_catalog.pg_stat_user_indexes i
+               WHERE i.relid = t.relid
+           ), '{}'::json)
+    FROM pg_catalog.pg_stat_user_tables t
+    JOIN pg_catalog.pg_class c ON c.oid = t.relid
+    LEFT JOIN widths w ON w.tablename = t.relname
+    WHERE t.schemaname = current_schema() AND (%(table)s IS NULL OR t.relname = %(table)s)
+    ORDER BY t.relname
+'''
+
+# Per-row overhead on a heap page: 23 byte tuple header (padded to 24) plus the 4 byte line pointer.
+ROW_OVERHEAD = 28
+PAGE_HEADER = 24
+
+
+def estimate_bloat(relpages: int, reltuples: int, row_width: t.Optional[int], block_size: int) -> t.Optional[int]:
+    """
+    Estimates the wasted bytes of a heap: its size minus the pages its live rows would need when tightly packed.
+
+    Uses the average column widths from ``pg_stats``, so it needs an analyzed table and ignores alignment padding and
+    fillfactor; treat it as an order of magnitude.
+
+    :return: The estimated bloat in bytes, ``None`` without statistics.
+    :rtype: t.Optional[int]
+    """
+
+    if row_width is None or reltuples is None or reltuples < 0:
+        return None
+
+    rows_per_page = max((block_size - PAGE_HEADER) // (ROW_OVERHEAD + int(row_width)), 1)
+    expected_pages = -(-reltuples // rows_per_page)
+
+    return max(relpages - expected_pages, 0) * block_size
+
+
+def health_row_to_dict(row: t.Tuple) -> t.Dict[str, t.Any]:
+    (
+        table_name, live, dead, modified, relpages, reltuples, row_width, block_size, table_size, total_size,
+        last_vacuum, last_autovacuum, last_analyze, last_autoanalyze, indexes,
+    ) = row
+
+    bloat = estimate_bloat(relpages, reltuples, row_width, block_size)
+
+    return {
+        'table_name': table_name,
+        'live_tuples': live,
+        'dead_tuples': dead,
+        'dead_ratio': dead / (live + dead) if live + dead else 0.0,
+        'modified_since_analyze': modified,
+        'table_size': table_size,
+        'total_size': total_size,
+        'estimated_bloat': bloat,
+        'estimated_bloat_ratio': bloat / table_size if bloat is not None and table_size else None,
+        'last_vacuum': last_vacuum,
+        'last_autovacuum': last_autovacuum,
+        'last_analyze': last_analyze,
+        'last_autoanalyze': last_autoanalyze,
+        'index_sizes': dict(indexes),
+    }
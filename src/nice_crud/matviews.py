@@ -0,0 +1,178 @@
+import threading
+import time
+import typing as t
+
+
+BASE_TABLES_SQL = '''
+    SELECT DISTINCT c.relname
+    FROM pg_catalog.pg_rewrite r
+    JOIN pg_catalog.pg_depend d
+      ON d.objid = r.oid
+     AND d.classid = 'pg_catalog.pg_rewrite'::regclass
+     AND d.refclassid = 'pg_catalog.pg_class'::regclass
+    JOIN pg_catalog.pg_class c ON c.oid = d.refobjid
+    WHERE r.ev_class = to_regclass(%s) AND c.oid <> r.ev_class AND c.relkind IN ('r', 'p', 'm')
+'''
+
+MODIFICATIONS_SQL = '''
+    SELECT coalesce(sum(n_tup_ins + n_tup_upd + n_tup_del), 0)
+    FROM pg_catalog.pg_stat_user_tables
+    WHERE schemaname = current_schema() AND relname = ANY(%s)
+'''
+
+
+def refresh_sql(name: str, concurrently: bool) -> str:
+    return f'REFRESH MATERIALIZED VIEW{" CONCURRENTLY" if concurrently else ""} "{name}"'
+
+
+class RefreshStats:
+    """
+    Thread-safe refresh metrics of materialized views: ``last_refresh`` (epoch seconds), ``last_duration``,
+    ``refresh_count``, ``error_count`` and ``last_error``. ``staleness`` - seconds since the last successful refresh -
+    is computed when read.
+    """
+
+    def __init__(self):
+        self._views: t.Dict[str, t.Dict[str, t.Any]] = {}
+        self._lock = threading.Lock()
+
+    def _view(self, name: str) -> t.Dict[str, t.Any]:
+        return self._views.setdefault(name, {
+            'last_refresh': None, 'last_duration': None, 'refresh_count': 0, 'error_count': 0, 'last_error': None,
+        })
+
+    def record(self, name: str, duration: float) -> None:
+        with self._lock:
+            view = self._view(name)
+            view['last_refresh'] = time.time()
+            view['last_duration'] = duration
+            view['refresh_count'] += 1
+
+    def record_error(self, name: str, error: Exception) -> None:
+        with self._lock:
+            view = self._view(name)
+            view['error_count'] += 1
+            view['last_error'] = str(error)
+
+    def snapshot(self, name: t.Optional[str] = None) -> t.Dict[str, t.Any]:
+        now = time.time()
+        with self._lock:
+            views = {
+                view_name: dict(
+                    view, staleness=None if view['last_refresh'] is None else now - view['last_refresh']
+                ) for view_name, view in self._views.items() if name is None or view_name == name
+            }
+
+        return views if name is None else views.get(name, {})
+
+
+class RefreshScheduler(threading.Thread):
+    """
+    Background thread refreshing materialized views on an interval and/or when their base tables changed.
+
+    Changes are detected from the ``n_tup_ins + n_tup_upd + n_tup_del`` counters of ``pg_stat_user_tables`` for the
+    tables the view depends on. Backends report these counters with a delay - about a second for busy sessions, up to
+    ten seconds for sessions going idle (PostgreSQL 15+) - so a change-triggered refresh lags the write accordingly.
+
+    Refreshes run on the scheduler's own autocommit connection, so they never block the instance's connection.
+    """
+
+    def __init__(
+            self, connect: t.Callable, stats: RefreshStats, tick: float = 1.0,
+            on_refresh: t.Optional[t.Callable[[str, t.Any], None]] = None
+    ):
+        super().__init__(name='nice_crud-matview-refresh', daemon=True)
+        self._connect = connect
+        self._stats = stats
+        self._tick = tick
+        self._on_refresh = on_refresh
+        self._views: t.Dict[str, t.Dict[str, t.Any]] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        self.error: t.Optional[Exception] = None
+
+    def add(
+            self, name: str, interval: t.Optional[float] = None, on_change: bool = False, min_interval: float = 0.0,
+            concurrently: bool = True
+    ) -> None:
+        if interval is None and not on_change:
+            raise ValueError('interval and/or on_change must be set')
+
+        with self._lock:
+            self._views[name] = {
+                'interval': interval, 'on_change': on_change, 'min_interval': min_interval,
+                'concurrently': concurrently, 'tables': None, 'modifications': None, 'last_run': time.monotonic(),
+            }
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            self._views.pop(name, None)
+
+    def _due(self, cur, name: str, view: t.Dict[str, t.Any], now: float) -> bool:
+        changed = False
+        if view['on_change']:
+            if view['tables'] is None:
+                cur.execute(BASE_TABLES_SQL, (f'"{name}"',))
+                view['tables'] = [row[0] for row in cur.fetchall()]
+
+            cur.execute(MODIFICATIONS_SQL, (view['tables'],))
+            view['observed'] = cur.fetchone()[0]
+            if view['modifications'] is None:
+                view['modifications'] = view['observed']
+            changed = view['observed'] != view['modifications']
+
+        elapsed = now - view['last_run']
+        if view['interval'] is not None and elapsed >= view['interval']:
+            return True
+
+        return changed and elapsed >= view['min_interval']
+
+    def _refresh(self, cur, name: str, view: t.Dict[str, t.Any]) -> None:
+        started = time.perf_counter()
+        try:
+            cur.execute(refresh_sql(name, view['concurrently']))
+        except Exception as e:
+            self._stats.record_error(name, e)
+            return
+        finally:
+            view['last_run'] = time.monotonic()
+
+        # The counters were read before the refresh, so changes made while it ran trigger the next one.
+        if view['on_change']:
+            view['modifications'] = view['observed']
+
+        self._stats.record(name, time.perf_counter() - started)
+        if self._on_refresh is not None:
+            self._on_refresh(name, cur)
+
+    def run(self) -> None:
+        conn = None
+        try:
+            conn = self._connect()
+            conn.autocommit = True
+            cur = conn.cursor()
+
+            while not self._stopped.wait(self._tick):
+                with self._lock:
+                    views = list(self._views.items())
+
+                for name, view in views:
+                    if self._stopped.is_set():
+                        break
+                    try:
+                        due = self._due(cur, name, view, time.monotonic())
+                    except Exception as e:
+                        self._stats.record_error(name, e)
+                        continue
+                    if due:
+                        self._refresh(cur, name, view)
+        except Exception as e:
+            self.error = e
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
@@ -0,0 +1,194 @@
+import datetime
+import re
+import typing as t
+
+
+class PartitionManager:
+    """
+    Keeps a range-partitioned table supplied with time partitions.
+
+    Partitions cover one ``interval`` each and are named ``<table>_p<start>`` (e.g. ``events_p20240131`` for daily
+    partitions). :meth:`run_maintenance` pre-creates the partition for the current period plus ``premake`` upcoming
+    ones, so inserts through ``insert``/``insert_from_dict`` and the bulk paths are routed by Postgres straight into an
+    existing partition, and detaches/drops partitions older than ``retention`` periods, which turns deleting old data
+    into a metadata operation instead of a bulk ``DELETE``.
+
+    Only partitions following the naming scheme are touched; the optional default partition is never expired.
+
+    Usage::
+
+        crud.create_table('events', {...}, partition_type=PartitionTypes.Range, partition_key='created_at')
+        manager = PartitionManager(crud, 'events', interval='day', premake=7, retention=30)
+        manager.run_maintenance()  # e.g. from a cron job
+    """
+
+    INTERVALS = ('hour', 'day', 'week', 'month', 'year')
+
+    __FORMATS = {
+        'hour': '%Y%m%d%H',
+        'day': '%Y%m%d',
+        'week': '%Y%m%d',
+        'month': '%Y%m',
+        'year': '%Y',
+    }
+
+    def __init__(
+            self, crud, table_name: str, interval: str = 'day', premake: int = 3,
+            retention: t.Optional[int] = None, drop_expired: bool = True, detach_concurrently: bool = False,
+            default_partition: bool = False
+    ):
+        """
+        :param crud: The ``PostgresCrud`` instance to run the DDL with.
+        :type crud: PostgresCrud
+
+        :param table_name: The range-partitioned parent table (partitioned by a date/timestamp column).
+        :type table_name: str
+
+        :param interval: The span of one partition, one of :attr:`INTERVALS`.
+        :type interval: str
+
+        :param premake: How many partitions to create ahead of the current one.
+        :type premake: int
+
+        :param retention: How many past partitions (besides the current one) to keep; ``None`` keeps everything.
+        :type retention: t.Optional[int]
+
+        :param drop_expired: Drop expired partitions after detaching them, instead of leaving them as plain tables.
+        :type drop_expired: bool
+
+        :param detach_concurrently: Detach with ``DETACH PARTITION ... CONCURRENTLY`` (PostgreSQL 14+).
+        :type detach_concurrently: bool
+
+        :param default_partition: Also create a ``<table>_default`` partition catching rows outside every range.
+        :type default_partition: bool
+        """
+
+        if interval not in self.INTERVALS:
+            raise ValueError(f'interval must be one of {self.INTERVALS}: {interval}')
+
+        self._crud = crud
+        self._table_name = table_name
+        self._interval = interval
+        self._premake = premake
+        self._retention = retention
+        self._drop_expired = drop_expired
+        self._detach_concurrently = detach_concurrently
+        self._default_partition = default_partition
+
+        self._name_pattern = re.compile(rf'^{re.escape(table_name)}_p(\d+)$')
+
+    def floor(self, value: datetime.datetime) -> datetime.datetime:
+        """ Returns the start of the period containing ``value`` """
+
+        if not isinstance(value, datetime.datetime):
+            value = datetime.datetime(value.year, value.month, value.day)
+
+        value = value.replace(minute=0, second=0, microsecond=0)
+
+        if self._interval == 'hour':
+            return value
+
+        value = value.replace(hour=0)
+        if self._interval == 'week':
+            return value - datetime.timedelta(days=value.weekday())
+        if self._interval == 'month':
+            return value.replace(day=1)
+        if self._interval == 'year':
+            return value.replace(month=1, day=1)
+
+        return value
+
+    def shift(self, start: datetime.datetime, periods: int) -> datetime.datetime:
+        """ Moves a period start by ``periods`` intervals (negative values go back in time) """
+
+        if self._interval == 'hour':
+            return start + datetime.timedelta(hours=periods)
+        if self._interval == 'day':
+            return start + datetime.timedelta(days=periods)
+        if self._interval == 'week':
+            return start + datetime.timedelta(weeks=periods)
+        if self._interval == 'year':
+            return start.replace(year=start.year + periods)
+
+        month = start.month - 1 + periods
+        return start.replace(year=start.year + month // 12, month=month % 12 + 1)
+
+    def partition_name(self, start: datetime.datetime) -> str:
+        return f'{self._table_name}_p{start.strftime(self.__FORMATS[self._interval])}'
+
+    def route(self, value: datetime.datetime) -> str:
+        """
+        Returns the name of the partition holding ``value``, so bulk loads can target it directly.
+        """
+
+        return self.partition_name(self.floor(value))
+
+    def ensure_partition(self, value: datetime.datetime) -> str:
+        """
+        Creates the partition covering ``value`` if it does not exist yet.
+
+        :return: The partition name.
+        :rtype: str
+        """
+
+        start = self.floor(value)
+        name = self.partition_name(start)
+        self._crud.create_partition(
+            self._table_name, name, from_value=start, to_value=self.shift(start, 1)
+        )
+
+        return name
+
+    def existing_partitions(self) -> t.Dict[str, datetime.datetime]:
+        """
+        Returns the managed partitions of the table mapped to the start of their period.
+        """
+
+        partitions = {}
+        for name, _ in self._crud.list_partitions(self._table_name):
+            match = self._name_pattern.match(name)
+            if match is not None:
+                partitions[name] = datetime.datetime.strptime(match.group(1), self.__FORMATS[self._interval])
+
+        return partitions
+
+    def run_maintenance(self, now: t.Optional[datetime.datetime] = None) -> t.Dict[str, t.List[str]]:
+        """
+        Creates the upcoming partitions and detaches (and drops) the expired ones.
+
+        :param now: The reference time, defaults to ``datetime.datetime.now()``. Bounds are written as timestamps
+            without time zone, so for ``timestamptz`` keys they are interpreted in the session time zone.
+        :type now: t.Optional[datetime.datetime]
+
+        :return: The names of the ``created``, ``detached`` and ``dropped`` partitions.
+        :rtype: t.Dict[str, t.List[str]]
+        """
+
+        current = self.floor(now or datetime.datetime.now())
+        existing = self.existing_partitions()
+        report = {'created': [], 'detached': [], 'dropped': []}
+
+        if self._default_partition:
+            self._crud.create_partition(self._table_name, f'{self._table_name}_default', default=True)
+
+        for offset in range(self._premake + 1):
+            start = self.shift(current, offset)
+            name = self.partition_name(start)
+            if name not in existing:
+                self._crud.create_partition(self._table_name, name, from_value=start, to_value=self.shift(start, 1))
+                report['created'].append(name)
+
+        if self._retention is not None:
+            cutoff = self.shift(current, -self._retention)
+            for name, start in sorted(existing.items(), key=lambda item: item[1]):
+                if start >= cutoff:
+                    continue
+
+                self._crud.detach_partition(self._table_name, name, concurrently=self._detach_concurrently)
+                report['detached'].append(name)
+
+                if self._drop_expired:
+                    self._crud.drop_table(name)
+                    report['dropped'].append(name)
+
+        return report
@@ -0,0 +1,81 @@
+import threading
+import typing as t
+
+
+PROGRESS_SQL = '''
+    SELECT phase, blocks_total, blocks_done, tuples_total, tuples_done,
+           lockers_total, lockers_done, partitions_total, partitions_done
+    FROM pg_catalog.pg_stat_progress_create_index
+    WHERE pid = %s
+'''
+
+_PROGRESS_FIELDS = (
+    'phase', 'blocks_total', 'blocks_done', 'tuples_total', 'tuples_done',
+    'lockers_total', 'lockers_done', 'partitions_total', 'partitions_done',
+)
+
+
+def progress_row_to_dict(row: t.Tuple) -> t.Dict[str, t.Any]:
+    """
+    Converts a ``pg_stat_progress_create_index`` row to a dict and adds a ``percent`` estimate for the current phase.
+    """
+
+    progress = dict(zip(_PROGRESS_FIELDS, row))
+
+    if progress['blocks_total']:
+        progress['percent'] = round(100.0 * progress['blocks_done'] / progress['blocks_total'], 2)
+    elif progress['tuples_total']:
+        progress['percent'] = round(100.0 * progress['tuples_done'] / progress['tuples_total'], 2)
+    elif progress['lockers_total']:
+        progress['percent'] = round(100.0 * progress['lockers_done'] / progress['lockers_total'], 2)
+    else:
+        progress['percent'] = None
+
+    return progress
+
+
+class IndexProgressPoller(threading.Thread):
+    """
+    Background thread that polls ``pg_stat_progress_create_index`` for one backend and reports every change of the
+    row through ``callback``.
+
+    It uses its own connection because the connection running the build is blocked for the whole build.
+    """
+
+    def __init__(
+            self, connect: t.Callable, pid: int, callback: t.Callable[[t.Dict[str, t.Any]], None],
+            interval: float = 1.0
+    ):
+        super().__init__(name=f'nice_crud-index-progress-{pid}', daemon=True)
+        self._connect = connect
+        self._pid = pid
+        self._callback = callback
+        self._interval = interval
+        self._stopped = threading.Event()
+
+        self.error: t.Optional[Exception] = None
+
+    def run(self) -> None:
+        conn = None
+        last = None
+
+        try:
+            conn = self._connect()
+            conn.autocommit = True
+            cur = conn.cursor()
+
+            while not self._stopped.wait(self._interval):
+                cur.execute(PROGRESS_SQL, (self._pid,))
+                row = cur.fetchone()
+                if row is not None and row != last:
+                    last = row
+                    self._callback(progress_row_to_dict(row))
+        except Exception as e:
+            self.error = e
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
@@ -1,8 +1,25 @@
+import concurrent.futures
+import datetime
+import os
+import select
+import threading
+import time
 import typing as t
 
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.extras
 
-from . import exceptions
+from . import (
+    advisor, arrow, bulk, cdc, delta, exceptions, invalidation, jobqueue, jsonb, maintenance, matviews, spill, swap,
+)
+from .buffer import WriteBuffer
+from .cancel import CancelHandle
+from .catalog import COLUMN_TYPE_SQL, CatalogSnapshot, column_spec_to_dict
+from .constants import IndexTypes
+from .invalidation import InvalidationListener, SelectCache
+from .progress import IndexProgressPoller
 
 
 class PostgresCrud:
@@ -26,9 +43,33 @@ class PostgresCrud:
 
     __INDEX_TYPES = ['btree', 'hash', 'gist', 'gin', 'spgist', 'brin', 'b-tree', 'sp-gist']
 
+    __PARTITION_TYPES = ['range', 'list', 'hash']
+
+    __AGGREGATES = [
+        'count', 'min', 'max', 'avg', 'sum', 'stddev', 'variance', 'bool_and', 'bool_or', 'array_agg', 'string_agg',
+    ]
+
     def __init__(
-            self, dbname: str, user: str, password: str, host: str, port: int, close_conn: bool = False
+            self, dbname: str, user: str, password: str, host: str, port: int, close_conn: bool = False,
+            catalog_cache: bool = False, timeout: t.Optional[float] = None, lock_timeout: t.Optional[float] = None,
+            memory_budget: t.Optional[int] = None, fetch_size: int = 2000
     ):
+        """
+        :param timeout: Default ``statement_timeout`` in seconds for every query, overridable per call.
+        :type timeout: t.Optional[float]
+
+        :param lock_timeout: Default ``lock_timeout`` in seconds for every query, overridable per call.
+        :type lock_timeout: t.Optional[float]
+
+        :param memory_budget: Default bound, in bytes, of the rows a ``select`` or ``manual_query`` read keeps in
+            memory, overridable per call (see ``select``); ``None`` fetches results whole. Internal lookups (catalog,
+            advisors, replication slots) always fetch whole.
+        :type memory_budget: t.Optional[int]
+
+        :param fetch_size: Rows fetched per round trip by reads with a memory budget.
+        :type fetch_size: int
+        """
+
         self._dbname = dbname
         self._user = user
         self._password = password
@@ -36,8 +77,37 @@ class PostgresCrud:
         self._port = port
 
         self._conn = None
+        self._conn_pid = None
         self._close_conn = close_conn
 
+        self._catalog_cache = catalog_cache
+        self._catalog: t.Optional[CatalogSnapshot] = None
+        self._column_types: t.Dict[t.Tuple[str, str], str] = {}
+
+        self._memory_budget = memory_budget
+        self._fetch_size = fetch_size
+        self.last_query_metrics: t.Optional[t.Dict[str, t.Any]] = None
+
+        self._write_buffer: t.Optional[WriteBuffer] = None
+
+        self._select_cache: t.Optional[SelectCache] = None
+        self._notify_channel: t.Optional[str] = None
+        self._listener: t.Optional[InvalidationListener] = None
+
+        self._refresh_stats = matviews.RefreshStats()
+
+        self._auto_analyze: t.Optional[t.Tuple[float, int]] = None
+        self._background_drops: t.List[threading.Thread] = []
+        self._queue_listeners: t.Dict[str, t.Any] = {}
+        self._changed_rows: t.Dict[str, int] = {}
+        self._refresh_scheduler: t.Optional[matviews.RefreshScheduler] = None
+
+        self._timeout = timeout
+        self._lock_timeout = lock_timeout
+        self._cancel_lock = threading.Lock()
+        self._in_flight = False
+        self._cancel_requested = False
+
     def _db_data_to_dict(self) -> t.Dict:
         return {
             'db_name': self._dbname,
@@ -47,21 +117,44 @@ class PostgresCrud:
             'db_port': self._port
         }
 
+    def _new_connection(self):
+        """
+        Opens a dedicated connection that is not shared with the cached ``_conn``.
+
+        Used for work that cannot run on the shared connection, e.g. statements that must run outside a transaction
+        block or monitoring queries issued while ``_conn`` is busy. The caller is responsible for closing it.
+        """
+
+        try:
+            return psycopg2.connect(
+                dbname=self._dbname,
+                user=self._user,
+                password=self._password,
+                host=self._host,
+                port=self._port
+            )
+        except Exception as e:
+            raise exceptions.ConnectionException(
+                func_name='connect', message=f'Connection Error: {e}', db_data=self._db_data_to_dict()
+            )
+
+    def _connection_kwargs(self) -> t.Dict[str, t.Any]:
+        return {
+            'dbname': self._dbname,
+            'user': self._user,
+            'password': self._password,
+            'host': self._host,
+            'port': self._port,
+        }
+
     def _connect(self):
+        if self._conn is not None and self._conn_pid != os.getpid():
+            # The connection was inherited through a fork: never use (or close) the parent's socket from the child.
+            self._conn = None
+
         if self._conn is None:
-            try:
-                self._conn = psycopg2.connect(
-                    dbname=self._dbname,
-                    user=self._user,
-                    password=self._password,
-                    host=self._host,
-                    port=self._port
-                )
-                return self._conn
-            except Exception as e:
-                raise exceptions.ConnectionException(
-                    func_name='connect', message=f'Connection Error: {e}', db_data=self._db_data_to_dict()
-                )
+            self._conn = self._new_connection()
+            self._conn_pid = os.getpid()
 
         return self._conn
 
@@ -75,19 +168,310 @@ class PostgresCrud:
                 )
         return True
 
-    def _execute(self, func_name: str, sql: str, type_: str, func_params, **kwargs):
-        __locals__ = locals()
-        __locals__.pop('self')
+    def close(self) -> None:
+        """
+        Flushes and stops the write buffer and stops the background threads, if enabled, then closes the connection.
+        The connections are closed even when the final flush fails; its ``WriteException`` is raised afterwards.
+        """
+
+        try:
+            if self._write_buffer is not None:
+                write_buffer, self._write_buffer = self._write_buffer, None
+                write_buffer.close()
+        finally:
+            if self._listener is not None:
+                self._listener.stop()
+                self._listener = None
+
+            if self._refresh_scheduler is not None:
+                self._refresh_scheduler.stop()
+                self._refresh_scheduler = None
+
+            for thread in self._background_drops:
+                thread.join()
+            self._background_drops = []
+
+            for conn in self._queue_listeners.values():
+                conn.close()
+            self._queue_listeners = {}
+
+            try:
+                self._close()
+            finally:
+                self._conn = None
+
+    def enable_write_buffer(
+            self, max_rows: int = 1000, max_bytes: int = 1 << 20, flush_interval: float = 1.0,
+            max_queue_rows: int = 100000, block_timeout: t.Optional[float] = None, max_attempts: int = 3
+    ) -> WriteBuffer:
+        """
+        Enables the write-behind buffer used by ``buffered_insert`` and ``buffered_update``.
+
+        Queued writes are flushed from a background thread on a dedicated connection as batched statements when
+        ``max_rows`` rows or ``max_bytes`` bytes are pending, or every ``flush_interval`` seconds. Writers block when
+        ``max_queue_rows`` rows are pending, for at most ``block_timeout`` seconds. Everything still queued is flushed
+        on ``close()`` and at interpreter exit. Every flush evicts the written tables from the select cache once it
+        commits. A write that fails on its own is retried by the next flushes, then moved to the buffer's
+        ``dead_letters`` after ``max_attempts`` failures, without holding back the others. See ``buffer.WriteBuffer``.
+
+        :return: The buffer.
+        :rtype: WriteBuffer
+        """
+
+        if self._write_buffer is None:
+            self._write_buffer = WriteBuffer(
+                self._new_connection, max_rows=max_rows, max_bytes=max_bytes, flush_interval=flush_interval,
+                max_queue_rows=max_queue_rows, block_timeout=block_timeout, notify_channel=self._notify_channel,
+                on_flush=self.invalidate_cache, max_attempts=max_attempts
+            )
+
+        return self._write_buffer
+
+    def enable_select_cache(self, max_entries: int = 1024, ttl: t.Optional[float] = None) -> SelectCache:
+        """
+        Enables an in-process cache of ``select`` results.
+
+        Entries of a table are evicted when this instance writes to it. To also evict them when other processes or
+        nodes write, call ``enable_invalidation`` on every instance sharing the database. ``manual_query`` writes are
+        not tracked; evict after them with ``invalidate_cache``.
+
+        :param max_entries: The maximum number of cached results, least recently used ones are evicted first.
+        :type max_entries: int
+
+        :param ttl: Optional maximum age of an entry in seconds, as a safety net against missed notifications.
+        :type ttl: t.Optional[float]
+
+        :return: The cache.
+        :rtype: SelectCache
+        """
+
+        if self._select_cache is None:
+            self._select_cache = SelectCache(max_entries=max_entries, ttl=ttl)
+
+        return self._select_cache
+
+    def enable_invalidation(
+            self, channel: str = 'nice_crud_invalidation', listen: bool = True, batch_interval: float = 0.05
+    ) -> t.Optional[InvalidationListener]:
+        """
+        Enables cross-node cache invalidation over ``LISTEN``/``NOTIFY``.
+
+        Every write method then issues ``pg_notify(channel, '<kind>:<table_name>')`` in the transaction of the write,
+        which Postgres delivers to listeners only once the transaction commits. The kind is ``ddl`` for schema changes
+        (``CREATE``, ``ALTER``, ``DROP``, ...) and ``data`` for everything else. With ``listen`` a background thread
+        listens on ``channel`` over a dedicated connection and evicts the notified tables from the select cache; a
+        ``ddl`` notification also drops the catalog snapshot, which is reloaded on next use. Notifications arriving
+        within ``batch_interval`` seconds are deduplicated and applied together.
+
+        :param channel: The notification channel, shared by all instances.
+        :type channel: str
+
+        :param listen: Start the listener; ``False`` only sends notifications (e.g. on write-only workers).
+        :type listen: bool
+
+        :param batch_interval: How long to collect notifications before evicting.
+        :type batch_interval: float
+
+        :return: The listener thread, or ``None`` if ``listen`` is ``False``.
+        :rtype: t.Optional[InvalidationListener]
+        """
+
+        self._notify_channel = channel
+        if self._write_buffer is not None:
+            self._write_buffer.notify_channel = channel
+
+        if listen and self._listener is None:
+            self._listener = InvalidationListener(
+                self._new_connection, channel, self._on_invalidation, batch_interval=batch_interval
+            )
+            self._listener.start()
+            self._listener.wait_listening(timeout=10)
+
+        return self._listener
+
+    def invalidate_cache(self, tables: t.Optional[t.Iterable[str]] = None) -> None:
+        """
+        Evicts ``tables`` (or everything, if ``None``) from the select cache. After DDL, see ``invalidate_catalog``.
+        """
+
+        if self._select_cache is not None:
+            self._select_cache.invalidate(tables)
+
+    def _on_invalidation(self, notifications: t.Optional[t.Set[t.Tuple[str, str]]]) -> None:
+        """ Applies a batch of ``(kind, table_name)`` notifications; ``None`` means some may have been missed """
+
+        if notifications is None:
+            self.invalidate_cache()
+            self.invalidate_catalog()
+            return
+
+        self.invalidate_cache({table_name for _, table_name in notifications})
+        if any(kind == 'ddl' for kind, _ in notifications):
+            self.invalidate_catalog()
+
+    def _notify_write(self, cur, table_name: t.Optional[str], kind: str = 'data') -> None:
+        """ Queues the invalidation notification in the current transaction. Must run before the commit. """
+
+        if self._notify_channel is not None and table_name is not None:
+            cur.execute('SELECT pg_notify(%s, %s)', (self._notify_channel, invalidation.payload(kind, table_name)))
+
+    def _after_write(self, table_name: t.Optional[str]) -> None:
+        if self._select_cache is not None and table_name is not None:
+            self._select_cache.invalidate((table_name,))
+
+    def _notify_committed(self, func_name: str, table_name: str, kind: str = 'data') -> None:
+        """ Publishes a write that was committed on other connections, e.g. by ``parallel_load`` workers. """
+
+        if self._notify_channel is not None:
+            conn = self._connect()
+            try:
+                self._notify_write(conn.cursor(), table_name, kind)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise exceptions.WriteException(func_name=func_name, message=f'{e}', table_name=table_name)
+
+        self._after_write(table_name)
+
+    def _buffer(self, func_name: str) -> WriteBuffer:
+        if self._write_buffer is None:
+            raise exceptions.WrongMethodException(
+                func_name, 'write buffer is not enabled, call `enable_write_buffer` first'
+            )
+
+        return self._write_buffer
+
+    def buffered_insert(self, table_name: str, data: t.Dict, on_conflict: t.Optional[str] = None) -> None:
+        """
+        Queues an ``insert_from_dict`` in the write buffer. The row is written by a later batched flush.
+        """
+
+        self._check_columns('buffered_insert', table_name, data.keys())
+        self._buffer('buffered_insert').insert(table_name, data, on_conflict)
+
+    def buffered_update(self, table_name: str, data: t.Dict, key: t.Dict) -> None:
+        """
+        Queues an update of the row identified by ``key`` (e.g. ``{'id': 42}``) in the write buffer.
+
+        Pending updates of the same key are coalesced, so only the latest value of each column is written.
+        """
+
+        self._check_columns('buffered_update', table_name, list(data) + list(key))
+        self._buffer('buffered_update').update(table_name, data, key)
+
+    def flush(self) -> int:
+        """
+        Flushes the write buffer immediately.
+
+        :return: The number of rows written.
+        :rtype: int
+        """
+
+        return self._buffer('flush').flush()
+
+    @staticmethod
+    def _timeout_prefix(timeout: t.Optional[float], lock_timeout: t.Optional[float]) -> str:
+        """
+        Builds ``SET LOCAL`` statements scoping the timeouts (in seconds) to the current transaction.
+        """
+
+        prefix = ''
+        if timeout is not None:
+            prefix += f'SET LOCAL statement_timeout = {PostgresCrud._milliseconds(timeout)}; '
+        if lock_timeout is not None:
+            prefix += f'SET LOCAL lock_timeout = {PostgresCrud._milliseconds(lock_timeout)}; '
+
+        return prefix
+
+    @staticmethod
+    def _milliseconds(seconds: float) -> int:
+        """ A timeout setting in milliseconds; ``0`` stays ``0`` (no timeout), shorter ones are rounded up to 1 ms """
+
+        return 0 if seconds <= 0 else max(int(seconds * 1000), 1)
+
+    def _begin_statement(self) -> None:
+        with self._cancel_lock:
+            self._in_flight = True
+            self._cancel_requested = False
+
+    def _end_statement(self) -> bool:
+        """ Marks the statement as finished and returns whether it was cancelled through ``cancel()`` """
+
+        with self._cancel_lock:
+            self._in_flight = False
+            cancelled, self._cancel_requested = self._cancel_requested, False
+
+        return cancelled
+
+    def cancel(self) -> bool:
+        """
+        Cancels the statement currently running on this instance's connection, from any thread.
+
+        The cancellation is sent as a protocol-level cancel request over a separate socket, so it does not need the
+        (busy) connection. The interrupted call raises ``ReadCancelledException``/``WriteCancelledException``.
+
+        :return: ``True`` if a statement was running and a cancel request was sent.
+        :rtype: bool
+        """
+
+        with self._cancel_lock:
+            if not self._in_flight or self._conn is None:
+                return False
+            self._cancel_requested = True
+            self._conn.cancel()
+
+        return True
+
+    def cancel_handle(self) -> CancelHandle:
+        """
+        Returns a handle that cancels the running statement, e.g. from a watchdog thread or an asyncio task.
+        """
+
+        return CancelHandle(self)
+
+    def _execute(
+            self, func_name: str, sql: str, type_: str, func_params: t.Optional[t.Dict] = None,
+            params: t.Optional[t.Sequence] = None, timeout: t.Optional[float] = None,
+            lock_timeout: t.Optional[float] = None, table_name: t.Optional[str] = None, returning: bool = False,
+            memory_budget: t.Optional[int] = None, **kwargs
+    ):
+        if memory_budget is not None and type_.upper() == 'READ':
+            self.last_query_metrics = None
+            if spill.is_query(sql):
+                return self._execute_budgeted(func_name, sql, memory_budget, func_params, params, timeout, lock_timeout)
+            started = time.perf_counter()
 
         conn = self._connect()
         cur = conn.cursor()
 
+        timeout = self._timeout if timeout is None else timeout
+        lock_timeout = self._lock_timeout if lock_timeout is None else lock_timeout
+        prefix = self._timeout_prefix(timeout, lock_timeout)
+        if prefix:
+            sql = prefix + sql
+
+        self._begin_statement()
         try:
-            cur.execute(sql)
+            cur.execute(sql, params)
             if type_.upper() == 'WRITE':
-                return conn.commit()
+                rows = cur.rowcount
+                res = cur.fetchall() if returning else None
+                if self._notify_channel is not None:
+                    self._notify_write(cur, table_name, invalidation.statement_kind(sql))
+                conn.commit()
+                self._after_write(table_name)
+                if self._auto_analyze is not None:
+                    self._track_changes(table_name, rows)
+                return res
             elif type_.upper() == 'READ':
                 res = cur.fetchall()
+                if prefix:
+                    # End the transaction so SET LOCAL does not leak into the next statement.
+                    conn.commit()
+                if memory_budget is not None:
+                    # Not a query a server-side cursor accepts: fetched whole, whatever the budget.
+                    size = spill.estimate_size(res)
+                    self.last_query_metrics = self._query_metrics(res, 1, started, memory_budget, size)
                 return res
             else:
                 raise exceptions.WrongTypeException(
@@ -95,12 +479,25 @@ class PostgresCrud:
                 )
         except Exception as e:
             conn.rollback()
+            cancelled = self._end_statement()
             if type_.upper() == 'WRITE':
-                raise exceptions.WriteException(
+                if isinstance(e, psycopg2.errors.QueryCanceled) and cancelled:
+                    exception = exceptions.WriteCancelledException
+                elif isinstance(e, (psycopg2.errors.QueryCanceled, psycopg2.errors.LockNotAvailable)):
+                    exception = exceptions.WriteTimeoutException
+                else:
+                    exception = exceptions.WriteException
+                raise exception(
                     func_name=func_name, message=f'{e}', sql=sql, type_=type_, func_params=func_params
                 )
             elif type_.upper() == 'READ':
-                raise exceptions.ReadException(
+                if isinstance(e, psycopg2.errors.QueryCanceled) and cancelled:
+                    exception = exceptions.ReadCancelledException
+                elif isinstance(e, (psycopg2.errors.QueryCanceled, psycopg2.errors.LockNotAvailable)):
+                    exception = exceptions.ReadTimeoutException
+                else:
+                    exception = exceptions.ReadException
+                raise exception(
                     func_name=func_name, message=f'{e}', sql=sql, type_=type_, func_params=func_params
                 )
             else:
@@ -108,10 +505,103 @@ class PostgresCrud:
                     func_name=func_name, message=f'Unknown type: {type_}', sql=sql,
                 )
 
+        finally:
+            self._end_statement()
+            if self._close_conn:
+                self._close()
+
+    def _execute_budgeted(
+            self, func_name: str, sql: str, memory_budget: int, func_params: t.Optional[t.Dict] = None,
+            params: t.Optional[t.Sequence] = None, timeout: t.Optional[float] = None,
+            lock_timeout: t.Optional[float] = None
+    ) -> t.Union[t.List[t.Tuple], spill.SpilledRows]:
+        """
+        Runs a read through a server-side cursor, fetching ``fetch_size`` rows at a time. Rows are kept in a list
+        until their estimated size exceeds ``memory_budget`` bytes; from then on they are spilled to a memory-mapped
+        ``spill.SpilledRows`` file, which is returned instead. Sets ``last_query_metrics``.
+        """
+
+        conn = self._connect()
+        timeout = self._timeout if timeout is None else timeout
+        lock_timeout = self._lock_timeout if lock_timeout is None else lock_timeout
+        prefix = self._timeout_prefix(timeout, lock_timeout)
+
+        started = time.perf_counter()
+        rows: t.List[t.Tuple] = []
+        store: t.Optional[spill.SpilledRows] = None
+        in_memory = peak_in_memory = batches = 0
+
+        self._begin_statement()
+        try:
+            if prefix:
+                conn.cursor().execute(prefix)
+            # Named per thread: threads sharing the instance may each have a cursor open on the connection.
+            cur = conn.cursor(name=f'nice_crud_fetch_{id(conn):x}_{threading.get_ident():x}')
+            cur.itersize = self._fetch_size
+            cur.execute(sql, params)
+
+            while True:
+                batch = cur.fetchmany(self._fetch_size)
+                if not batch:
+                    break
+                batches += 1
+
+                if store is None:
+                    rows.extend(batch)
+                    in_memory += spill.estimate_size(batch)
+                    peak_in_memory = max(peak_in_memory, in_memory)
+                    if in_memory > memory_budget:
+                        store = spill.SpilledRows()
+                        store.extend(rows)
+                        rows, in_memory = [], 0
+                else:
+                    store.extend(batch)
+                    peak_in_memory = max(peak_in_memory, spill.estimate_size(batch))
+
+            cur.close()
+            if prefix:
+                conn.commit()
+            self._end_statement()
+        except Exception as e:
+            conn.rollback()
+            cancelled = self._end_statement()
+            if store is not None:
+                store.close()
+            if isinstance(e, psycopg2.errors.QueryCanceled) and cancelled:
+                exception = exceptions.ReadCancelledException
+            elif isinstance(e, (psycopg2.errors.QueryCanceled, psycopg2.errors.LockNotAvailable)):
+                exception = exceptions.ReadTimeoutException
+            else:
+                exception = exceptions.ReadException
+            raise exception(
+                func_name=func_name, message=f'{e}', sql=sql, type_='READ',
+                func_params=func_params
+            )
         finally:
             if self._close_conn:
                 self._close()
 
+        result = rows if store is None else store.finish()
+        self.last_query_metrics = self._query_metrics(result, batches, started, memory_budget, peak_in_memory, store)
+
+        return result
+
+    @staticmethod
+    def _query_metrics(
+            result: t.Sequence[t.Tuple], batches: int, started: float, memory_budget: int, peak_in_memory: int,
+            store: t.Optional[spill.SpilledRows] = None
+    ) -> t.Dict[str, t.Any]:
+        return {
+            'rows': len(result),
+            'batches': batches,
+            'duration': time.perf_counter() - started,
+            'memory_budget': memory_budget,
+            'peak_in_memory_bytes': peak_in_memory,
+            'spilled': store is not None,
+            'spill_bytes': store.nbytes if store is not None else 0,
+            'peak_rss': spill.peak_rss(),
+        }
+
     @staticmethod
     def _correct_input(_: t.Any):
         """
@@ -126,6 +616,8 @@ class PostgresCrud:
 
         if isinstance(_, str):
             return f"'{_}'"
+        elif isinstance(_, dict):
+            return jsonb.literal(_)
         else:
             return _
 
@@ -196,14 +688,129 @@ class PostgresCrud:
 
         return sql
 
+    def load_catalog(self, refresh: bool = False) -> CatalogSnapshot:
+        """
+        Loads (or returns the cached) snapshot of the current schema's columns, constraints and indexes.
+
+        The snapshot is fetched from ``pg_catalog`` with one query and kept up to date by the DDL helpers.
+
+        :param refresh: Re-read the catalog even if a snapshot is already cached.
+        :type refresh: bool
+
+        :return: The catalog snapshot.
+        :rtype: CatalogSnapshot
+        """
+
+        if self._catalog is None or refresh:
+            rows = self._execute(
+                func_name='load_catalog', sql=CatalogSnapshot.SQL, type_='READ', func_params={'refresh': refresh}
+            )
+            self._catalog = CatalogSnapshot(rows)
+
+        return self._catalog
+
+    def invalidate_catalog(self) -> None:
+        """ Drops the cached catalog snapshot, e.g. after DDL issued through ``manual_query`` """
+
+        self._catalog = None
+        self._column_types = {}
+
+    def _column_type(self, func_name: str, table_name: str, column: str) -> str:
+        """ The type of a column, looked up once and kept until ``invalidate_catalog`` or ``drop_table`` """
+
+        type_ = self._column_types.get((table_name, column))
+        if type_ is None:
+            rows = self._execute(
+                func_name=func_name, sql=COLUMN_TYPE_SQL, type_='READ', params=(f'"{table_name}"', column),
+                func_params={'table_name': table_name, 'column': column}
+            )
+            if not rows:
+                raise exceptions.ReadException(
+                    func_name=func_name, message=f'column "{column}" of relation "{table_name}" does not exist',
+                    table_name=table_name
+                )
+            type_ = self._column_types[(table_name, column)] = rows[0][0]
+
+        return type_
+
+    def _cached_catalog(self) -> t.Optional[CatalogSnapshot]:
+        if not self._catalog_cache:
+            return None
+
+        return self.load_catalog()
+
+    def _check_columns(self, func_name: str, table_name: str, columns: t.Iterable[str]) -> None:
+        catalog = self._cached_catalog()
+        if catalog is None or not catalog.has_table(table_name):
+            return
+
+        unknown = [column for column in columns if catalog.column_type(table_name, column) is None]
+        if unknown:
+            raise exceptions.WriteException(
+                func_name=func_name, message=f'Unknown columns for table "{table_name}": {unknown}',
+                table_name=table_name
+            )
+
+    def _adapt_value(self, func_name: str, table_name: str, column: str, value: t.Any) -> t.Optional[str]:
+        """
+        Picks an adapter for a value from the cached column type. Dicts are always adapted to ``jsonb``; lists are
+        adapted to ``jsonb`` for ``json``/``jsonb`` columns and to a Postgres array otherwise.
+
+        :return: The quoted SQL literal, or None if the value should go through the default quoting.
+        :rtype: t.Optional[str]
+        """
+
+        if isinstance(value, dict):
+            return jsonb.literal(value)
+
+        catalog = self._cached_catalog()
+
+        if isinstance(value, list):
+            type_ = catalog.column_type(table_name, column) if catalog is not None else None
+            if type_ is None:
+                type_ = self._column_type(func_name, table_name, column)
+            if type_ in ('json', 'jsonb'):
+                return jsonb.literal(value)
+            return psycopg2.extensions.adapt(value).getquoted().decode()
+
+        if catalog is None:
+            return None
+
+        if catalog.column_type(table_name, column) == 'bytea' and isinstance(value, (bytes, bytearray, memoryview)):
+            return psycopg2.extensions.adapt(psycopg2.Binary(value)).getquoted().decode()
+
+        return None
+
     def create_table(
-            self, table_name: str, columns: __create_table_col_types,
-            primary_key: t.Optional[str] = None, unique_keys: t.Optional[t.Union[t.List[str], t.Tuple[str], str]] = None
+            self, table_name: str, columns: __create_table_col_types, primary_key: t.Optional[str] = None,
+            unique_keys: t.Optional[t.Union[t.List[str], t.Tuple[str], str]] = None,
+            partition_type: t.Optional[str] = None, partition_key: t.Optional[str] = None,
+            timeout: t.Optional[float] = None, lock_timeout: t.Optional[float] = None
     ) -> None:
-        __locals__ = locals()
-        __locals__.pop('self')
-        conn = self._connect()
-        cur = conn.cursor()
+        """
+        Creates a table.
+
+        Passing ``partition_type`` (one of ``constants.PartitionTypes``) and ``partition_key`` creates a declaratively
+        partitioned table (``PARTITION BY RANGE|LIST|HASH (partition_key)``). Rows inserted into it are routed by
+        Postgres to the matching partition, see ``create_partition`` and ``partitions.PartitionManager``.
+        """
+
+        func_params = {
+            'table_name': table_name, 'columns': columns, 'primary_key': primary_key, 'unique_keys': unique_keys,
+            'partition_type': partition_type, 'partition_key': partition_key, 'timeout': timeout,
+            'lock_timeout': lock_timeout
+        }
+
+        if (partition_type is None) != (partition_key is None):
+            raise ValueError('partition_type and partition_key must be given together')
+        if partition_type is not None and partition_type.lower() not in self.__PARTITION_TYPES:
+            raise ValueError(f'partition_type must be one of {self.__PARTITION_TYPES}')
+
+        catalog = self._cached_catalog()
+        column_types = column_spec_to_dict(columns)
+        if catalog is not None and catalog.has_columns(table_name, column_types):
+            return None
+        existed = catalog is not None and catalog.has_table(table_name)
 
         sql = f'CREATE TABLE IF NOT EXISTS "{table_name}" '
 
@@ -235,14 +842,142 @@ class PostgresCrud:
 
         sql += ")"
 
-        return self._execute(func_name='create_table', sql=sql, type_='WRITE', func_params=__locals__)
+        if partition_type is not None:
+            sql += f' PARTITION BY {partition_type.upper()} ({partition_key})'
+
+        res = self._execute(
+            func_name='create_table', sql=sql, type_='WRITE', func_params=func_params,
+            timeout=timeout, lock_timeout=lock_timeout, table_name=table_name
+        )
+
+        if existed:
+            # the server kept the table as it was, so the snapshot is reloaded rather than trusting ``columns``
+            self.load_catalog(refresh=True)
+        elif catalog is not None:
+            catalog.add_table(table_name, column_types)
+
+        return res
+
+    @staticmethod
+    def _bound_literal(value: t.Any) -> str:
+        if isinstance(value, str) and value.upper() in ('MINVALUE', 'MAXVALUE'):
+            return value.upper()
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            return f"'{value.isoformat(sep=' ') if isinstance(value, datetime.datetime) else value.isoformat()}'"
+        if isinstance(value, str):
+            return f"'{value}'"
+
+        return str(value)
+
+    def create_partition(
+            self, table_name: str, partition_name: str,
+            from_value: t.Any = None, to_value: t.Any = None, in_values: t.Optional[t.Iterable[t.Any]] = None,
+            modulus: t.Optional[int] = None, remainder: t.Optional[int] = None, default: bool = False
+    ) -> None:
+        """
+        Creates a partition of a partitioned table, if it does not exist yet.
+
+        Exactly one kind of bound must be given: ``from_value``/``to_value`` for range partitions (``MINVALUE`` and
+        ``MAXVALUE`` are accepted), ``in_values`` for list partitions, ``modulus``/``remainder`` for hash partitions,
+        or ``default=True`` for the default partition.
+
+        :param table_name: The partitioned (parent) table.
+        :type table_name: str
+
+        :param partition_name: The name of the partition table.
+        :type partition_name: str
+        """
+
+        func_params = {
+            'table_name': table_name, 'partition_name': partition_name, 'from_value': from_value, 'to_value': to_value,
+            'in_values': in_values, 'modulus': modulus, 'remainder': remainder, 'default': default
+        }
+
+        sql = f'CREATE TABLE IF NOT EXISTS "{partition_name}" PARTITION OF "{table_name}"'
+
+        if default:
+            sql += ' DEFAULT'
+        elif from_value is not None and to_value is not None:
+            sql += f' FOR VALUES FROM ({self._bound_literal(from_value)}) TO ({self._bound_literal(to_value)})'
+        elif in_values is not None:
+            sql += f' FOR VALUES IN ({", ".join(self._bound_literal(v) for v in in_values)})'
+        elif modulus is not None and remainder is not None:
+            sql += f' FOR VALUES WITH (MODULUS {int(modulus)}, REMAINDER {int(remainder)})'
+        else:
+            raise ValueError('one of from_value/to_value, in_values, modulus/remainder or default is required')
+
+        res = self._execute(
+            func_name='create_partition', sql=sql, type_='WRITE', func_params=func_params, table_name=table_name
+        )
+
+        if self._catalog is not None:
+            self._catalog.discard_table(partition_name)
+
+        return res
+
+    def detach_partition(self, table_name: str, partition_name: str, concurrently: bool = False) -> None:
+        """
+        Detaches a partition from its parent table, leaving it as a standalone table.
+
+        ``concurrently=True`` (PostgreSQL 14+) only takes a ``SHARE UPDATE EXCLUSIVE`` lock on the parent; it cannot
+        run inside a transaction block so it is issued on a dedicated autocommit connection.
+        """
+
+        func_params = {'table_name': table_name, 'partition_name': partition_name, 'concurrently': concurrently}
+
+        sql = f'ALTER TABLE "{table_name}" DETACH PARTITION "{partition_name}"'
+
+        if not concurrently:
+            return self._execute(
+                func_name='detach_partition', sql=sql, type_='WRITE', func_params=func_params, table_name=table_name
+            )
+
+        conn = self._new_connection()
+        conn.autocommit = True
+        try:
+            cur = conn.cursor()
+            cur.execute(sql + ' CONCURRENTLY')
+            self._notify_write(cur, table_name)
+            self._after_write(table_name)
+        except Exception as e:
+            raise exceptions.WriteException(
+                func_name='detach_partition', message=f'{e}', sql=sql, type_='WRITE',
+                func_params=func_params
+            )
+        finally:
+            conn.close()
+
+    def list_partitions(self, table_name: str) -> t.List[t.Tuple[str, str]]:
+        """
+        Lists the partitions of a partitioned table.
+
+        :return: ``(partition_name, partition_bound)`` tuples, e.g. ``('events_p20240101', "FOR VALUES FROM (...)")``.
+        :rtype: t.List[t.Tuple[str, str]]
+        """
+
+        func_params = {'table_name': table_name}
+
+        sql = '''
+            SELECT c.relname, pg_catalog.pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_catalog.pg_inherits i
+            JOIN pg_catalog.pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+            ORDER BY c.relname
+        '''
+
+        return self._execute(
+            func_name='list_partitions', sql=sql, type_='READ', func_params=func_params, params=(f'"{table_name}"',)
+        )
 
     def insert(
             self, table_name: str, columns: t.Union[t.List[str], t.Tuple, str, t.Dict],
-            values: t.Union[t.List[str], t.Tuple, str], on_conflict: t.Optional[str] = None
+            values: t.Union[t.List[str], t.Tuple, str], on_conflict: t.Optional[str] = None,
+            timeout: t.Optional[float] = None, lock_timeout: t.Optional[float] = None
     ) -> None:
-        __locals__ = locals()
-        __locals__.pop('self')
+        func_params = {
+            'table_name': table_name, 'columns': columns, 'values': values, 'on_conflict': on_conflict,
+            'timeout': timeout, 'lock_timeout': lock_timeout
+        }
 
         sql = f'INSERT INTO "{table_name}" '
 
@@ -267,32 +1002,59 @@ class PostgresCrud:
         if on_conflict:
             sql += f' ON CONFLICT {on_conflict}'
 
-        return self._execute(func_name='insert', sql=sql, type_='WRITE', func_params=__locals__)
+        return self._execute(
+            func_name='insert', sql=sql, type_='WRITE', func_params=func_params,
+            timeout=timeout, lock_timeout=lock_timeout, table_name=table_name
+        )
+
+    def insert_from_dict(
+            self, table_name: str, data: t.Dict, on_conflict: t.Optional[str] = None,
+            timeout: t.Optional[float] = None, lock_timeout: t.Optional[float] = None
+    ):
+        func_params = {
+            'table_name': table_name, 'data': data, 'on_conflict': on_conflict, 'timeout': timeout,
+            'lock_timeout': lock_timeout
+        }
 
-    def insert_from_dict(self, table_name: str, data: t.Dict, on_conflict: t.Optional[str] = None):
-        __locals__ = locals()
-        __locals__.pop('self')
+        self._check_columns('insert_from_dict', table_name, data.keys())
 
         sql = f'INSERT INTO "{table_name}" '
 
         sql += f'({", ".join(data.keys())})'
 
-        sql += f''' VALUES ({", ".join(map(lambda x: f"'{x}'", data.values()))})'''
+        values = [self._adapt_value('insert_from_dict', table_name, k, v) or f"'{v}'" for k, v in data.items()]
+        sql += f''' VALUES ({", ".join(values)})'''
 
         if on_conflict:
             sql += f' ON CONFLICT {on_conflict}'
 
-        return self._execute(func_name='insert_from_dict', sql=sql, type_='WRITE', func_params=__locals__)
+        return self._execute(
+            func_name='insert_from_dict', sql=sql, type_='WRITE', func_params=func_params,
+            timeout=timeout, lock_timeout=lock_timeout, table_name=table_name
+        )
 
     def select(
             self, table_name: str, columns: t.Union[t.List[str], t.Tuple, str], condition: t.Optional[str] = None,
-            limit: t.Optional[int] = None, offset: t.Optional[int] = None, order_by: t.Optional[str] = None
-    ) -> t.List[t.Tuple[t.Tuple]]:
+            limit: t.Optional[int] = None, offset: t.Optional[int] = None, order_by: t.Optional[str] = None,
+            timeout: t.Optional[float] = None, lock_timeout: t.Optional[float] = None, use_cache: bool = True,
+            memory_budget: t.Optional[int] = None
+    ) -> t.Union[t.List[t.Tuple[t.Tuple]], spill.SpilledRows]:
+        """
+        Selects rows.
+
+        :param memory_budget: Bytes of rows to keep in memory (defaults to the instance's ``memory_budget``). Rows are
+            then fetched in batches through a server-side cursor and, past the budget, spilled to a memory-mapped
+            file: a ``spill.SpilledRows`` sequence is returned instead of a list, and ``last_query_metrics`` reports
+            the row count, spill size and ``peak_rss``, the peak resident set size of the whole process since it
+            started (``ru_maxrss``), not of this query. Spilled results are not cached.
+        :type memory_budget: t.Optional[int]
+        """
 
-        __locals__ = locals()
-        __locals__.pop('self')
-        conn = self._connect()
-        cur = conn.cursor()
+        func_params = {
+            'table_name': table_name, 'columns': columns, 'condition': condition, 'limit': limit, 'offset': offset,
+            'order_by': order_by, 'timeout': timeout, 'lock_timeout': lock_timeout, 'use_cache': use_cache,
+            'memory_budget': memory_budget
+        }
 
         sql = f'SELECT %s FROM "{table_name}"'
 
@@ -317,16 +1079,423 @@ class PostgresCrud:
         if offset:
             sql += f' OFFSET {offset}'
 
-        return self._execute(func_name='select', sql=sql, type_='READ', func_params=__locals__)
+        cache = self._select_cache if use_cache else None
+        if cache is not None:
+            hit, rows = cache.get(table_name, sql)
+            if hit:
+                return list(rows)
+            generation = cache.generation(table_name)
+
+        rows = self._execute(
+            func_name='select', sql=sql, type_='READ', func_params=func_params,
+            timeout=timeout, lock_timeout=lock_timeout,
+            memory_budget=self._memory_budget if memory_budget is None else memory_budget
+        )
+
+        if cache is not None and type(rows) == list:
+            cache.put(table_name, sql, rows, generation)
+            return list(rows)
+
+        return rows
+
+    def select_many(
+            self, table_name: str, key_column: str, keys: t.Iterable[t.Any],
+            columns: t.Union[t.List[str], t.Tuple, str] = '*', chunk_size: int = 1000, workers: int = 1,
+            missing: str = 'omit', timeout: t.Optional[float] = None
+    ) -> t.Dict[t.Any, t.Optional[t.Tuple]]:
+        """
+        Fetches the rows of many keys at once, instead of one ``select`` per key.
 
-    def update(
-            self, table_name: str, columns: t.Union[t.List[t.Any], t.Tuple],
-            values: t.Union[t.List[t.Any], t.Tuple, str], condition: t.Optional[t.Union[str, t.List, t.Tuple]] = None
+        The keys are deduplicated and sent in chunks of ``chunk_size`` as one array parameter per query, joined to the
+        table through ``unnest(...) WITH ORDINALITY`` and cast to the type of ``key_column`` (looked up once), so keys
+        may be given in any form Postgres can cast, e.g. ``'42'`` for an integer column; the returned mapping uses the
+        keys as given. With ``workers > 1`` the chunks run in parallel, each on its own connection. ``key_column``
+        should be unique (e.g. the primary key); otherwise one of the matching rows is kept per key.
+
+        :param columns: The columns of the returned rows.
+        :type columns: t.Union[t.List[str], t.Tuple, str]
+
+        :param missing: What to do about keys without a row: ``'omit'`` leaves them out of the mapping, ``'none'``
+            maps them to ``None``, ``'raise'`` raises a ``ReadException`` listing them.
+        :type missing: str
+
+        :return: A mapping of key -> row, in the order the keys were given.
+        :rtype: t.Dict[t.Any, t.Optional[t.Tuple]]
+        """
+
+        func_params = {
+            'table_name': table_name, 'key_column': key_column, 'keys': keys, 'columns': columns,
+            'chunk_size': chunk_size, 'workers': workers, 'missing': missing, 'timeout': timeout
+        }
+
+        if missing not in ('omit', 'none', 'raise'):
+            raise ValueError(f"missing must be 'omit', 'none' or 'raise': {missing}")
+
+        if columns == '*':
+            selected = f'"{table_name}".*'
+        elif type(columns) == str:
+            selected = columns
+        elif type(columns) == list or type(columns) == tuple:
+            selected = ', '.join(columns)
+        else:
+            raise TypeError(f'columns must be str, list or tuple: {type(columns)}')
+
+        unique_keys = list(dict.fromkeys(keys))
+        if not unique_keys:
+            return {}
+
+        key_type = self._column_type('select_many', table_name, key_column)
+        # The position of the matched key in its chunk identifies the key as given, whatever its Python type.
+        sql = f'SELECT nice_crud_keys.position, {selected} ' \
+              f'FROM unnest(%s::text[]) WITH ORDINALITY AS nice_crud_keys (key, position) ' \
+              f'JOIN "{table_name}" ON "{table_name}"."{key_column}" = nice_crud_keys.key::{key_type}'
+        chunks = [unique_keys[i:i + chunk_size] for i in range(0, len(unique_keys), chunk_size)]
+
+        if workers > 1 and len(chunks) > 1:
+            prefix = self._timeout_prefix(timeout, None)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+                results = list(pool.map(
+                    lambda chunk: self._read_on_new_connection('select_many', prefix + sql, (chunk,), func_params),
+                    chunks
+                ))
+        else:
+            results = [
+                self._execute(
+                    func_name='select_many', sql=sql, type_='READ', func_params=func_params, params=(chunk,),
+                    timeout=timeout
+                )
+                for chunk in chunks
+            ]
+
+        found = {chunk[row[0] - 1]: row[1:] for chunk, rows in zip(chunks, results) for row in rows}
+
+        absent = [key for key in unique_keys if key not in found]
+        if absent and missing == 'raise':
+            raise exceptions.ReadException(
+                func_name='select_many', message=f'{len(absent)} keys not found: {absent[:20]}', sql=sql, type_='READ',
+                missing=absent
+            )
+
+        if missing == 'none':
+            return {key: found.get(key) for key in unique_keys}
+
+        return {key: found[key] for key in unique_keys if key in found}
+
+    def _read_on_new_connection(
+            self, func_name: str, sql: str, params: t.Any, func_params: t.Optional[t.Dict] = None
+    ) -> t.List[t.Tuple]:
+        """ Runs one read on a dedicated connection, for reads issued in parallel """
+
+        conn = self._new_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            return cur.fetchall()
+        except Exception as e:
+            raise exceptions.ReadException(
+                func_name=func_name, message=f'{e}', sql=sql, type_='READ', func_params=func_params
+            )
+        finally:
+            conn.close()
+
+    def select_changed_since(
+            self, table_name: str, watermark: t.Any = None, strategy: str = 'xmin', column: str = 'updated_at',
+            columns: t.Union[t.List[str], t.Tuple, str] = '*',
+            condition: t.Optional[t.Union[str, t.List, t.Tuple]] = None, batch_size: int = 10000
+    ) -> delta.ChangedRows:
+        """
+        Incremental extraction: returns the rows inserted or updated since ``watermark``, and the watermark to pass
+        next time. Deletes are not seen, use ``stream_changes`` for them.
+
+        With ``strategy='xmin'`` the watermark is a 64 bit transaction id and rows are selected by the id of the
+        transaction that last wrote them (the ``xmin`` system column), so no schema change is needed; the table is
+        still scanned, but only changed rows are sent. A watermark from before the last 2^31 transactions cannot be
+        compared with ``xmin`` any more (wraparound), and the whole table is returned, with ``full`` set.
+
+        With ``strategy='column'`` rows are selected by ``column > watermark``, e.g. an indexed ``updated_at``
+        timestamp maintained on every write, which makes the cost proportional to the changes. Before the snapshot,
+        the start of the oldest transaction still writing in another session is read from ``pg_stat_activity``, and
+        the new watermark is held back to it (or to the time of that read), so rows committed after the snapshot with
+        earlier timestamps than the ones read are picked up by the next call. This holds for timestamps taken with
+        ``clock_timestamp()`` when the row is written, and needs the other sessions to be visible (same role, or
+        ``pg_read_all_stats``); with ``now()``, a transaction that started before that read but writes only after it
+        can be missed. Other column types, e.g. a version number from a sequence, are not held back: a transaction
+        committing out of order can be missed.
+
+        The rows are read in one ``REPEATABLE READ`` snapshot, and the new watermark is chosen so that transactions
+        still running in that snapshot are picked up by the next call: a few rows may be returned twice.
+
+        :param watermark: The ``watermark`` of the previous result; ``None`` for a full extraction.
+        :type watermark: t.Any
+
+        :param strategy: ``'xmin'`` or ``'column'``.
+        :type strategy: str
+
+        :param batch_size: The number of rows per batch.
+        :type batch_size: int
+
+        :return: An iterable of row batches, with the new ``watermark``.
+        :rtype: delta.ChangedRows
+        """
+
+        func_params = {
+            'table_name': table_name, 'watermark': watermark, 'strategy': strategy, 'column': column,
+            'columns': columns, 'condition': condition, 'batch_size': batch_size
+        }
+
+        if strategy not in delta.STRATEGIES:
+            raise ValueError(f'strategy must be one of {delta.STRATEGIES}: {strategy}')
+
+        if type(columns) == str:
+            selected = columns
+        elif type(columns) == list or type(columns) == tuple:
+            selected = ', '.join(columns)
+        else:
+            raise TypeError(f'columns must be str, list or tuple: {type(columns)}')
+
+        conn = self._new_connection()
+        conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+
+        # Every query below is sent with parameters: literal % signs of the condition must be doubled.
+        conditions = [] if not condition else [self._process_condition(condition)[len(' WHERE '):].replace('%', '%%')]
+        params = {'watermark': watermark}
+        try:
+            cur = conn.cursor()
+            if strategy == 'column':
+                # Read in its own transaction: the snapshot is taken by the first statement after the commit.
+                cur.execute(delta.HOLDBACK_SQL)
+                bound = cur.fetchone()[0]
+                conn.commit()
+
+            if strategy == 'xmin':
+                cur.execute(delta.SNAPSHOT_SQL)
+                xmin, xmax = cur.fetchone()
+                full = watermark is None or xmax - int(watermark) >= delta.XID_HORIZON
+                if not full:
+                    conditions.append(delta.xmin_condition(int(watermark), xmax))
+                new_watermark = xmin
+            else:
+                full = watermark is None
+                if not full:
+                    conditions.append(f'"{column}" > %(watermark)s')
+
+                where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+                cur.execute(f'SELECT max("{column}") FROM "{table_name}"{where}', params)
+                maximum = cur.fetchone()[0]
+                new_watermark = watermark if maximum is None else delta.column_watermark(maximum, bound)
+
+            where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+            sql = f'SELECT {selected} FROM "{table_name}"{where}'
+
+            named = conn.cursor(name=f'nice_crud_delta_{id(conn):x}')
+            named.itersize = batch_size
+            named.execute(sql, params)
+        except Exception as e:
+            conn.close()
+            raise exceptions.ReadException(
+                func_name='select_changed_since', message=f'{e}', type_='READ',
+                func_params=func_params
+            )
+
+        return delta.ChangedRows(conn, named, new_watermark, full, batch_size)
+
+    def count(
+            self, table_name: str, condition: t.Optional[t.Union[str, t.List, t.Tuple]] = None,
+            column: str = '*', distinct: bool = False,
+            timeout: t.Optional[float] = None, lock_timeout: t.Optional[float] = None
+    ) -> int:
+        """
+        Counts rows on the server with ``SELECT count(...)``.
+
+        :param condition: Same forms as ``select``/``delete`` conditions.
+        :type condition: t.Optional[t.Union[str, t.List, t.Tuple]]
+
+        :param column: Count the non-null values of this column instead of rows.
+        :type column: str
+
+        :param distinct: Count distinct values of ``column``.
+        :type distinct: bool
+
+        :return: The number of rows.
+        :rtype: int
+        """
+
+        func_params = {
+            'table_name': table_name, 'condition': condition, 'column': column, 'distinct': distinct,
+            'timeout': timeout, 'lock_timeout': lock_timeout
+        }
+
+        if distinct and column == '*':
+            raise ValueError('distinct requires a column')
+
+        sql = f'SELECT count({"DISTINCT " if distinct else ""}{column}) FROM "{table_name}"'
+
+        if condition:
+            sql += self._process_condition(condition)
+
+        return self._execute(
+            func_name='count', sql=sql, type_='READ', func_params=func_params,
+            timeout=timeout, lock_timeout=lock_timeout
+        )[0][0]
+
+    def exists(
+            self, table_name: str, condition: t.Optional[t.Union[str, t.List, t.Tuple]] = None,
+            timeout: t.Optional[float] = None, lock_timeout: t.Optional[float] = None
+    ) -> bool:
+        """
+        Checks whether at least one row matches, stopping at the first match on the server.
+
+        :param condition: Same forms as ``select``/``delete`` conditions.
+        :type condition: t.Optional[t.Union[str, t.List, t.Tuple]]
+
+        :rtype: bool
+        """
+
+        func_params = {
+            'table_name': table_name, 'condition': condition, 'timeout': timeout, 'lock_timeout': lock_timeout
+        }
+
+        sql = f'SELECT 1 FROM "{table_name}"'
+
+        if condition:
+            sql += self._process_condition(condition)
+
+        sql = f'SELECT EXISTS ({sql})'
+
+        return self._execute(
+            func_name='exists', sql=sql, type_='READ', func_params=func_params,
+            timeout=timeout, lock_timeout=lock_timeout
+        )[0][0]
+
+    def aggregate(
+            self, table_name: str, aggregations: t.Dict[str, t.Union[str, t.List[str], t.Tuple[str]]],
+            condition: t.Optional[t.Union[str, t.List, t.Tuple]] = None,
+            group_by: t.Optional[t.Union[str, t.List[str], t.Tuple[str]]] = None,
+            order_by: t.Optional[str] = None, limit: t.Optional[int] = None,
+            timeout: t.Optional[float] = None, lock_timeout: t.Optional[float] = None
+    ) -> t.List[t.Tuple]:
+        """
+        Computes aggregates on the server.
+
+        ``crud.aggregate('users', {'age': ['min', 'max', 'avg'], '*': 'count'}, group_by='family')`` runs
+        ``SELECT family, min(age), max(age), avg(age), count(*) FROM users GROUP BY family``.
+
+        :param aggregations: Column names mapped to one or more aggregate function names. ``'*'`` is only valid with
+            ``count``.
+        :type aggregations: t.Dict[str, t.Union[str, t.List[str], t.Tuple[str]]]
+
+        :param condition: Same forms as ``select``/``delete`` conditions.
+        :type condition: t.Optional[t.Union[str, t.List, t.Tuple]]
+
+        :param group_by: Column(s) to group by; they come first in every returned row.
+        :type group_by: t.Optional[t.Union[str, t.List[str], t.Tuple[str]]]
+
+        :return: One tuple per group: the ``group_by`` values followed by the aggregates in the given order.
+        :rtype: t.List[t.Tuple]
+        """
+
+        func_params = {
+            'table_name': table_name, 'aggregations': aggregations, 'condition': condition, 'group_by': group_by,
+            'order_by': order_by, 'limit': limit, 'timeout': timeout, 'lock_timeout': lock_timeout
+        }
+
+        if not aggregations:
+            raise ValueError('aggregations must not be empty')
+
+        if group_by is None:
+            group_columns = []
+        elif type(group_by) == str:
+            group_columns = [group_by]
+        elif type(group_by) == list or type(group_by) == tuple:
+            group_columns = list(group_by)
+        else:
+            raise TypeError(f'group_by must be str, list or tuple: {type(group_by)}')
+
+        expressions = []
+        for column, functions in aggregations.items():
+            for function in ([functions] if type(functions) == str else functions):
+                function = function.lower()
+                if function not in self.__AGGREGATES:
+                    raise ValueError(f'aggregate must be one of {self.__AGGREGATES}: {function}')
+                if column == '*' and function != 'count':
+                    raise ValueError(f'"*" can only be counted, not {function}')
+                expressions.append(f'{function}({column})')
+
+        sql = f'SELECT {", ".join(group_columns + expressions)} FROM "{table_name}"'
+
+        if condition:
+            sql += self._process_condition(condition)
+        if group_columns:
+            sql += f' GROUP BY {", ".join(group_columns)}'
+        if order_by:
+            sql += f' ORDER BY {order_by}'
+        if limit:
+            sql += f' LIMIT {limit}'
+
+        return self._execute(
+            func_name='aggregate', sql=sql, type_='READ', func_params=func_params,
+            timeout=timeout, lock_timeout=lock_timeout
+        )
+
+    def estimated_count(
+            self, table_name: str, fallback: bool = True, timeout: t.Optional[float] = None,
+            lock_timeout: t.Optional[float] = None
+    ) -> int:
+        """
+        Returns the planner's row estimate for a table, read from ``pg_class.reltuples`` without scanning it.
+
+        The estimate is scaled to the current table size the same way the planner does, and summed over the leaf
+        partitions of a partitioned table. It is only as fresh as the last ``VACUUM``/``ANALYZE``.
+
+        :param fallback: Run an exact ``count`` if the table (or one of its partitions) was never analyzed.
+        :type fallback: bool
+
+        :return: The estimated number of rows (0 for never-analyzed tables when ``fallback`` is False).
+        :rtype: int
+        """
+
+        func_params = {'table_name': table_name, 'fallback': fallback, 'timeout': timeout, 'lock_timeout': lock_timeout}
+
+        sql = '''
+            SELECT to_regclass(%(table)s) IS NOT NULL,
+                   coalesce(sum(
+                       CASE
+                           WHEN c.reltuples < 0 THEN 0
+                           WHEN c.relpages > 0 THEN c.reltuples / c.relpages
+                               * (pg_catalog.pg_relation_size(c.oid) / current_setting('block_size')::int)
+                           ELSE c.reltuples
+                       END
+                   ), 0)::bigint,
+                   coalesce(bool_or(c.reltuples < 0), false)
+            FROM pg_catalog.pg_class c
+            WHERE c.oid IN (SELECT relid FROM pg_catalog.pg_partition_tree(to_regclass(%(table)s)) WHERE isleaf)
+               OR (c.oid = to_regclass(%(table)s) AND c.relkind <> 'p')
+        '''
+
+        found, estimate, never_analyzed = self._execute(
+            func_name='estimated_count', sql=sql, type_='READ', func_params=func_params,
+            params={'table': f'"{table_name}"'}, timeout=timeout, lock_timeout=lock_timeout
+        )[0]
+
+        if not found:
+            raise exceptions.ReadException(
+                func_name='estimated_count', message=f'relation "{table_name}" does not exist', table_name=table_name
+            )
+
+        if never_analyzed and fallback:
+            return self.count(table_name, timeout=timeout, lock_timeout=lock_timeout)
+
+        return estimate
+
+    def update(
+            self, table_name: str, columns: t.Union[t.List[t.Any], t.Tuple],
+            values: t.Union[t.List[t.Any], t.Tuple, str], condition: t.Optional[t.Union[str, t.List, t.Tuple]] = None,
+            timeout: t.Optional[float] = None, lock_timeout: t.Optional[float] = None
     ):
-        __locals__ = locals()
-        __locals__.pop('self')
-        conn = self._connect()
-        cur = conn.cursor()
+        func_params = {
+            'table_name': table_name, 'columns': columns, 'values': values, 'condition': condition, 'timeout': timeout,
+            'lock_timeout': lock_timeout
+        }
 
         sql = f'UPDATE "{table_name}"'
 
@@ -366,45 +1535,72 @@ class PostgresCrud:
         else:
             raise TypeError(f'columns must be str, list or tuple: {type(columns)}')
 
-        sql += f''' SET {", ".join(map(lambda x: f'"{x[0]}" = {self._correct_input(x[1])}', zip(columns, values)))}'''
+        self._check_columns('update', table_name, columns)
+
+        assignments = [
+            f'"{k}" = {self._adapt_value("update", table_name, k, v) or self._correct_input(v)}'
+            for k, v in zip(columns, values)
+        ]
+        sql += f' SET {", ".join(assignments)}'
 
         if condition:
             sql += self._process_condition(condition)
 
-        return self._execute(func_name='update', sql=sql, type_='WRITE', func_params=__locals__)
+        return self._execute(
+            func_name='update', sql=sql, type_='WRITE', func_params=func_params,
+            timeout=timeout, lock_timeout=lock_timeout, table_name=table_name
+        )
 
     def update_via_dict(
-            self, table_name: str, data: t.Dict, condition: t.Optional[t.Union[str, t.List, t.Tuple]] = None
+            self, table_name: str, data: t.Dict, condition: t.Optional[t.Union[str, t.List, t.Tuple]] = None,
+            timeout: t.Optional[float] = None, lock_timeout: t.Optional[float] = None
     ) -> None:
-        __locals__ = locals()
-        __locals__.pop('self')
-        conn = self._connect()
-        cur = conn.cursor()
+        func_params = {
+            'table_name': table_name, 'data': data, 'condition': condition, 'timeout': timeout,
+            'lock_timeout': lock_timeout
+        }
+
+        self._check_columns('update_via_dict', table_name, data.keys())
 
         sql = f'UPDATE "{table_name}"'
 
-        sql += f''' SET {", ".join([f'"{k}" = {self._correct_input(v)}' for k, v in data.items()])}'''
+        assignments = [
+            f'"{k}" = {self._adapt_value("update_via_dict", table_name, k, v) or self._correct_input(v)}'
+            for k, v in data.items()
+        ]
+        sql += f' SET {", ".join(assignments)}'
 
         if condition:
             sql += self._process_condition(condition)
 
-        return self._execute(func_name='update_via_dict', sql=sql, type_='WRITE', func_params=__locals__)
+        return self._execute(
+            func_name='update_via_dict', sql=sql, type_='WRITE', func_params=func_params,
+            timeout=timeout, lock_timeout=lock_timeout, table_name=table_name
+        )
 
-    def update_manual(self, table_name: str, update: str, condition: str):
-        __locals__ = locals()
-        __locals__.pop('self')
-        conn = self._connect()
-        cur = conn.cursor()
+    def update_manual(
+            self, table_name: str, update: str, condition: str,
+            timeout: t.Optional[float] = None, lock_timeout: t.Optional[float] = None
+    ):
+        func_params = {
+            'table_name': table_name, 'update': update, 'condition': condition, 'timeout': timeout,
+            'lock_timeout': lock_timeout
+        }
 
         sql = f'UPDATE "{table_name}" SET {update} WHERE {condition}'
 
-        return self._execute(func_name='update_manual', sql=sql, type_='WRITE', func_params=__locals__)
+        return self._execute(
+            func_name='update_manual', sql=sql, type_='WRITE', func_params=func_params,
+            timeout=timeout, lock_timeout=lock_timeout, table_name=table_name
+        )
 
-    def delete(self, table_name: str, condition: t.Union[str, t.List, t.Tuple]):
-        __locals__ = locals()
-        __locals__.pop('self')
-        conn = self._connect()
-        cur = conn.cursor()
+    def delete(
+            self, table_name: str, condition: t.Union[str, t.List, t.Tuple],
+            timeout: t.Optional[float] = None, lock_timeout: t.Optional[float] = None
+    ):
+        func_params = {
+            'table_name': table_name, 'condition': condition, 'timeout': timeout, 'lock_timeout': lock_timeout
+        }
 
         sql = f'DELETE FROM "{table_name}"'
 
@@ -413,27 +1609,71 @@ class PostgresCrud:
         else:
             raise ValueError('condition is required')
 
-        return self._execute(func_name='delete', sql=sql, type_='WRITE', func_params=__locals__)
+        return self._execute(
+            func_name='delete', sql=sql, type_='WRITE', func_params=func_params,
+            timeout=timeout, lock_timeout=lock_timeout, table_name=table_name
+        )
 
-    def drop_table(self, table_name: str):
-        __locals__ = locals()
-        __locals__.pop('self')
-        conn = self._connect()
-        cur = conn.cursor()
+    def drop_table(self, table_name: str, timeout: t.Optional[float] = None, lock_timeout: t.Optional[float] = None):
+        func_params = {'table_name': table_name, 'timeout': timeout, 'lock_timeout': lock_timeout}
 
         sql = f'DROP TABLE IF EXISTS "{table_name}"'
 
-        return self._execute(func_name='drop_table', sql=sql, type_='WRITE', func_params=__locals__)
+        res = self._execute(
+            func_name='drop_table', sql=sql, type_='WRITE', func_params=func_params,
+            timeout=timeout, lock_timeout=lock_timeout, table_name=table_name
+        )
+
+        if self._catalog is not None:
+            self._catalog.discard_table(table_name)
+        self._column_types = {key: type_ for key, type_ in self._column_types.items() if key[0] != table_name}
+
+        return res
 
     def create_index(
             self, table_name: str, columns: __create_index_col_types,
             unique: bool = False, index_name: t.Optional[str] = None,
-            index_type: t.Optional[str] = None, index_options: t.Optional[str] = None
+            index_type: t.Optional[str] = None, index_options: t.Optional[str] = None,
+            concurrently: bool = False, maintenance_work_mem: t.Optional[str] = None,
+            max_parallel_maintenance_workers: t.Optional[int] = None,
+            progress_callback: t.Optional[t.Callable[[t.Dict[str, t.Any]], None]] = None,
+            progress_interval: float = 1.0, timeout: t.Optional[float] = None, lock_timeout: t.Optional[float] = None
     ) -> None:
-        __locals__ = locals()
-        __locals__.pop('self')
-        conn = self._connect()
-        cur = conn.cursor()
+        """
+        Creates an index.
+
+        With ``concurrently=True`` the index is built with ``CREATE INDEX CONCURRENTLY`` on a dedicated autocommit
+        connection, so writes to the table are not blocked. An invalid index left behind by an earlier failed
+        concurrent build with the same name is dropped first, and a failed build cleans up after itself.
+
+        :param maintenance_work_mem: ``maintenance_work_mem`` for this build only, e.g. ``'2GB'``.
+        :type maintenance_work_mem: t.Optional[str]
+
+        :param max_parallel_maintenance_workers: ``max_parallel_maintenance_workers`` for this build only.
+        :type max_parallel_maintenance_workers: t.Optional[int]
+
+        :param progress_callback: Called from a background thread with each new ``pg_stat_progress_create_index``
+            row, as a dict with an extra ``percent`` key.
+        :type progress_callback: t.Optional[t.Callable[[t.Dict[str, t.Any]], None]]
+
+        :param progress_interval: Seconds between two progress polls.
+        :type progress_interval: float
+
+        :param timeout: ``statement_timeout`` in seconds for the build, also with ``concurrently=True``.
+        :type timeout: t.Optional[float]
+
+        :param lock_timeout: ``lock_timeout`` in seconds for the build, also with ``concurrently=True``.
+        :type lock_timeout: t.Optional[float]
+        """
+
+        func_params = {
+            'table_name': table_name, 'columns': columns, 'unique': unique, 'index_name': index_name,
+            'index_type': index_type, 'index_options': index_options, 'concurrently': concurrently,
+            'maintenance_work_mem': maintenance_work_mem,
+            'max_parallel_maintenance_workers': max_parallel_maintenance_workers,
+            'progress_callback': progress_callback, 'progress_interval': progress_interval, 'timeout': timeout,
+            'lock_timeout': lock_timeout
+        }
 
         if index_type is not None and index_type.lower() not in self.__INDEX_TYPES:
             raise ValueError(f'index_type must be one of {self.__INDEX_TYPES}')
@@ -468,7 +1708,11 @@ class PostgresCrud:
         __index = 'UNIQUE INDEX' if unique else 'INDEX'
         __index_name = index_name if index_name else table_name+'_index'
 
-        sql = f'''CREATE {__index} {__index_name} ON "{table_name}"'''
+        catalog = self._cached_catalog()
+        if catalog is not None and catalog.has_index(__index_name):
+            return None
+
+        sql = f'''CREATE {__index}{' CONCURRENTLY' if concurrently else ''} {__index_name} ON "{table_name}"'''
 
         if index_type:
             sql += f' USING {index_type}'
@@ -478,16 +1722,309 @@ class PostgresCrud:
 
         sql += f' ({__columns})'
 
-        return self._execute(func_name='create_index', sql=sql, type_='WRITE', func_params=__locals__)
+        statement_timeout = self._timeout if timeout is None else timeout
+        lock_wait_timeout = self._lock_timeout if lock_timeout is None else lock_timeout
+        settings = [
+            (name, value) for name, value in (
+                ('maintenance_work_mem', maintenance_work_mem),
+                ('max_parallel_maintenance_workers', max_parallel_maintenance_workers),
+                ('statement_timeout', None if statement_timeout is None else self._milliseconds(statement_timeout)),
+                ('lock_timeout', None if lock_wait_timeout is None else self._milliseconds(lock_wait_timeout)),
+            ) if value is not None
+        ]
+
+        if concurrently:
+            res = self._create_index_concurrently(
+                sql, table_name, __index_name, settings, progress_callback, progress_interval, func_params
+            )
+        else:
+            res = self._create_index_in_transaction(
+                sql, table_name, settings, progress_callback, progress_interval, func_params
+            )
+
+        if catalog is not None:
+            catalog.add_index(table_name, __index_name, index_type)
+
+        return res
+
+    def create_jsonb_index(
+            self, table_name: str, column: str, path_ops: bool = True, index_name: t.Optional[str] = None,
+            concurrently: bool = False
+    ) -> None:
+        """
+        Creates a GIN index on a ``jsonb`` column for the ``jsonb`` condition helpers.
+
+        ``jsonb_path_ops`` (the default) builds a smaller, faster index serving ``@>`` (``jsonb.contains``,
+        ``jsonb.path_equals``) and jsonpath tests (``jsonb.has_key(..., path_ops=True)``); ``path_ops=False`` uses
+        the default ``jsonb_ops`` opclass, which also serves the key operators ``?``, ``?|`` and ``?&``.
+
+        :param index_name: Defaults to ``<table_name>_<column>_gin``.
+        :type index_name: t.Optional[str]
+        """
+
+        self.create_index(
+            table_name=table_name, columns=f'"{column}"{" jsonb_path_ops" if path_ops else ""}',
+            index_name=index_name or f'{table_name}_{column}_gin', index_type=IndexTypes.Gin, concurrently=concurrently
+        )
+
+    def enable_fulltext(
+            self, table_name: str, columns: t.Union[t.List[str], t.Tuple[str], t.Dict[str, str], str],
+            language: str = 'english', vector_column: str = 'search_vector', concurrently: bool = False
+    ) -> None:
+        """
+        Makes text columns searchable with ``search``: adds a stored generated ``tsvector`` column computed from
+        ``columns`` and a GIN index on it.
+
+        The generated column is maintained by Postgres on every insert and update (and filled for existing rows,
+        which rewrites the table), and is returned by ``SELECT *``.
+
+        :param columns: The text columns, or a dict of column -> weight (``'A'`` to ``'D'``) to rank matches in some
+            columns (e.g. a title) above others.
+        :type columns: t.Union[t.List[str], t.Tuple[str], t.Dict[str, str], str]
+
+        :param language: The text search configuration, e.g. ``'english'`` or ``'simple'``.
+        :type language: str
+
+        :param vector_column: The name of the generated column; the index is ``<table_name>_<vector_column>_gin``.
+        :type vector_column: str
+        """
+
+        func_params = {
+            'table_name': table_name, 'columns': columns, 'language': language, 'vector_column': vector_column,
+            'concurrently': concurrently
+        }
+
+        if type(columns) == dict:
+            weights = columns
+        else:
+            weights = {column: None for column in ([columns] if type(columns) == str else columns)}
+        if not weights:
+            raise ValueError('columns must not be empty')
+
+        vectors = []
+        for column, weight in weights.items():
+            vector = f"to_tsvector('{language}'::regconfig, coalesce(\"{column}\"::text, ''))"
+            vectors.append(vector if weight is None else f"setweight({vector}, '{weight}')")
+
+        sql = f'ALTER TABLE "{table_name}" ADD COLUMN IF NOT EXISTS "{vector_column}" tsvector ' \
+              f'GENERATED ALWAYS AS ({" || ".join(vectors)}) STORED'
+
+        self._execute(
+            func_name='enable_fulltext', sql=sql, type_='WRITE', func_params=func_params, table_name=table_name
+        )
+
+        if self._catalog is not None:
+            self._catalog.discard_table(table_name)
+
+        self.create_index(
+            table_name=table_name, columns=f'"{vector_column}"', index_name=f'{table_name}_{vector_column}_gin',
+            index_type=IndexTypes.Gin, concurrently=concurrently
+        )
+
+    def search(
+            self, table_name: str, query: str, limit: t.Optional[int] = 10, rank: bool = True,
+            columns: t.Union[t.List[str], t.Tuple, str] = '*', headline: t.Optional[str] = None,
+            headline_options: t.Optional[str] = None, language: str = 'english', vector_column: str = 'search_vector',
+            condition: t.Optional[t.Union[str, t.List, t.Tuple]] = None, offset: t.Optional[int] = None,
+            timeout: t.Optional[float] = None
+    ) -> t.List[t.Tuple]:
+        """
+        Full-text search over a table prepared with ``enable_fulltext``, served by its GIN index.
+
+        ``query`` is parsed with ``websearch_to_tsquery`` (``"quoted phrases"``, ``or``, ``-excluded`` words), so user
+        input can be passed as is; it is sent as a query parameter.
+
+        :param rank: Order the matches by ``ts_rank``, best first, and append the rank to every row.
+        :type rank: bool
+
+        :param headline: A text column to append a highlighted snippet of (``ts_headline``), computed only for the
+            returned rows.
+        :type headline: t.Optional[str]
+
+        :param headline_options: ``ts_headline`` options, e.g. ``'StartSel=<mark>, StopSel=</mark>, MaxFragments=2'``.
+        :type headline_options: t.Optional[str]
+
+        :param language: Must match the configuration passed to ``enable_fulltext``.
+        :type language: str
+
+        :param condition: Extra conditions, same forms as ``select`` conditions.
+        :type condition: t.Optional[t.Union[str, t.List, t.Tuple]]
+
+        :return: The selected columns, followed by the rank if ``rank`` and the snippet if ``headline``.
+        :rtype: t.List[t.Tuple]
+        """
+
+        func_params = {
+            'table_name': table_name, 'query': query, 'limit': limit, 'rank': rank, 'columns': columns,
+            'headline': headline, 'headline_options': headline_options, 'language': language,
+            'vector_column': vector_column, 'condition': condition, 'offset': offset, 'timeout': timeout
+        }
+
+        if type(columns) == str:
+            selected = [f'"{table_name}".*' if columns == '*' else columns]
+        elif type(columns) == list or type(columns) == tuple:
+            selected = list(columns)
+        else:
+            raise TypeError(f'columns must be str, list or tuple: {type(columns)}')
+
+        if rank:
+            selected.append(f'ts_rank("{vector_column}", search_query) AS rank')
+        if headline is not None:
+            options = ', %(headline_options)s' if headline_options is not None else ''
+            selected.append(
+                f'ts_headline(%(language)s::regconfig, "{headline}"::text, search_query{options}) AS headline'
+            )
+
+        sql = f'SELECT {", ".join(selected)} FROM "{table_name}", ' \
+              f'websearch_to_tsquery(%(language)s::regconfig, %(query)s) AS search_query ' \
+              f'WHERE "{vector_column}" @@ search_query'
+        if condition:
+            sql += self._process_condition(condition).replace(' WHERE ', ' AND (', 1).replace('%', '%%') + ')'
+        if rank:
+            sql += ' ORDER BY rank DESC'
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+        if offset:
+            sql += f' OFFSET {int(offset)}'
+
+        return self._execute(
+            func_name='search', sql=sql, type_='READ', func_params=func_params, timeout=timeout,
+            params={'query': query, 'language': language, 'headline_options': headline_options}
+        )
+
+    def _create_index_in_transaction(
+            self, sql: str, table_name: str, settings: t.List[t.Tuple[str, t.Any]],
+            progress_callback: t.Optional[t.Callable], progress_interval: float, func_params: t.Dict
+    ) -> None:
+        params = []
+        prefix = ''
+        for name, value in settings:
+            prefix += f'SET LOCAL {name} = %s; '
+            params.append(value)
+
+        poller = None
+        if progress_callback is not None:
+            poller = IndexProgressPoller(
+                self._new_connection, self._connect().get_backend_pid(), progress_callback, progress_interval
+            )
+            poller.start()
+
+        try:
+            return self._execute(
+                func_name='create_index', sql=prefix + (sql.replace('%', '%%') if params else sql), type_='WRITE',
+                func_params=func_params, params=params or None, table_name=table_name
+            )
+        finally:
+            if poller is not None:
+                poller.stop()
+
+    def _create_index_concurrently(
+            self, sql: str, table_name: str, index_name: str, settings: t.List[t.Tuple[str, t.Any]],
+            progress_callback: t.Optional[t.Callable], progress_interval: float, func_params: t.Dict
+    ) -> None:
+        conn = self._new_connection()
+        conn.autocommit = True
+        poller = None
+
+        try:
+            cur = conn.cursor()
+            self._drop_invalid_indexes(cur, index_name=index_name.lower())
+
+            for name, value in settings:
+                cur.execute(f'SET {name} = %s', (value,))
+
+            if progress_callback is not None:
+                poller = IndexProgressPoller(
+                    self._new_connection, conn.get_backend_pid(), progress_callback, progress_interval
+                )
+                poller.start()
+
+            cur.execute(sql)
+        except Exception as e:
+            try:
+                self._drop_invalid_indexes(conn.cursor(), index_name=index_name.lower())
+            except Exception:
+                pass
+
+            raise exceptions.WriteException(
+                func_name='create_index', message=f'{e}', sql=sql, type_='WRITE', func_params=func_params
+            )
+        finally:
+            if poller is not None:
+                poller.stop()
+            conn.close()
+
+        self._notify_committed('create_index', table_name, 'ddl')
+
+    @staticmethod
+    def _drop_invalid_indexes(
+            cur, table_name: t.Optional[str] = None, index_name: t.Optional[str] = None
+    ) -> t.List[str]:
+        """
+        Drops invalid indexes of the current schema that no ``CREATE INDEX`` is still building.
+
+        ``cur`` must belong to an autocommit connection since ``DROP INDEX CONCURRENTLY`` cannot run in a transaction.
+        """
+
+        sql = '''
+            SELECT i.relname
+            FROM pg_catalog.pg_index x
+            JOIN pg_catalog.pg_class i ON i.oid = x.indexrelid
+            JOIN pg_catalog.pg_class c ON c.oid = x.indrelid
+            JOIN pg_catalog.pg_namespace n ON n.oid = i.relnamespace
+            WHERE NOT x.indisvalid AND n.nspname = current_schema()
+              AND NOT EXISTS (
+                  SELECT 1 FROM pg_catalog.pg_stat_progress_create_index p WHERE p.index_relid = x.indexrelid
+              )
+              AND (%(table_name)s IS NULL OR c.relname = %(table_name)s)
+              AND (%(index_name)s IS NULL OR i.relname = %(index_name)s)
+        '''
+        cur.execute(sql, {'table_name': table_name, 'index_name': index_name})
+        dropped = [row[0] for row in cur.fetchall()]
+
+        for name in dropped:
+            cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+        return dropped
+
+    def cleanup_invalid_indexes(self, table_name: t.Optional[str] = None) -> t.List[str]:
+        """
+        Drops the invalid indexes left behind by failed ``CREATE INDEX CONCURRENTLY`` builds.
+
+        :param table_name: Only clean up the indexes of this table.
+        :type table_name: t.Optional[str]
+
+        :return: The names of the dropped indexes.
+        :rtype: t.List[str]
+        """
+
+        conn = self._new_connection()
+        conn.autocommit = True
+
+        try:
+            dropped = self._drop_invalid_indexes(conn.cursor(), table_name=table_name)
+        except Exception as e:
+            raise exceptions.WriteException(
+                func_name='cleanup_invalid_indexes', message=f'{e}', table_name=table_name
+            )
+        finally:
+            conn.close()
+
+        if self._catalog is not None:
+            for name in dropped:
+                self._catalog.discard_index(name)
+
+        return dropped
 
     def drop_index(
             self, index_name: str, concurrently: bool = None, if_exists: bool = None,
-            restrict: bool = None, cascade: bool = None
+            restrict: bool = None, cascade: bool = None, timeout: t.Optional[float] = None,
+            lock_timeout: t.Optional[float] = None
     ) -> None:
-        __locals__ = locals()
-        __locals__.pop('self')
-        conn = self._connect()
-        cur = conn.cursor()
+        func_params = {
+            'index_name': index_name, 'concurrently': concurrently, 'if_exists': if_exists, 'restrict': restrict,
+            'cascade': cascade, 'timeout': timeout, 'lock_timeout': lock_timeout
+        }
 
         sql = 'DROP INDEX'
 
@@ -503,12 +2040,1338 @@ class PostgresCrud:
         if cascade is not None:
             sql += ' CASCADE'
 
-        return self._execute(func_name='drop_index', sql=sql, type_='WRITE', func_params=__locals__)
+        # Listeners evict cache entries by table, so the table the index belongs to is looked up before it is gone.
+        owner_sql = '''
+            SELECT c.relname
+            FROM pg_catalog.pg_index x
+            JOIN pg_catalog.pg_class c ON c.oid = x.indrelid
+            WHERE x.indexrelid = to_regclass(%s)
+        '''
+        owner = self._execute(
+            func_name='drop_index', sql=owner_sql, type_='READ', params=(f'"{index_name}"',), func_params=func_params
+        )
+
+        res = self._execute(
+            func_name='drop_index', sql=sql, type_='WRITE', func_params=func_params, timeout=timeout,
+            lock_timeout=lock_timeout
+        )
+
+        if self._catalog is not None:
+            self._catalog.discard_index(index_name)
+        if owner:
+            self._notify_committed('drop_index', owner[0][0], 'ddl')
+
+        return res
+
+    def create_materialized_view(
+            self, name: str, query: str, indexes: t.Optional[t.Iterable[t.Union[t.Dict[str, t.Any], t.Any]]] = None,
+            with_data: bool = True
+    ) -> None:
+        """
+        Creates a materialized view storing the result of ``query``, if it does not exist yet.
+
+        ``REFRESH MATERIALIZED VIEW CONCURRENTLY`` (which keeps the view readable during the refresh) needs at least
+        one unique index on plain columns of the view, so create one through ``indexes``.
 
-    def manual_query(self, query: str, type_: str) -> t.Union[t.List, t.Tuple]:
-        __locals__ = locals()
-        __locals__.pop('self')
-        conn = self._connect()
-        cur = conn.cursor()
+        :param indexes: Indexes to create on the view, each either a ``create_index`` ``columns`` value or a dict of
+            ``create_index`` keyword arguments, e.g. ``[{'columns': 'day', 'unique': True}, 'country']``. Indexes
+            without ``index_name`` are named ``<name>_idx<position>``.
+        :type indexes: t.Optional[t.Iterable[t.Union[t.Dict[str, t.Any], t.Any]]]
+
+        :param with_data: Populate the view right away; ``False`` leaves it unreadable until the first refresh.
+        :type with_data: bool
+        """
+
+        func_params = {'name': name, 'query': query, 'indexes': indexes, 'with_data': with_data}
+
+        sql = f'CREATE MATERIALIZED VIEW IF NOT EXISTS "{name}" AS {query} WITH{"" if with_data else " NO"} DATA'
+
+        self._execute(
+            func_name='create_materialized_view', sql=sql, type_='WRITE', func_params=func_params, table_name=name
+        )
+
+        for position, index in enumerate(indexes or ()):
+            kwargs = dict(index) if type(index) == dict else {'columns': index}
+            kwargs.setdefault('index_name', f'{name}_idx{position}')
+            self.create_index(table_name=name, **kwargs)
+
+    def refresh_materialized_view(
+            self, name: str, concurrently: bool = True, timeout: t.Optional[float] = None
+    ) -> float:
+        """
+        Recomputes a materialized view.
+
+        With ``concurrently`` readers keep seeing the old contents during the refresh; it requires a unique index on
+        the view and a populated view.
+
+        :return: The refresh duration in seconds, also recorded in ``materialized_view_stats``.
+        :rtype: float
+        """
+
+        func_params = {'name': name, 'concurrently': concurrently, 'timeout': timeout}
+
+        started = time.perf_counter()
+        try:
+            self._execute(
+                func_name='refresh_materialized_view', sql=matviews.refresh_sql(name, concurrently), type_='WRITE',
+                func_params=func_params, timeout=timeout, table_name=name
+            )
+        except exceptions.WriteException as e:
+            self._refresh_stats.record_error(name, e)
+            raise
+
+        duration = time.perf_counter() - started
+        self._refresh_stats.record(name, duration)
+
+        return duration
+
+    def drop_materialized_view(self, name: str, cascade: bool = False) -> None:
+        func_params = {'name': name, 'cascade': cascade}
+
+        sql = f'DROP MATERIALIZED VIEW IF EXISTS "{name}"{" CASCADE" if cascade else ""}'
+
+        return self._execute(
+            func_name='drop_materialized_view', sql=sql, type_='WRITE', func_params=func_params, table_name=name
+        )
+
+    def schedule_refresh(
+            self, name: str, interval: t.Optional[float] = None, on_change: bool = False, min_interval: float = 0.0,
+            concurrently: bool = True, tick: float = 1.0
+    ) -> matviews.RefreshScheduler:
+        """
+        Refreshes a materialized view from a background thread every ``interval`` seconds and/or, with
+        ``on_change``, whenever the row modification counters (``pg_stat_user_tables``) of the tables it reads from
+        changed, at most once per ``min_interval`` seconds.
+
+        The scheduler checks all its views every ``tick`` seconds on its own connection; it is stopped by
+        ``close()``. Refreshes are recorded in ``materialized_view_stats`` and evict the view from the select cache.
+
+        :return: The scheduler thread.
+        :rtype: matviews.RefreshScheduler
+        """
+
+        if self._refresh_scheduler is None:
+            def on_refresh(view_name: str, cur) -> None:
+                self._notify_write(cur, view_name)
+                self._after_write(view_name)
+
+            self._refresh_scheduler = matviews.RefreshScheduler(
+                self._new_connection, self._refresh_stats, tick=tick, on_refresh=on_refresh
+            )
+            self._refresh_scheduler.start()
+
+        self._refresh_scheduler.add(
+            name, interval=interval, on_change=on_change, min_interval=min_interval, concurrently=concurrently
+        )
+
+        return self._refresh_scheduler
+
+    def unschedule_refresh(self, name: str) -> None:
+        if self._refresh_scheduler is not None:
+            self._refresh_scheduler.remove(name)
+
+    def materialized_view_stats(self, name: t.Optional[str] = None) -> t.Dict[str, t.Any]:
+        """
+        Returns the refresh metrics of one view, or of all refreshed views keyed by name: ``last_refresh`` (epoch
+        seconds), ``last_duration`` and ``staleness`` (seconds since the last successful refresh), ``refresh_count``,
+        ``error_count`` and ``last_error``.
+        """
+
+        return self._refresh_stats.snapshot(name)
+
+    def analyze(self, table_name: t.Optional[str] = None, columns: t.Optional[t.Sequence[str]] = None) -> None:
+        """
+        Refreshes the planner statistics of a table (or of the whole database if ``table_name`` is ``None``).
+
+        :param columns: Only analyze these columns.
+        :type columns: t.Optional[t.Sequence[str]]
+        """
+
+        func_params = {'table_name': table_name, 'columns': columns}
+
+        sql = 'ANALYZE'
+        if table_name is not None:
+            sql += f' "{table_name}"'
+            if columns:
+                sql += f' ({", ".join(columns)})'
+
+        self._execute(func_name='analyze', sql=sql, type_='WRITE', func_params=func_params)
+        self._changed_rows.pop(table_name, None)
+
+    def vacuum(
+            self, table_name: t.Optional[str] = None, full: bool = False, analyze: bool = True,
+            timeout: t.Optional[float] = None
+    ) -> None:
+        """
+        Vacuums a table (or the whole database if ``table_name`` is ``None``).
+
+        ``VACUUM`` cannot run inside a transaction block, so it is issued on a dedicated autocommit connection.
+        ``full`` rewrites the table to return its space to the operating system, holding an ``ACCESS EXCLUSIVE`` lock
+        for the whole rewrite.
+
+        :param analyze: Also refresh the planner statistics.
+        :type analyze: bool
+
+        :param timeout: ``statement_timeout`` in seconds.
+        :type timeout: t.Optional[float]
+        """
+
+        func_params = {'table_name': table_name, 'full': full, 'analyze': analyze, 'timeout': timeout}
+
+        options = []
+        if full:
+            options.append('FULL')
+        if analyze:
+            options.append('ANALYZE')
+
+        sql = 'VACUUM'
+        if options:
+            sql += f' ({", ".join(options)})'
+        if table_name is not None:
+            sql += f' "{table_name}"'
+
+        conn = self._new_connection()
+        conn.autocommit = True
+        try:
+            cur = conn.cursor()
+            if timeout is not None:
+                cur.execute(f'SET statement_timeout = {self._milliseconds(timeout)}')
+            cur.execute(sql)
+        except Exception as e:
+            raise exceptions.WriteException(
+                func_name='vacuum', message=f'{e}', sql=sql, type_='WRITE', func_params=func_params
+            )
+        finally:
+            conn.close()
+
+        if analyze:
+            self._changed_rows.pop(table_name, None)
+
+    def table_health(self, table_name: t.Optional[str] = None) -> t.List[t.Dict[str, t.Any]]:
+        """
+        Reports the maintenance state of the tables of the current schema (or of one table).
+
+        Every entry has ``live_tuples``, ``dead_tuples``, ``dead_ratio``, ``modified_since_analyze``, ``table_size`` and
+        ``total_size`` (bytes, the latter including indexes and TOAST), ``estimated_bloat`` (bytes) and
+        ``estimated_bloat_ratio`` (see ``maintenance.estimate_bloat``), the ``last_vacuum``/``last_autovacuum``/
+        ``last_analyze``/``last_autoanalyze`` timestamps and ``index_sizes`` (index name to bytes).
+
+        :rtype: t.List[t.Dict[str, t.Any]]
+        """
+
+        func_params = {'table_name': table_name}
+
+        rows = self._execute(
+            func_name='table_health', sql=maintenance.HEALTH_SQL, type_='READ', func_params=func_params,
+            params={'table': table_name}
+        )
+
+        return [maintenance.health_row_to_dict(row) for row in rows]
+
+    def enable_auto_analyze(self, fraction: float = 0.1, min_rows: int = 1000) -> None:
+        """
+        Runs ``ANALYZE`` on a table once the writes of this instance changed more than ``fraction`` of its estimated
+        rows, instead of waiting for autovacuum to notice.
+
+        Rows are counted for ``copy_from``, ``parallel_load``, ``from_arrow``/``from_parquet`` and for the statements
+        of ``insert``, ``update`` and ``delete`` methods. The table size is only looked up once ``min_rows`` rows
+        changed, so small writes cost nothing extra.
+
+        :param fraction: The share of the table that must change, e.g. ``0.1`` for 10%.
+        :type fraction: float
+
+        :param min_rows: The minimum number of changed rows before checking.
+        :type min_rows: int
+        """
+
+        self._auto_analyze = (fraction, min_rows)
+
+    def _track_changes(self, table_name: t.Optional[str], rows: int) -> None:
+        if self._auto_analyze is None or table_name is None or rows <= 0:
+            return
+
+        fraction, min_rows = self._auto_analyze
+        changed = self._changed_rows.get(table_name, 0) + rows
+        self._changed_rows[table_name] = changed
+        if changed < min_rows:
+            return
+
+        try:
+            if changed > fraction * self.estimated_count(table_name, fallback=False):
+                self.analyze(table_name)
+        except exceptions.NiceCRUDException:
+            # Best effort: the write itself succeeded, autovacuum will analyze the table eventually.
+            pass
+
+    def advise_indexes(
+            self, min_seq_scans: int = 50, min_table_rows: int = 10000, max_statements: int = 500,
+            limit: t.Optional[int] = None
+    ) -> t.List[t.Dict[str, t.Any]]:
+        """
+        Recommends indexes to create and to drop from the cumulative statistics views.
+
+        Sequentially scanned tables are read from ``pg_stat_user_tables``, never-scanned indexes from
+        ``pg_stat_user_indexes`` and, when the extension is installed, the filtered columns from
+        ``pg_stat_statements``. Without ``pg_stat_statements`` only jsonb/array (GIN) and append-only timestamp
+        (BRIN) columns can be suggested.
+
+        Each recommendation is a dict with ``action`` (``'create_index'`` or ``'drop_index'``), ``kwargs`` ready to be
+        passed to that method, ``benefit`` (page accesses avoided), ``estimated_size`` (bytes) and ``reason``::
+
+            for rec in crud.advise_indexes(limit=5):
+                getattr(crud, rec['action'])(**rec['kwargs'])
+
+        :param min_seq_scans: Ignore tables with fewer sequential scans.
+        :type min_seq_scans: int
+
+        :param min_table_rows: Ignore tables with fewer live rows.
+        :type min_table_rows: int
+
+        :param max_statements: How many of the most expensive statements to inspect.
+        :type max_statements: int
+
+        :param limit: Return at most this many recommendations.
+        :type limit: t.Optional[int]
+
+        :return: The recommendations, best first.
+        :rtype: t.List[t.Dict[str, t.Any]]
+        """
+
+        func_params = {
+            'min_seq_scans': min_seq_scans, 'min_table_rows': min_table_rows, 'max_statements': max_statements,
+            'limit': limit
+        }
+
+        catalog = self.load_catalog(refresh=True)
+        table_stats = self._execute(
+            func_name='advise_indexes', sql=advisor.TABLE_STATS_SQL, type_='READ', func_params=func_params
+        )
+        unused_indexes = self._execute(
+            func_name='advise_indexes', sql=advisor.UNUSED_INDEXES_SQL, type_='READ', func_params=func_params
+        )
+        column_stats = self._execute(
+            func_name='advise_indexes', sql=advisor.COLUMN_STATS_SQL, type_='READ', func_params=func_params
+        )
+
+        statements = []
+        total_time_column = self._execute(
+            func_name='advise_indexes', sql=advisor.STATEMENTS_COLUMN_SQL, type_='READ', func_params=func_params
+        )
+        if total_time_column:
+            try:
+                statements = self._execute(
+                    func_name='advise_indexes', sql=advisor.STATEMENTS_SQL.format(total_time=total_time_column[0][0]),
+                    type_='READ', func_params=func_params, params=(max_statements,)
+                )
+            except exceptions.ReadException:
+                # Installed but not in shared_preload_libraries: the view exists and raises when read.
+                statements = []
+
+        recommendations = advisor.rank_recommendations(
+            catalog, table_stats, unused_indexes, column_stats, statements,
+            min_seq_scans=min_seq_scans, min_table_rows=min_table_rows
+        )
+
+        return recommendations[:limit] if limit else recommendations
+
+    def stream_changes(
+            self, tables: t.Optional[t.Sequence[str]], slot_name: str, plugin: str = 'pgoutput',
+            create_slot: bool = True, ack_interval: float = 1.0, idle_timeout: t.Optional[float] = None,
+            poll_interval: float = 0.5
+    ) -> t.Iterator[t.Dict[str, t.Any]]:
+        """
+        Yields the inserts, updates, deletes and truncates committed to ``tables`` as they happen, read from a logical
+        replication slot instead of polling the tables.
+
+        Each event is a dict with ``operation``, ``schema``, ``table``, ``new`` (the new row, as a column -> value
+        dict), ``old`` (the replica identity - by default the primary key - of an updated or deleted row, when the
+        plugin sends it), ``xid`` and ``lsn``.
+
+        The slot is created by this call if missing (for ``pgoutput``, with a publication ``<slot_name>_pub`` for
+        ``tables``), so changes committed after it returns are captured. The slot keeps its position on the server:
+        an event is acknowledged once the consumer asks for the next one, in batches every ``ack_interval`` seconds,
+        and a stream restarted on the same slot resumes after the last acknowledged event. Events not acknowledged
+        before a crash are delivered again (at-least-once). An unused slot holds back WAL on the server: drop it with
+        ``drop_change_stream`` when done.
+
+        Requires ``wal_level = logical`` and the ``REPLICATION`` privilege; ``wal2json`` must be installed on the
+        server to be used.
+
+        :param tables: The tables to stream; ``None`` for all tables (``pgoutput``: ``FOR ALL TABLES``, which
+            requires superuser).
+        :type tables: t.Optional[t.Sequence[str]]
+
+        :param plugin: ``'pgoutput'``, ``'wal2json'`` or ``'test_decoding'``, used when creating the slot; an existing
+            slot keeps its plugin.
+        :type plugin: str
+
+        :param idle_timeout: Stop after this many seconds without a change; ``None`` streams until the generator is
+            closed.
+        :type idle_timeout: t.Optional[float]
+
+        :return: A generator of change events.
+        :rtype: t.Iterator[t.Dict[str, t.Any]]
+        """
+
+        if plugin not in cdc.PLUGINS:
+            raise ValueError(f'plugin must be one of {cdc.PLUGINS}: {plugin}')
+
+        # Captured before ``tables`` and ``plugin`` are normalized, for error reports.
+        func_params = {'tables': tables, 'slot_name': slot_name, 'plugin': plugin, 'create_slot': create_slot}
+        tables = list(tables) if tables else []
+        publication = cdc.publication_name(slot_name)
+
+        existing = self._execute(
+            func_name='stream_changes', sql=cdc.SLOT_SQL, type_='READ', params=(slot_name,), func_params=func_params
+        )
+        if existing:
+            plugin = existing[0][0]
+        elif not create_slot:
+            raise exceptions.ReadException(
+                func_name='stream_changes', message=f'replication slot "{slot_name}" does not exist', type_='READ',
+                func_params=func_params
+            )
+
+        if plugin == 'pgoutput' and not self._execute(
+                func_name='stream_changes', sql=cdc.PUBLICATION_SQL, type_='READ', params=(publication,),
+                func_params=func_params
+        ):
+            target = ', '.join(f'"{table}"' for table in tables) if tables else None
+            self._execute(
+                func_name='stream_changes', type_='WRITE', func_params=func_params,
+                sql=f'CREATE PUBLICATION "{publication}" FOR {f"TABLE {target}" if target else "ALL TABLES"}'
+            )
+
+        if not existing:
+            # Created now rather than when iteration starts, so the changes committed in between are not missed.
+            self._execute(
+                func_name='stream_changes', sql='SELECT pg_catalog.pg_create_logical_replication_slot(%s, %s)',
+                type_='WRITE', params=(slot_name, plugin), func_params=func_params
+            )
+
+        decoder = cdc.DECODERS[plugin]()
+        options = decoder.options(tables, publication)
+
+        def events() -> t.Iterator[t.Dict[str, t.Any]]:
+            try:
+                conn = psycopg2.connect(
+                    **self._connection_kwargs(), connection_factory=psycopg2.extras.LogicalReplicationConnection
+                )
+            except Exception as e:
+                raise exceptions.ConnectionException(
+                    func_name='stream_changes', message=f'Connection Error: {e}', db_data=self._db_data_to_dict()
+                )
+
+            cur = conn.cursor()
+            processed = acknowledged = 0
+            last_ack = last_change = time.monotonic()
+            try:
+                cur.start_replication(slot_name=slot_name, options=options, decode=False)
+
+                while True:
+                    message = cur.read_message()
+                    now = time.monotonic()
+
+                    if message is None:
+                        # Everything received was consumed: acknowledge the position the server decoded up to, so an
+                        # idle slot (or one streaming other tables' changes) does not hold back WAL.
+                        if not decoder.in_transaction:
+                            processed = max(processed, cur.wal_end)
+                        if idle_timeout is not None and now - last_change >= idle_timeout:
+                            return
+                        select.select([cur], [], [], poll_interval)
+                    else:
+                        last_change = now
+                        for change in decoder.decode(message.payload):
+                            change['lsn'] = cdc.format_lsn(message.data_start)
+                            yield change
+                        processed = max(processed, cdc.acknowledgeable(decoder, message.data_start) or 0)
+
+                    if processed > acknowledged and now - last_ack >= ack_interval:
+                        cur.send_feedback(flush_lsn=processed, force=True)
+                        acknowledged, last_ack = processed, now
+            except psycopg2.Error as e:
+                raise exceptions.ReadException(
+                    func_name='stream_changes', message=f'{e}', type_='READ', func_params=func_params
+                )
+            finally:
+                if processed > acknowledged and not conn.closed:
+                    try:
+                        cur.send_feedback(flush_lsn=processed, force=True)
+                    except psycopg2.Error:
+                        pass
+                conn.close()
+
+        return events()
+
+    def drop_change_stream(self, slot_name: str) -> None:
+        """ Drops a replication slot created by ``stream_changes``, and its publication """
+
+        func_params = {'slot_name': slot_name}
+
+        slots = self._execute(
+            func_name='drop_change_stream', sql=cdc.SLOT_SQL, type_='READ', func_params=func_params, params=(slot_name,)
+        )
+        if slots:
+            self._execute(
+                func_name='drop_change_stream', sql='SELECT pg_catalog.pg_drop_replication_slot(%s)', type_='WRITE',
+                func_params=func_params, params=(slot_name,)
+            )
+        self._execute(
+            func_name='drop_change_stream', type_='WRITE', func_params=func_params,
+            sql=f'DROP PUBLICATION IF EXISTS "{cdc.publication_name(slot_name)}"'
+        )
+
+    def create_queue(self, queue_name: str) -> None:
+        """
+        Creates the table of a job queue, see ``enqueue_many`` and ``dequeue``. Does nothing if it exists.
+        """
+
+        func_params = {'queue_name': queue_name}
+
+        self._execute(
+            func_name='create_queue', sql=jobqueue.create_sql(queue_name), type_='WRITE', func_params=func_params
+        )
+
+    def enqueue_many(self, queue_name: str, payloads: t.Iterable[t.Any], delay: float = 0.0) -> t.List[int]:
+        """
+        Adds jobs to a queue in one statement and wakes up waiting consumers.
+
+        :param payloads: The JSON-serializable payloads of the jobs.
+        :type payloads: t.Iterable[t.Any]
+
+        :param delay: Seconds before the jobs can be dequeued.
+        :type delay: float
+
+        :return: The ids of the jobs.
+        :rtype: t.List[int]
+        """
+
+        func_params = {'queue_name': queue_name, 'payloads': payloads, 'delay': delay}
+
+        rows = self._execute(
+            func_name='enqueue_many', sql=jobqueue.enqueue_sql(queue_name), type_='WRITE', func_params=func_params,
+            returning=True, table_name=queue_name,
+            params={'channel': jobqueue.channel(queue_name), 'delay': delay, 'payloads': jobqueue.encode(payloads)}
+        )
+
+        return [row[0] for row in rows]
+
+    def dequeue(
+            self, queue_name: str, batch: int = 1, visibility_timeout: float = 30.0, wait: float = 0.0
+    ) -> t.List[t.Dict[str, t.Any]]:
+        """
+        Leases up to ``batch`` visible jobs, oldest first, as dicts with ``id``, ``payload``, ``attempts`` and
+        ``enqueued_at``.
+
+        Jobs are selected with ``FOR UPDATE SKIP LOCKED``, so concurrent consumers never block each other nor lease
+        the same job. A leased job stays invisible for ``visibility_timeout`` seconds: ``ack`` it when done, ``nack``
+        it to retry it, or it becomes visible again when the lease expires (e.g. the consumer died).
+
+        :param wait: Seconds to wait for jobs when the queue is empty. The consumer sleeps on ``LISTEN`` until
+            ``enqueue_many`` notifies it, or until the next delayed job or expired lease becomes visible.
+        :type wait: float
+
+        :return: The leased jobs; empty if none became available within ``wait``.
+        :rtype: t.List[t.Dict[str, t.Any]]
+        """
+
+        func_params = {'queue_name': queue_name, 'batch': batch, 'visibility_timeout': visibility_timeout, 'wait': wait}
+
+        deadline = time.monotonic() + wait
+        params = {'batch': batch, 'visibility_timeout': visibility_timeout}
+
+        while True:
+            rows = self._execute(
+                func_name='dequeue', sql=jobqueue.dequeue_sql(queue_name), type_='WRITE', func_params=func_params,
+                returning=True, params=params, table_name=queue_name
+            )
+            remaining = deadline - time.monotonic()
+            if rows or remaining <= 0:
+                return [jobqueue.job_to_dict(row) for row in rows]
+
+            listener = self._queue_listeners.get(queue_name)
+            if listener is None:
+                # Listen before looking again, so a job enqueued in between is not slept through.
+                self._queue_listeners[queue_name] = self._new_listener(jobqueue.channel(queue_name))
+                continue
+
+            next_visible = self._execute(
+                func_name='dequeue', sql=jobqueue.next_visible_sql(queue_name), type_='READ', func_params=func_params
+            )
+            if next_visible[0][0] is not None:
+                remaining = min(remaining, max(float(next_visible[0][0]), 0.0))
+
+            select.select([listener], [], [], remaining)
+            listener.poll()
+            listener.notifies.clear()
+
+    def _new_listener(self, channel: str):
+        conn = self._new_connection()
+        conn.autocommit = True
+        conn.cursor().execute(f'LISTEN "{channel}"')
+
+        return conn
+
+    def ack(self, queue_name: str, jobs: t.Iterable[t.Dict[str, t.Any]]) -> int:
+        """
+        Deletes finished jobs. A job whose lease expired and was leased again by another consumer is left alone.
+
+        :return: The number of jobs deleted.
+        :rtype: int
+        """
+
+        func_params = {'queue_name': queue_name, 'jobs': jobs}
+
+        return len(self._execute(
+            func_name='ack', table_name=queue_name, sql=jobqueue.ack_sql(queue_name), type_='WRITE',
+            func_params=func_params, returning=True, params=jobqueue.receipts(jobs)
+        ))
+
+    def nack(self, queue_name: str, jobs: t.Iterable[t.Dict[str, t.Any]], delay: float = 0.0) -> int:
+        """
+        Releases leased jobs to be retried after ``delay`` seconds; their ``attempts`` count is kept.
+
+        :return: The number of jobs released.
+        :rtype: int
+        """
+
+        func_params = {'queue_name': queue_name, 'jobs': jobs, 'delay': delay}
+
+        return len(self._execute(
+            func_name='nack', table_name=queue_name, sql=jobqueue.nack_sql(queue_name), type_='WRITE',
+            func_params=func_params, returning=True, params=dict(jobqueue.receipts(jobs), delay=delay)
+        ))
+
+    def copy_from(
+            self, table_name: str, source: t.Union[str, t.IO, t.Iterable[t.Sequence[t.Any]]],
+            columns: t.Optional[t.Sequence[str]] = None, format: str = 'csv', header: bool = False,
+            delimiter: t.Optional[str] = None
+    ) -> int:
+        """
+        Bulk loads rows with ``COPY ... FROM STDIN`` in one transaction.
+
+        :param source: A file path, a readable file object, or an iterable of row sequences (streamed as CSV).
+        :type source: t.Union[str, t.IO, t.Iterable[t.Sequence[t.Any]]]
+
+        :param columns: The target columns, in the order of the source fields.
+        :type columns: t.Optional[t.Sequence[str]]
+
+        :param format: ``'csv'``, ``'text'`` or ``'binary'`` (ignored for iterables, which are always CSV).
+        :type format: str
+
+        :return: The number of rows copied.
+        :rtype: int
+        """
+
+        func_params = {
+            'table_name': table_name, 'columns': columns, 'format': format, 'header': header, 'delimiter': delimiter
+        }
+
+        opened = None
+        if isinstance(source, (str, os.PathLike)):
+            stream = opened = open(source, 'rb')
+        elif hasattr(source, 'read'):
+            stream = source
+        else:
+            stream = bulk.RowStream(source)
+
+        if isinstance(stream, bulk.RowStream):
+            options = ['FORMAT csv']
+        else:
+            options = [f'FORMAT {format}']
+            if header:
+                options.append('HEADER true')
+            if delimiter is not None:
+                options.append(f"DELIMITER '{delimiter}'")
+
+        sql = f'COPY "{table_name}"'
+        if columns:
+            sql += f' ({", ".join(columns)})'
+        sql += f' FROM STDIN WITH ({", ".join(options)})'
+
+        conn = self._connect()
+        cur = conn.cursor()
+
+        try:
+            cur.copy_expert(sql, stream)
+            rows = cur.rowcount
+            self._notify_write(cur, table_name)
+            conn.commit()
+            self._after_write(table_name)
+        except Exception as e:
+            conn.rollback()
+            raise exceptions.WriteException(
+                func_name='copy_from', message=f'{e}', sql=sql, type_='WRITE',
+                func_params=func_params
+            )
+        finally:
+            if opened is not None:
+                opened.close()
+            if self._close_conn:
+                self._close()
+
+        self._track_changes(table_name, rows)
+
+        return rows
+
+    def copy_to(self, query: str, destination: t.Union[str, t.IO], format: str = 'csv', header: bool = False) -> int:
+        """
+        Streams the result of ``query`` (or a whole table, if ``query`` is a table name) with ``COPY ... TO STDOUT``.
+
+        :param destination: A file path or a writable file object.
+        :type destination: t.Union[str, t.IO]
+
+        :param format: ``'csv'``, ``'text'`` or ``'binary'``.
+        :type format: str
+
+        :return: The number of rows copied.
+        :rtype: int
+        """
+
+        func_params = {'query': query, 'destination': destination, 'format': format, 'header': header}
+
+        source = f'({query})' if ' ' in query.strip() else f'"{query}"'
+        options = [f'FORMAT {format}']
+        if header:
+            options.append('HEADER true')
+        sql = f'COPY {source} TO STDOUT WITH ({", ".join(options)})'
+
+        opened = None
+        target = destination
+        if isinstance(destination, (str, os.PathLike)):
+            target = opened = open(destination, 'wb')
+
+        conn = self._connect()
+        cur = conn.cursor()
+
+        try:
+            cur.copy_expert(sql, target)
+            conn.commit()
+            return cur.rowcount
+        except Exception as e:
+            conn.rollback()
+            raise exceptions.ReadException(
+                func_name='copy_to', message=f'{e}', sql=sql, type_='READ', func_params=func_params
+            )
+        finally:
+            if opened is not None:
+                opened.close()
+            if self._close_conn:
+                self._close()
+
+    def write_blob(
+            self, table_name: str, key: t.Any, stream: t.Union[str, t.IO], column: str = 'data',
+            key_column: str = 'id', large_object: bool = False, chunk_size: int = 1024 * 1024
+    ) -> int:
+        """
+        Streams a binary value into ``column`` of the row whose ``key_column`` equals ``key``, reading ``stream`` one
+        ``chunk_size`` chunk at a time, so the value is never held in memory (nor inlined into the SQL text).
+
+        For a ``bytea`` column the chunks are staged in a temporary table and assembled server side by a single
+        ``UPDATE``. With ``large_object=True`` the column holds the ``oid`` of a large object written with
+        ``lo_write``; the large object it pointed to before is unlinked. Either way the new value becomes visible
+        at once, when the transaction commits.
+
+        :param stream: A file path or a readable binary file object.
+        :type stream: t.Union[str, t.IO]
+
+        :return: The number of bytes written.
+        :rtype: int
+        """
+
+        func_params = {
+            'table_name': table_name, 'key': key, 'stream': stream, 'column': column, 'key_column': key_column,
+            'large_object': large_object, 'chunk_size': chunk_size
+        }
+
+        opened = None
+        reader = stream
+        if isinstance(stream, (str, os.PathLike)):
+            reader = opened = open(stream, 'rb')
+
+        conn = self._connect()
+        cur = conn.cursor()
+        size = 0
+
+        try:
+            cur.execute(
+                f'SELECT "{column}" FROM "{table_name}" WHERE "{key_column}" = %s FOR UPDATE', (key,)
+            )
+            row = cur.fetchone()
+            if row is None:
+                raise ValueError(f'no row with {key_column} = {key!r} in "{table_name}"')
+
+            if large_object:
+                lobject = conn.lobject(0, 'wb')
+                for chunk in iter(lambda: reader.read(chunk_size), b''):
+                    size += lobject.write(chunk)
+                lobject.close()
+
+                cur.execute(
+                    f'UPDATE "{table_name}" SET "{column}" = %s WHERE "{key_column}" = %s', (lobject.oid, key)
+                )
+                if row[0] is not None:
+                    cur.execute('SELECT pg_catalog.lo_unlink(%s)', (row[0],))
+            else:
+                cur.execute('CREATE TEMPORARY TABLE nice_crud_blob_chunks (n integer, chunk bytea) ON COMMIT DROP')
+                for n, chunk in enumerate(iter(lambda: reader.read(chunk_size), b'')):
+                    cur.execute('INSERT INTO nice_crud_blob_chunks VALUES (%s, %s)', (n, psycopg2.Binary(chunk)))
+                    size += len(chunk)
+
+                cur.execute(
+                    f'UPDATE "{table_name}" SET "{column}" = coalesce('
+                    f"(SELECT string_agg(chunk, ''::bytea ORDER BY n) FROM nice_crud_blob_chunks), ''::bytea) "
+                    f'WHERE "{key_column}" = %s', (key,)
+                )
+
+            self._notify_write(cur, table_name)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise exceptions.WriteException(
+                func_name='write_blob', message=f'{e}', type_='WRITE', func_params=func_params
+            )
+        finally:
+            if opened is not None:
+                opened.close()
+            if self._close_conn:
+                self._close()
+
+        self._after_write(table_name)
+
+        return size
+
+    def read_blob(
+            self, table_name: str, key: t.Any, column: str = 'data', key_column: str = 'id', large_object: bool = False,
+            chunk_size: int = 1024 * 1024
+    ) -> t.Iterator[bytes]:
+        """
+        Streams a binary value out of ``column`` in chunks of at most ``chunk_size`` bytes, with ``substring``
+        offsets for ``bytea`` and ``lo_read`` for large objects.
+
+        The chunks are read on a dedicated connection, opened when iteration starts, in one ``REPEATABLE READ``
+        transaction, so they all come from the same version of the value; the connection is closed when the iterator
+        is exhausted or closed. Slicing a
+        ``bytea`` is cheapest when the column is stored uncompressed (``ALTER TABLE ... ALTER COLUMN ... SET STORAGE
+        EXTERNAL``); a compressed value is decompressed for every chunk.
+
+        Errors, e.g. a missing row, are raised when iteration starts.
+
+        :return: An iterator of ``bytes`` chunks; ``None`` values yield nothing.
+        :rtype: t.Iterator[bytes]
+        """
+
+        func_params = {
+            'table_name': table_name, 'key': key, 'column': column, 'key_column': key_column,
+            'large_object': large_object, 'chunk_size': chunk_size,
+        }
+
+        def chunks() -> t.Iterator[bytes]:
+            conn = self._new_connection()
+            conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+            try:
+                cur = conn.cursor()
+                selected = 'pg_catalog.octet_length("{0}")' if not large_object else '"{0}"'
+                try:
+                    cur.execute(
+                        f'SELECT {selected.format(column)} FROM "{table_name}" WHERE "{key_column}" = %s', (key,)
+                    )
+                    row = cur.fetchone()
+                except Exception as e:
+                    raise exceptions.ReadException(
+                        func_name='read_blob', message=f'{e}', type_='READ', func_params=func_params
+                    )
+
+                if row is None:
+                    raise exceptions.ReadException(
+                        func_name='read_blob', message=f'no row with {key_column} = {key!r} in "{table_name}"',
+                        type_='READ', func_params=func_params
+                    )
+                if row[0] is None:
+                    return
+
+                if large_object:
+                    lobject = conn.lobject(row[0], 'rb')
+                    for chunk in iter(lambda: lobject.read(chunk_size), b''):
+                        yield chunk
+                    lobject.close()
+                else:
+                    sql = f'SELECT substring("{column}" FROM %s FOR %s) FROM "{table_name}" WHERE "{key_column}" = %s'
+                    for offset in range(1, row[0] + 1, chunk_size):
+                        cur.execute(sql, (offset, chunk_size, key))
+                        yield bytes(cur.fetchone()[0])
+            finally:
+                conn.close()
+
+        return chunks()
+
+    def _index_definitions(self, table_name: str) -> t.List[t.Tuple[str, str]]:
+        """ ``(name, CREATE INDEX statement)`` of the non-unique indexes of a table that do not back a constraint """
+
+        sql = '''
+            SELECT i.relname, pg_catalog.pg_get_indexdef(i.oid)
+            FROM pg_catalog.pg_index x
+            JOIN pg_catalog.pg_class i ON i.oid = x.indexrelid
+            WHERE x.indrelid = to_regclass(%s) AND NOT x.indisunique
+              AND NOT EXISTS (SELECT 1 FROM pg_catalog.pg_constraint c WHERE c.conindid = x.indexrelid)
+        '''
+
+        return self._execute(
+            func_name='index_definitions', sql=sql, type_='READ', func_params={'table_name': table_name},
+            params=(f'"{table_name}"',)
+        )
+
+    def _foreign_keys(self, table_name: str) -> t.List[t.Tuple[str, str]]:
+        """ ``(name, constraint definition)`` of the foreign keys declared on a table """
+
+        sql = '''
+            SELECT conname, pg_catalog.pg_get_constraintdef(oid)
+            FROM pg_catalog.pg_constraint
+            WHERE conrelid = to_regclass(%s) AND contype = 'f'
+        '''
+
+        return self._execute(
+            func_name='foreign_keys', sql=sql, type_='READ', func_params={'table_name': table_name},
+            params=(f'"{table_name}"',)
+        )
+
+    def parallel_load(
+            self, table_name: str, source: t.Union[str, t.Iterable[t.Sequence[t.Any]]], workers: int = 4,
+            columns: t.Optional[t.Sequence[str]] = None, format: str = 'csv', header: bool = False,
+            delimiter: t.Optional[str] = None, chunk_rows: int = 50000, defer_indexes: bool = False,
+            mp_context: str = 'spawn'
+    ) -> t.Dict[str, t.Any]:
+        """
+        Loads a file or an iterable of rows with a pool of worker processes, each streaming its share via COPY.
+
+        A file is split into ``workers`` newline-aligned byte ranges (one record per line is assumed, so
+        ``format='binary'`` files are rejected); an iterable is split into ``chunk_rows``-row chunks that are sent to
+        the workers. Every worker opens its own connection, so
+        the cached ``_conn`` never crosses a process boundary, and every shard is committed on its own: a failed shard
+        is reported in ``errors`` without rolling back the others.
+
+        With ``defer_indexes=True`` the table's foreign keys and the non-unique indexes that do not back a constraint
+        are dropped before the load and recreated once all workers are done. Unique indexes and constraints are kept,
+        so duplicates are still rejected while loading. Every deferred one is recreated; those that fail (e.g. a
+        foreign key the loaded rows violate) are reported in ``errors`` with their ``statement``.
+
+        :return: ``rows``, ``seconds``, ``rows_per_sec``, ``errors`` and per-pid ``workers`` stats
+            (``rows``, ``seconds``, ``tasks``, ``rows_per_sec``, ``errors``).
+        :rtype: t.Dict[str, t.Any]
+        """
+
+        func_params = {
+            'table_name': table_name, 'workers': workers, 'columns': columns, 'format': format, 'header': header,
+            'delimiter': delimiter, 'chunk_rows': chunk_rows, 'defer_indexes': defer_indexes, 'mp_context': mp_context
+        }
+
+        if format == 'binary' and isinstance(source, (str, os.PathLike)):
+            raise ValueError('binary COPY files cannot be split at newlines, load them with copy_from')
+
+        indexes, foreign_keys = [], []
+        if defer_indexes:
+            indexes = self._index_definitions(table_name)
+            foreign_keys = self._foreign_keys(table_name)
+            statements = [f'ALTER TABLE "{table_name}" DROP CONSTRAINT "{name}"' for name, _ in foreign_keys]
+            statements += [f'DROP INDEX "{name}"' for name, _ in indexes]
+            if statements:
+                self._execute(
+                    func_name='parallel_load', sql='; '.join(statements), type_='WRITE', func_params=func_params
+                )
+
+        try:
+            report = bulk.run_parallel_load(
+                self._connection_kwargs(), table_name, source, workers, columns, chunk_rows,
+                {'format': format, 'header': header, 'delimiter': delimiter}, mp_context
+            )
+        except Exception as e:
+            failures = self._recreate_deferred(table_name, indexes, foreign_keys)
+            if failures:
+                raise exceptions.WriteException(
+                    func_name='parallel_load', message=f'{e}; then failed to recreate: '
+                    + '; '.join(f'{failure["statement"]}: {failure["error"]}' for failure in failures),
+                    func_params=func_params
+                ) from e
+            raise
+
+        report['errors'] += self._recreate_deferred(table_name, indexes, foreign_keys)
+
+        if report['rows']:
+            self._notify_committed('parallel_load', table_name)
+            self._track_changes(table_name, report['rows'])
+
+        return report
+
+    def _recreate_deferred(
+            self, table_name: str, indexes: t.List[t.Tuple[str, str]], foreign_keys: t.List[t.Tuple[str, str]]
+    ) -> t.List[t.Dict[str, t.Any]]:
+        """ Recreates the indexes and foreign keys dropped by ``parallel_load``, going on after a failure """
+
+        statements = [definition for _, definition in indexes]
+        statements += [
+            f'ALTER TABLE "{table_name}" ADD CONSTRAINT "{name}" {definition}' for name, definition in foreign_keys
+        ]
+
+        failures = []
+        for statement in statements:
+            try:
+                self._execute(
+                    func_name='parallel_load', sql=statement, type_='WRITE', func_params={'table_name': table_name}
+                )
+            except exceptions.WriteException as e:
+                failures.append({'pid': None, 'statement': statement, 'error': str(e)})
+
+        return failures
+
+    def _build_index(self, sql: str, maintenance_work_mem: t.Optional[str]) -> None:
+        """ Runs one index build on its own connection, so several builds can run in parallel """
+
+        conn = self._new_connection()
+        try:
+            cur = conn.cursor()
+            if maintenance_work_mem is not None:
+                cur.execute('SET LOCAL maintenance_work_mem = %s', (maintenance_work_mem,))
+            cur.execute(sql)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _drop_in_background(self, table_name: str) -> threading.Thread:
+        def drop() -> None:
+            conn = self._new_connection()
+            try:
+                conn.cursor().execute(f'DROP TABLE IF EXISTS "{table_name}"')
+                conn.commit()
+            finally:
+                conn.close()
+
+        thread = threading.Thread(target=drop, name=f'nice_crud-drop-{table_name}', daemon=True)
+        thread.start()
+        self._background_drops = [t_ for t_ in self._background_drops if t_.is_alive()] + [thread]
+
+        return thread
+
+    def replace_table(
+            self, table_name: str, source: t.Union[str, t.IO, t.Iterable[t.Sequence[t.Any]]],
+            columns: t.Optional[t.Sequence[str]] = None, format: str = 'csv', header: bool = False,
+            delimiter: t.Optional[str] = None, index_workers: int = 4, maintenance_work_mem: t.Optional[str] = None,
+            lock_timeout: float = 5.0, drop_old: bool = True
+    ) -> int:
+        """
+        Replaces the whole contents of a table without exposing partial data or leaving bloat behind.
+
+        The data is loaded with ``COPY`` into an ``UNLOGGED`` copy of the table (``<table>__new``: columns, defaults,
+        check constraints, generated and identity columns, but no indexes). The indexes, primary key, unique,
+        exclusion and foreign key constraints are then built, the index builds in parallel on ``index_workers``
+        connections. The copy is switched to ``LOGGED`` and swapped in by renaming in one short transaction, which
+        waits at most ``lock_timeout`` seconds for readers of the old table. ``serial`` sequences are handed over to
+        the new table, identity sequences continue after the old values. The old table, renamed to ``<table>__old``,
+        is dropped in a background thread.
+
+        Writes to the table while this runs are lost, privileges and triggers are not copied, and the table must not
+        be partitioned or referenced by foreign keys or views (they would keep pointing to the old table).
+
+        :param source: A file path, a readable file object, or an iterable of row sequences, see ``copy_from``.
+        :type source: t.Union[str, t.IO, t.Iterable[t.Sequence[t.Any]]]
+
+        :param index_workers: How many indexes to build at the same time.
+        :type index_workers: int
+
+        :param maintenance_work_mem: ``maintenance_work_mem`` for the index builds, e.g. ``'1GB'``.
+        :type maintenance_work_mem: t.Optional[str]
+
+        :param drop_old: Drop the old table; otherwise it is kept as ``<table>__old``.
+        :type drop_old: bool
+
+        :return: The number of rows loaded.
+        :rtype: int
+        """
+
+        func_params = {
+            'table_name': table_name, 'columns': columns, 'format': format, 'header': header, 'delimiter': delimiter,
+            'index_workers': index_workers, 'maintenance_work_mem': maintenance_work_mem, 'lock_timeout': lock_timeout,
+            'drop_old': drop_old
+        }
+
+        relkind = self._execute(
+            func_name='replace_table', sql=swap.RELKIND_SQL, type_='READ', func_params=func_params,
+            params=(f'"{table_name}"',)
+        )
+        if not relkind or relkind[0][0] != 'r':
+            raise exceptions.WrongMethodException(
+                func_name='replace_table', message=f'"{table_name}" is not a plain table', table_name=table_name
+            )
+
+        dependents = self._execute(
+            func_name='replace_table', sql=swap.DEPENDENTS_SQL, type_='READ', func_params=func_params,
+            params={'table': f'"{table_name}"'}
+        )
+        if dependents:
+            raise exceptions.WrongMethodException(
+                func_name='replace_table', table_name=table_name,
+                message=f'"{table_name}" is referenced by {", ".join(row[0] for row in dependents)}'
+            )
+
+        staging = swap.suffixed(table_name, swap.NEW_SUFFIX)
+        old = swap.suffixed(table_name, swap.OLD_SUFFIX)
+
+        constraints = self._execute(
+            func_name='replace_table', sql=swap.CONSTRAINTS_SQL, type_='READ', func_params=func_params,
+            params=(f'"{table_name}"',)
+        )
+        indexes = self._index_definitions(table_name)
+        sequences = self._execute(
+            func_name='replace_table', sql=swap.SERIAL_SEQUENCES_SQL, type_='READ', func_params=func_params,
+            params=(f'"{table_name}"',)
+        )
+        identities = self._execute(
+            func_name='replace_table', sql=swap.IDENTITY_COLUMNS_SQL, type_='READ', func_params=func_params,
+            params=(f'"{table_name}"',)
+        )
+
+        self._execute(
+            func_name='replace_table', type_='WRITE', func_params=func_params,
+            sql=f'DROP TABLE IF EXISTS "{staging}"; '
+                f'CREATE UNLOGGED TABLE "{staging}" (LIKE "{table_name}" {swap.LIKE_OPTIONS})'
+        )
+
+        try:
+            rows = self.copy_from(staging, source, columns=columns, format=format, header=header, delimiter=delimiter)
+
+            builds = [swap.retarget_index(definition, swap.suffixed(name, swap.NEW_SUFFIX), staging)
+                      for name, definition in indexes]
+            builds += [swap.retarget_index(index_definition, swap.suffixed(name, swap.NEW_SUFFIX), staging)
+                       for name, contype, index_definition, _, _, _ in constraints if contype in ('p', 'u')]
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(index_workers, 1)) as pool:
+                for future in [pool.submit(self._build_index, sql, maintenance_work_mem) for sql in builds]:
+                    future.result()
+
+            statements = [
+                swap.constraint_statement(staging, name, contype, deferrable, deferred, definition)
+                for name, contype, _, deferrable, deferred, definition in constraints
+            ]
+            statements += [
+                f"SELECT setval(pg_catalog.pg_get_serial_sequence('\"{staging}\"', '{column}'), greatest("
+                f"pg_catalog.pg_sequence_last_value(pg_catalog.pg_get_serial_sequence('\"{table_name}\"', '{column}')),"
+                f' (SELECT max("{column}") FROM "{staging}"), 1))'
+                for column, in identities
+            ]
+            statements += [
+                f'SELECT setval(\'"{sequence}"\', greatest(pg_catalog.pg_sequence_last_value(\'"{sequence}"\'),'
+                f' (SELECT max("{column}") FROM "{staging}"), 1))'
+                for sequence, column in sequences
+            ]
+            statements.append(f'ALTER TABLE "{staging}" SET LOGGED')
+            self._execute(func_name='replace_table', sql='; '.join(statements), type_='WRITE', func_params=func_params)
+        except Exception as e:
+            try:
+                self._execute(
+                    func_name='replace_table', sql=f'DROP TABLE IF EXISTS "{staging}"', type_='WRITE',
+                    func_params=func_params
+                )
+            except exceptions.NiceCRUDException:
+                pass
+
+            if isinstance(e, exceptions.NiceCRUDException):
+                raise
+            raise exceptions.WriteException(
+                func_name='replace_table', message=f'{e}', func_params=func_params
+            )
+
+        statements = swap.swap_statements(
+            table_name, [row[0] for row in constraints], [name for name, _ in indexes], sequences
+        )
+        self._execute(
+            func_name='replace_table', sql='; '.join(statements), type_='WRITE', func_params=func_params,
+            lock_timeout=lock_timeout, table_name=table_name
+        )
+
+        if self._catalog is not None:
+            self._catalog.discard_table(table_name)
+            self._catalog.discard_table(staging)
+
+        if drop_old:
+            self._drop_in_background(old)
+
+        return rows
+
+    def _describe(self, func_name: str, query: str) -> t.List[t.Tuple[str, int]]:
+        """ ``(column name, type oid)`` of the result of a query, without fetching any row """
+
+        conn = self._connect()
+        cur = conn.cursor()
+
+        try:
+            cur.execute(f'SELECT * FROM ({query}) AS q LIMIT 0')
+            return [(column.name, column.type_code) for column in cur.description]
+        except Exception as e:
+            conn.rollback()
+            raise exceptions.ReadException(func_name=func_name, message=f'{e}', sql=query, type_='READ')
+
+    def _copy_to_arrow(self, func_name: str, query: str, on_batch: t.Callable, batch_rows: int):
+        columns = self._describe(func_name, query)
+        select = ', '.join(
+            f'"{name}"' if oid in arrow.SUPPORTED_OIDS else f'"{name}"::text' for name, oid in columns
+        )
+        oids = [oid if oid in arrow.SUPPORTED_OIDS else 25 for _, oid in columns]
+        sql = f'COPY (SELECT {select} FROM ({query}) AS q) TO STDOUT WITH (FORMAT binary)'
+
+        decoder = arrow.BinaryCopyDecoder([name for name, _ in columns], oids, on_batch, batch_rows)
+        conn = self._connect()
+        cur = conn.cursor()
+
+        try:
+            cur.copy_expert(sql, decoder)
+            decoder.close()
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise exceptions.ReadException(func_name=func_name, message=f'{e}', sql=sql, type_='READ')
+        finally:
+            if self._close_conn:
+                self._close()
+
+        return decoder
+
+    def to_arrow(self, query: str, batch_rows: int = 65536):
+        """
+        Runs a query and returns the result as a ``pyarrow.Table``.
+
+        The rows are streamed with ``COPY (query) TO STDOUT (FORMAT binary)`` and their fields copied into Arrow buffers
+        as wire bytes, one field at a time. Columns of types without a binary decoder are fetched as text.
+
+        :param query: The ``SELECT`` to run.
+        :type query: str
+
+        :param batch_rows: Rows per record batch.
+        :type batch_rows: int
+
+        :rtype: pyarrow.Table
+        """
+
+        arrow.require_pyarrow('to_arrow')
+
+        batches = []
+        decoder = self._copy_to_arrow('to_arrow', query, batches.append, batch_rows)
+
+        return arrow.pa.Table.from_batches(batches, schema=decoder.schema)
+
+    def to_parquet(self, query: str, path: str, batch_rows: int = 65536, **writer_kwargs) -> int:
+        """
+        Streams the result of a query into a Parquet file, one record batch at a time.
+
+        :return: The number of rows written.
+        :rtype: int
+        """
+
+        arrow.require_pyarrow('to_parquet')
+
+        writer = None
+
+        def write(batch):
+            nonlocal writer
+            if writer is None:
+                writer = arrow.pq.ParquetWriter(path, batch.schema, **writer_kwargs)
+            writer.write_batch(batch)
+
+        try:
+            decoder = self._copy_to_arrow('to_parquet', query, write, batch_rows)
+            if writer is None:
+                writer = arrow.pq.ParquetWriter(path, decoder.schema, **writer_kwargs)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        return decoder.rows
+
+    def _copy_from_arrow(self, func_name: str, table_name: str, names: t.Sequence[str], batches: t.Iterable) -> int:
+        target = dict(self._describe(func_name, f'SELECT * FROM "{table_name}"'))
+        missing = [name for name in names if name not in target]
+        if missing:
+            raise exceptions.WriteException(
+                func_name=func_name, message=f'Unknown columns for table "{table_name}": {missing}'
+            )
+
+        oids = [target[name] for name in names]
+        columns = ', '.join(f'"{name}"' for name in names)
+
+        if all(oid in arrow.SUPPORTED_OIDS for oid in oids):
+            source = arrow.BinaryCopyEncoder(batches, oids)
+            sql = f'COPY "{table_name}" ({columns}) FROM STDIN WITH (FORMAT binary)'
+        else:
+            source = arrow.CsvEncoder(batches, oids)
+            sql = f'COPY "{table_name}" ({columns}) FROM STDIN WITH (FORMAT csv)'
+
+        conn = self._connect()
+        cur = conn.cursor()
+
+        try:
+            cur.copy_expert(sql, source)
+            rows = cur.rowcount
+            self._notify_write(cur, table_name)
+            conn.commit()
+            self._after_write(table_name)
+        except Exception as e:
+            conn.rollback()
+            raise exceptions.WriteException(func_name=func_name, message=f'{e}', sql=sql, type_='WRITE')
+        finally:
+            if self._close_conn:
+                self._close()
+
+        self._track_changes(table_name, rows)
+
+        return rows
+
+    def from_arrow(self, table_name: str, arrow_table) -> int:
+        """
+        Loads a ``pyarrow.Table`` (or ``RecordBatch``) into a table with binary COPY.
+
+        Columns are matched by name. Values are converted to the target column types with vectorized casts and then
+        copied from the Arrow buffers into the COPY stream field by field, one batch at a time. If a target column has
+        a type without a binary encoder, the data is sent as CSV instead.
+
+        :return: The number of rows copied.
+        :rtype: int
+        """
+
+        arrow.require_pyarrow('from_arrow')
+
+        if isinstance(arrow_table, arrow.pa.RecordBatch):
+            batches = [arrow_table]
+        else:
+            batches = arrow_table.to_batches()
+
+        return self._copy_from_arrow('from_arrow', table_name, arrow_table.schema.names, batches)
+
+    def from_parquet(self, table_name: str, path: str, batch_rows: int = 65536) -> int:
+        """
+        Streams a Parquet file into a table, reading and copying one record batch at a time.
+
+        :return: The number of rows copied.
+        :rtype: int
+        """
+
+        arrow.require_pyarrow('from_parquet')
+
+        parquet_file = arrow.pq.ParquetFile(path)
+
+        return self._copy_from_arrow(
+            'from_parquet', table_name, parquet_file.schema_arrow.names, parquet_file.iter_batches(batch_rows)
+        )
+
+    def manual_query(
+            self, query: str, type_: str, timeout: t.Optional[float] = None, lock_timeout: t.Optional[float] = None,
+            memory_budget: t.Optional[int] = None
+    ) -> t.Union[t.List, t.Tuple, spill.SpilledRows]:
+        func_params = {
+            'query': query, 'type_': type_, 'timeout': timeout, 'lock_timeout': lock_timeout,
+            'memory_budget': memory_budget
+        }
 
-        return self._execute(func_name='manual_query', sql=query, type_=type_, func_params=__locals__)
+        return self._execute(
+            func_name='manual_query', sql=query, type_=type_, func_params=func_params,
+            timeout=timeout, lock_timeout=lock_timeout,
+            memory_budget=self._memory_budget if memory_budget is None else memory_budget
+        )
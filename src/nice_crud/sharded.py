@@ -0,0 +1,370 @@
+import bisect
+import concurrent.futures
+import functools
+import hashlib
+import heapq
+import itertools
+import re
+import tempfile
+import typing as t
+
+from . import exceptions
+from .catalog import split_top_level
+from .psql import PostgresCrud
+
+
+HASH_SPACE = 1 << 32
+
+
+def key_hash(value: t.Any) -> int:
+    """
+    32-bit hash of a shard key: the first 8 hex digits of ``md5(str(value))``.
+
+    Matches :func:`key_hash_sql` for values whose Python ``str`` equals their Postgres ``::text`` form (integers,
+    text, uuids).
+    """
+
+    return int(hashlib.md5(str(value).encode()).hexdigest()[:8], 16)
+
+
+def key_hash_sql(column: str) -> str:
+    """ The SQL expression computing :func:`key_hash` of ``column`` """
+
+    return f"('x' || substr(md5(\"{column}\"::text), 1, 8))::bit(32)::bigint"
+
+
+class HashRing:
+    """
+    Consistent hash ring placing ``vnodes`` virtual nodes per shard on the 32-bit hash space.
+
+    A key belongs to the shard of the first virtual node at or after its hash, wrapping around at the end. Adding or
+    removing one shard only moves the keys of the hash ranges it gains or loses.
+    """
+
+    def __init__(self, shards: t.Iterable[str], vnodes: int = 64):
+        points = sorted((key_hash(f'{shard}#{i}'), shard) for shard in shards for i in range(vnodes))
+        if not points:
+            raise ValueError('a hash ring needs at least one shard')
+
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, value: t.Any) -> str:
+        index = bisect.bisect_left(self._hashes, key_hash(value))
+        return self._shards[index % len(self._shards)]
+
+    def ranges(self, shard: str) -> t.List[t.Tuple[int, int]]:
+        """
+        Returns the inclusive ``(low, high)`` hash ranges owned by ``shard``, adjacent ranges merged.
+        """
+
+        ranges = []
+        for index, (point, owner) in enumerate(zip(self._hashes, self._shards)):
+            if owner != shard:
+                continue
+            if index == 0:
+                if self._hashes[-1] < HASH_SPACE - 1:
+                    ranges.append((self._hashes[-1] + 1, HASH_SPACE - 1))
+                ranges.append((0, point))
+            elif self._hashes[index - 1] < point:
+                ranges.append((self._hashes[index - 1] + 1, point))
+
+        merged: t.List[t.Tuple[int, int]] = []
+        for low, high in sorted(ranges):
+            if merged and low <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+            else:
+                merged.append((low, high))
+
+        return merged
+
+
+_ORDER_ITEM = re.compile(
+    r'^(?P<expr>.+?)(?:\s+(?P<dir>asc|desc))?(?:\s+nulls\s+(?P<nulls>first|last))?$', re.IGNORECASE | re.DOTALL
+)
+
+
+def parse_order_by(order_by: str) -> t.List[t.Tuple[str, bool, bool]]:
+    """
+    Parses an ``ORDER BY`` clause into ``(expression, descending, nulls_first)`` items, with Postgres' defaults
+    (``NULLS LAST`` for ascending, ``NULLS FIRST`` for descending order).
+    """
+
+    items = []
+    for part in split_top_level(order_by):
+        match = _ORDER_ITEM.match(part.strip())
+        descending = (match.group('dir') or '').lower() == 'desc'
+        nulls = match.group('nulls')
+        nulls_first = descending if nulls is None else nulls.lower() == 'first'
+        items.append((match.group('expr'), descending, nulls_first))
+
+    return items
+
+
+def _compare(directions: t.Sequence[t.Tuple[bool, bool]], left: t.Sequence, right: t.Sequence) -> int:
+    for (descending, nulls_first), a, b in zip(directions, left, right):
+        if a == b:
+            continue
+        if a is None or b is None:
+            return (-1 if a is None else 1) * (1 if nulls_first else -1)
+        result = -1 if a < b else 1
+        return -result if descending else result
+
+    return 0
+
+
+class ShardedPostgresCrud:
+    """
+    Spreads tables over several databases, each accessed through its own ``PostgresCrud``.
+
+    Rows are placed by the value of a shard key column with consistent hashing (see :class:`HashRing`). Writes that
+    know their shard key go to one shard; everything else fans out to all shards in parallel. Selects without
+    ``shard_key_value`` are merged from all shards: with ``order_by`` every shard returns its sorted first
+    ``offset + limit`` rows and they are k-way merged, so ``limit``/``offset`` apply to the combined order. Text sort
+    keys are merged with Python's ordering, which matches the ``"C"`` collation.
+
+    Usage::
+
+        crud = ShardedPostgresCrud(
+            {'s0': PostgresCrud(...), 's1': PostgresCrud(...)}, shard_key={'users': 'user_id', 'orders': 'user_id'}
+        )
+        crud.broadcast('create_table', 'users', {...})
+        crud.insert_from_dict('users', {'user_id': 42, 'name': 'john'})
+        crud.select('users', '*', order_by='created_at DESC', limit=20)
+    """
+
+    def __init__(
+            self, shards: t.Dict[str, PostgresCrud], shard_key: t.Union[str, t.Dict[str, str]], vnodes: int = 64,
+            max_workers: t.Optional[int] = None
+    ):
+        """
+        :param shards: The shard instances by name; the names place the shards on the ring, so keep them stable.
+        :type shards: t.Dict[str, PostgresCrud]
+
+        :param shard_key: The shard key column of every table, or one column name used for all tables.
+        :type shard_key: t.Union[str, t.Dict[str, str]]
+
+        :param vnodes: Virtual nodes per shard; more spread the keys more evenly.
+        :type vnodes: int
+
+        :param max_workers: Threads used for fan-out, defaults to one per shard.
+        :type max_workers: t.Optional[int]
+        """
+
+        self._shards = dict(shards)
+        self._shard_key = shard_key
+        self._vnodes = vnodes
+        self._ring = HashRing(self._shards, vnodes)
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers or len(self._shards), thread_name_prefix='nice_crud-shard'
+        )
+
+    @property
+    def shards(self) -> t.Dict[str, PostgresCrud]:
+        return dict(self._shards)
+
+    def close(self) -> None:
+        self._pool.shutdown()
+        for shard in self._shards.values():
+            shard.close()
+
+    def shard_key(self, table_name: str) -> str:
+        if type(self._shard_key) == str:
+            return self._shard_key
+
+        try:
+            return self._shard_key[table_name]
+        except KeyError:
+            raise exceptions.WrongMethodException(
+                func_name='shard_key', message=f'No shard key configured for table: {table_name}'
+            )
+
+    def shard_for(self, value: t.Any) -> PostgresCrud:
+        """ Returns the shard holding the rows with shard key ``value`` """
+
+        return self._shards[self._ring.shard_for(value)]
+
+    def _fan_out(self, method: str, *args, **kwargs) -> t.Dict[str, t.Any]:
+        futures = {
+            name: self._pool.submit(getattr(shard, method), *args, **kwargs) for name, shard in self._shards.items()
+        }
+
+        return {name: future.result() for name, future in futures.items()}
+
+    def broadcast(self, method: str, *args, **kwargs) -> t.Dict[str, t.Any]:
+        """
+        Calls a ``PostgresCrud`` method on every shard in parallel, e.g. ``broadcast('create_table', ...)``.
+
+        :return: The results by shard name.
+        :rtype: t.Dict[str, t.Any]
+        """
+
+        return self._fan_out(method, *args, **kwargs)
+
+    @staticmethod
+    def _literal_value(value: t.Any) -> t.Any:
+        """ Turns a SQL literal as accepted by ``PostgresCrud.insert`` (e.g. ``"'john'"``) back into its value """
+
+        if type(value) == str:
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] == "'":
+                return value[1:-1].replace("''", "'")
+
+        return value
+
+    def insert(
+            self, table_name: str, columns: t.Union[t.List[str], t.Tuple, str],
+            values: t.Union[t.List[str], t.Tuple, str], on_conflict: t.Optional[str] = None,
+            shard_key_value: t.Any = None, **kwargs
+    ) -> None:
+        """
+        ``PostgresCrud.insert`` on the shard of the row. The shard key value is read from ``columns``/``values``
+        unless given as ``shard_key_value``.
+        """
+
+        if shard_key_value is None:
+            names = split_top_level(columns) if type(columns) == str else list(columns)
+            items = split_top_level(values) if type(values) == str else list(values)
+            names = [name.strip().strip('"') for name in names]
+            key = self.shard_key(table_name)
+            if key not in names:
+                raise exceptions.WrongMethodException(
+                    func_name='insert', message=f'Shard key {key} missing from columns: {columns}'
+                )
+            shard_key_value = self._literal_value(items[names.index(key)])
+
+        return self.shard_for(shard_key_value).insert(table_name, columns, values, on_conflict=on_conflict, **kwargs)
+
+    def insert_from_dict(
+            self, table_name: str, data: t.Dict, on_conflict: t.Optional[str] = None, **kwargs
+    ) -> None:
+        key = self.shard_key(table_name)
+        if key not in data:
+            raise exceptions.WrongMethodException(
+                func_name='insert_from_dict', message=f'Shard key {key} missing from data: {list(data)}'
+            )
+
+        return self.shard_for(data[key]).insert_from_dict(table_name, data, on_conflict=on_conflict, **kwargs)
+
+    def update_via_dict(
+            self, table_name: str, data: t.Dict, condition: t.Optional[t.Union[str, t.List, t.Tuple]] = None,
+            shard_key_value: t.Any = None, **kwargs
+    ) -> None:
+        """
+        ``PostgresCrud.update_via_dict`` on the shard of ``shard_key_value``, or on every shard if it is ``None``.
+
+        The shard key itself can not be updated since that would move the row to another shard.
+        """
+
+        if self.shard_key(table_name) in data:
+            raise exceptions.WrongMethodException(
+                func_name='update_via_dict', message=f'Can not update the shard key {self.shard_key(table_name)}'
+            )
+
+        if shard_key_value is not None:
+            return self.shard_for(shard_key_value).update_via_dict(table_name, data, condition=condition, **kwargs)
+
+        self._fan_out('update_via_dict', table_name, data, condition=condition, **kwargs)
+
+    def delete(
+            self, table_name: str, condition: t.Union[str, t.List, t.Tuple], shard_key_value: t.Any = None, **kwargs
+    ) -> None:
+        """
+        ``PostgresCrud.delete`` on the shard of ``shard_key_value``, or on every shard if it is ``None``.
+        """
+
+        if shard_key_value is not None:
+            return self.shard_for(shard_key_value).delete(table_name, condition, **kwargs)
+
+        self._fan_out('delete', table_name, condition, **kwargs)
+
+    def select(
+            self, table_name: str, columns: t.Union[t.List[str], t.Tuple, str], condition: t.Optional[str] = None,
+            limit: t.Optional[int] = None, offset: t.Optional[int] = None, order_by: t.Optional[str] = None,
+            shard_key_value: t.Any = None, **kwargs
+    ) -> t.List[t.Tuple]:
+        """
+        ``PostgresCrud.select`` on the shard of ``shard_key_value``, or merged from all shards if it is ``None``.
+        """
+
+        if shard_key_value is not None:
+            return self.shard_for(shard_key_value).select(
+                table_name, columns, condition=condition, limit=limit, offset=offset, order_by=order_by, **kwargs
+            )
+
+        window = None if limit is None else limit + (offset or 0)
+
+        if not order_by:
+            results = self._fan_out('select', table_name, columns, condition=condition, limit=window, **kwargs)
+            rows = itertools.chain.from_iterable(results[name] for name in self._shards)
+            return list(itertools.islice(rows, offset or 0, window))
+
+        # The sort keys are selected as extra trailing columns, so any ORDER BY expression can be merged on.
+        items = parse_order_by(order_by)
+        select_list = columns if type(columns) == str else ', '.join(columns)
+        select_list += ''.join(f', {expression}' for expression, _, _ in items)
+
+        results = self._fan_out(
+            'select', table_name, select_list, condition=condition, limit=window, order_by=order_by, **kwargs
+        )
+
+        width = len(items)
+        directions = [(descending, nulls_first) for _, descending, nulls_first in items]
+        sort_key = functools.cmp_to_key(functools.partial(_compare, directions))
+        merged = heapq.merge(*results.values(), key=lambda row: sort_key(row[-width:]))
+
+        return [row[:-width] for row in itertools.islice(merged, offset or 0, window)]
+
+    def _move_predicate(self, table_name: str, ranges: t.List[t.Tuple[int, int]]) -> str:
+        expression = key_hash_sql(self.shard_key(table_name))
+        return ' OR '.join(f'{expression} BETWEEN {low} AND {high}' for low, high in ranges)
+
+    def reshard(
+            self, shards: t.Dict[str, PostgresCrud], tables: t.Iterable[str], spool_bytes: int = 64 << 20
+    ) -> t.Dict[str, t.Dict[t.Tuple[str, str], int]]:
+        """
+        Moves rows to match a new set of shards, then switches routing to it.
+
+        For every table and every pair of shards the rows whose key hash falls into a range the new ring assigns to
+        another shard are streamed with ``COPY (SELECT ...) TO STDOUT`` (binary format, spooled to a temporary file
+        above ``spool_bytes``), loaded with ``COPY ... FROM STDIN`` into the new owner and then deleted from the old
+        one. Only the hash ranges that changed owner are moved. New shards must already have the tables. Writes to
+        the moved tables must be paused while resharding. Removed shards are emptied but not closed.
+
+        :param shards: The complete new shard set; existing shards keep their names.
+        :type shards: t.Dict[str, PostgresCrud]
+
+        :return: The rows moved per table and ``(source, target)`` shard pair.
+        :rtype: t.Dict[str, t.Dict[t.Tuple[str, str], int]]
+        """
+
+        ring = HashRing(shards, self._vnodes)
+        report: t.Dict[str, t.Dict[t.Tuple[str, str], int]] = {}
+
+        for table_name in tables:
+            moved = report.setdefault(table_name, {})
+            for target_name, target in shards.items():
+                predicate = self._move_predicate(table_name, ring.ranges(target_name))
+                for source_name, source in self._shards.items():
+                    if source_name == target_name:
+                        continue
+
+                    query = f'SELECT * FROM "{table_name}" WHERE {predicate}'
+                    with tempfile.SpooledTemporaryFile(max_size=spool_bytes) as spool:
+                        rows = source.copy_to(query, spool, format='binary')
+                        if not rows:
+                            continue
+                        spool.seek(0)
+                        target.copy_from(table_name, spool, format='binary')
+
+                    source.delete(table_name, predicate)
+                    moved[(source_name, target_name)] = rows
+
+        self._shards = dict(shards)
+        self._ring = ring
+        self._pool.shutdown()
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(self._shards), thread_name_prefix='nice_crud-shard'
+        )
+
+        return report
@@ -0,0 +1,137 @@
+import array
+import mmap
+import os
+import pickle
+import sys
+import tempfile
+import typing as t
+import weakref
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+
+# Rows of a batch whose size is measured to estimate the size of the whole batch.
+SAMPLE_ROWS = 16
+
+
+# Statements a server-side cursor (``DECLARE ... CURSOR FOR``) accepts.
+_QUERY_KEYWORDS = ('SELECT', 'WITH', 'VALUES', 'TABLE')
+
+
+def is_query(sql: str) -> bool:
+    """ Whether a statement can be read through a server-side cursor; others are fetched whole """
+
+    words = sql.lstrip(' \t\n(').split(None, 1)
+
+    return bool(words) and words[0].upper() in _QUERY_KEYWORDS and ';' not in sql.rstrip().rstrip(';')
+
+
+def estimate_size(rows: t.Sequence[t.Tuple]) -> int:
+    """ Approximate memory held by a batch of rows, extrapolated from its first rows """
+
+    if not rows:
+        return 0
+
+    sample = rows[:SAMPLE_ROWS]
+    size = sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in sample)
+
+    return size * len(rows) // len(sample)
+
+
+def peak_rss() -> t.Optional[int]:
+    """ Peak resident set size of the process so far, in bytes, or ``None`` where it cannot be read """
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _remove(path: str, handles: t.List[t.Any]) -> None:
+    for handle in handles:
+        handle.close()
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class SpilledRows(t.Sequence):
+    """
+    Read-only sequence of rows stored on disk: a temporary file of pickled rows, memory-mapped once written, plus an
+    array of their offsets, so only 8 bytes per row stay in Python memory.
+
+    Supports ``len``, indexing (including negative indexes and slices, which return lists), iteration and comparison
+    with lists. The file is deleted by ``close()``, or when the object is garbage collected.
+    """
+
+    def __init__(self, directory: t.Optional[str] = None):
+        fd, self.path = tempfile.mkstemp(prefix='nice_crud_spill_', suffix='.rows', dir=directory)
+        self._file = os.fdopen(fd, 'w+b')
+        self._offsets = array.array('Q', [0])
+        self._mmap: t.Optional[mmap.mmap] = None
+        self._handles = [self._file]
+        self._finalizer = weakref.finalize(self, _remove, self.path, self._handles)
+
+    def extend(self, rows: t.Iterable[t.Tuple]) -> None:
+        if self._mmap is not None:
+            raise ValueError('SpilledRows is read-only once finished')
+
+        for row in rows:
+            data = pickle.dumps(tuple(row), protocol=pickle.HIGHEST_PROTOCOL)
+            self._file.write(data)
+            self._offsets.append(self._offsets[-1] + len(data))
+
+    def finish(self) -> 'SpilledRows':
+        """ Flushes the file and maps it for reading """
+
+        self._file.flush()
+        if self.nbytes:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._handles.insert(0, self._mmap)
+
+        return self
+
+    @property
+    def nbytes(self) -> int:
+        """ Size of the spill file """
+
+        return self._offsets[-1]
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def _row(self, index: int) -> t.Tuple:
+        return pickle.loads(self._mmap[self._offsets[index]:self._offsets[index + 1]])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._row(i) for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('SpilledRows index out of range')
+
+        return self._row(index)
+
+    def __iter__(self) -> t.Iterator[t.Tuple]:
+        for index in range(len(self)):
+            yield self._row(index)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (SpilledRows, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f'<SpilledRows rows={len(self)} bytes={self.nbytes} path={self.path!r}>'
+
+    def close(self) -> None:
+        self._mmap = None
+        self._finalizer()
@@ -0,0 +1,114 @@
+import re
+import typing as t
+
+
+RELKIND_SQL = 'SELECT relkind FROM pg_catalog.pg_class WHERE oid = to_regclass(%s)'
+
+DEPENDENTS_SQL = '''
+    SELECT 'foreign key ' || c.conname || ' of ' || c.conrelid::regclass::text
+    FROM pg_catalog.pg_constraint c
+    WHERE c.confrelid = to_regclass(%(table)s) AND c.contype = 'f'
+    UNION ALL
+    SELECT DISTINCT 'view ' || r.ev_class::regclass::text
+    FROM pg_catalog.pg_depend d
+    JOIN pg_catalog.pg_rewrite r ON r.oid = d.objid
+    WHERE d.classid = 'pg_catalog.pg_rewrite'::regclass
+      AND d.refobjid = to_regclass(%(table)s)
+      AND r.ev_class <> d.refobjid
+'''
+
+CONSTRAINTS_SQL = '''
+    SELECT c.conname, c.contype, pg_catalog.pg_get_indexdef(c.conindid), c.condeferrable, c.condeferred,
+           pg_catalog.pg_get_constraintdef(c.oid)
+    FROM pg_catalog.pg_constraint c
+    WHERE c.conrelid = to_regclass(%s) AND c.contype IN ('p', 'u', 'x', 'f')
+    ORDER BY c.contype, c.conname
+'''
+
+SERIAL_SEQUENCES_SQL = '''
+    SELECT s.relname, a.attname
+    FROM pg_catalog.pg_depend d
+    JOIN pg_catalog.pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+    JOIN pg_catalog.pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+    WHERE d.classid = 'pg_catalog.pg_class'::regclass
+      AND d.refobjid = to_regclass(%s)
+      AND d.deptype = 'a'
+'''
+
+IDENTITY_COLUMNS_SQL = '''
+    SELECT attname
+    FROM pg_catalog.pg_attribute
+    WHERE attrelid = to_regclass(%s) AND attidentity <> '' AND NOT attisdropped
+'''
+
+# Everything but indexes, which are built after the load.
+LIKE_OPTIONS = 'INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED INCLUDING IDENTITY INCLUDING STORAGE ' \
+               'INCLUDING COMMENTS'
+
+NEW_SUFFIX = '__new'
+OLD_SUFFIX = '__old'
+
+_INDEX_HEAD = re.compile(r'^CREATE (UNIQUE )?INDEX \S+ ON (ONLY )?\S+')
+
+
+def suffixed(name: str, suffix: str) -> str:
+    """ Appends ``suffix`` to an identifier, truncating it to Postgres' 63 byte limit """
+
+    return name[:63 - len(suffix)] + suffix
+
+
+def retarget_index(definition: str, index_name: str, table_name: str) -> str:
+    """ Rewrites a ``pg_get_indexdef`` statement to build ``index_name`` on ``table_name`` """
+
+    return _INDEX_HEAD.sub(
+        lambda match: f'CREATE {match.group(1) or ""}INDEX "{index_name}" ON "{table_name}"', definition, count=1
+    )
+
+
+def constraint_statement(
+        staging: str, name: str, contype: str, deferrable: bool, deferred: bool, definition: str
+) -> str:
+    """
+    ``ALTER TABLE`` statement attaching a constraint to the staging table: primary keys and unique constraints
+    reuse the index built in advance (``<name>__new``), other constraints are declared from their definition.
+    """
+
+    new_name = suffixed(name, NEW_SUFFIX)
+    if contype in ('p', 'u'):
+        sql = f'ALTER TABLE "{staging}" ADD CONSTRAINT "{new_name}" '
+        sql += f'{"PRIMARY KEY" if contype == "p" else "UNIQUE"} USING INDEX "{new_name}"'
+        if deferrable:
+            sql += ' DEFERRABLE INITIALLY DEFERRED' if deferred else ' DEFERRABLE'
+        return sql
+
+    return f'ALTER TABLE "{staging}" ADD CONSTRAINT "{new_name}" {definition}'
+
+
+def swap_statements(
+        table_name: str, constraints: t.Sequence[str], indexes: t.Sequence[str],
+        sequences: t.Sequence[t.Tuple[str, str]]
+) -> t.List[str]:
+    """
+    The statements renaming the old table (and its constraints and indexes) out of the way and the staging table
+    into place, then moving the ownership of ``serial`` sequences to the new table.
+    """
+
+    staging = suffixed(table_name, NEW_SUFFIX)
+    old = suffixed(table_name, OLD_SUFFIX)
+
+    statements = [
+        f'LOCK TABLE "{table_name}" IN ACCESS EXCLUSIVE MODE',
+        f'ALTER TABLE "{table_name}" RENAME TO "{old}"',
+    ]
+    for name in constraints:
+        statements.append(f'ALTER TABLE "{old}" RENAME CONSTRAINT "{name}" TO "{suffixed(name, OLD_SUFFIX)}"')
+        statements.append(f'ALTER TABLE "{staging}" RENAME CONSTRAINT "{suffixed(name, NEW_SUFFIX)}" TO "{name}"')
+    for name in indexes:
+        statements.append(f'ALTER INDEX "{name}" RENAME TO "{suffixed(name, OLD_SUFFIX)}"')
+        statements.append(f'ALTER INDEX "{suffixed(name, NEW_SUFFIX)}" RENAME TO "{name}"')
+
+    statements.append(f'ALTER TABLE "{staging}" RENAME TO "{table_name}"')
+    for sequence, column in sequences:
+        statements.append(f'ALTER SEQUENCE "{sequence}" OWNED BY "{table_name}"."{column}"')
+
+    return statements
@@ -1,13 +1,23 @@
+import asyncio
+import datetime
+import io
 import unittest
 
 import os
 import sys
+import threading
+import time
 
+import psycopg2
 from dotenv import load_dotenv, find_dotenv
 
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from src.nice_crud import PostgresCrud
+from src.nice_crud import DataLoader, PostgresCrud, PartitionManager, ShardedPostgresCrud
+from src.nice_crud import arrow, buffer, cdc, invalidation, jsonb
+from src.nice_crud.bench import main as bench_main, parse_mix, percentile, run as run_benchmark, setup_table
+from src.nice_crud.constants import PartitionTypes
+from src.nice_crud.exceptions import ReadCancelledException, ReadException, ReadTimeoutException, WriteException
 
 
 load_dotenv(dotenv_path=find_dotenv(raise_error_if_not_found=True))
@@ -847,5 +857,1707 @@ class CreateIndex(unittest.TestCase):
         self.assertFalse(is_exception)
 
 
+class CatalogCache(unittest.TestCase):
+    crud = PostgresCrud(
+        host=os.getenv('DB_HOST'),
+        port=int(os.getenv('DB_PORT')),
+        dbname=os.getenv('DB_NAME'),
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        catalog_cache=True,
+    )
+    table_name = table_name
+
+    def test_create_table_twice(self):
+        try:
+            reset()
+        except Exception as e:
+            print(e)
+
+        try:
+            for _ in range(2):
+                self.crud.create_table(
+                    table_name=self.table_name,
+                    columns={'id': 'serial', 'name': 'text NOT NULL'},
+                    primary_key='id'
+                )
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+
+        self.assertFalse(is_exception)
+        self.assertTrue(self.crud.load_catalog(refresh=True).has_columns(self.table_name, ['id', 'name']))
+
+    def test_unknown_column(self):
+        try:
+            reset(create_table=True)
+            self.crud.invalidate_catalog()
+        except Exception as e:
+            print(e)
+
+        with self.assertRaises(WriteException):
+            self.crud.insert_from_dict(table_name=self.table_name, data={'nickname': 'johnny'})
+
+    def test_existing_table_keeps_its_columns(self):
+        try:
+            reset(create_table=True)
+            self.crud.invalidate_catalog()
+            self.crud.load_catalog()
+        except Exception as e:
+            print(e)
+
+        self.crud.create_table(table_name=self.table_name, columns={'id': 'serial', 'nickname': 'text'})
+
+        self.assertIsNone(self.crud.load_catalog().column_type(self.table_name, 'nickname'))
+        with self.assertRaises(WriteException):
+            self.crud.insert_from_dict(table_name=self.table_name, data={'nickname': 'johnny'})
+
+    def test_unquoted_names_are_case_folded(self):
+        try:
+            reset()
+            self.crud.invalidate_catalog()
+            self.crud.load_catalog()
+        except Exception as e:
+            print(e)
+
+        try:
+            self.crud.create_table(table_name=self.table_name, columns='Id serial, "NickName" text, Name text')
+            self.crud.insert_from_dict(table_name=self.table_name, data={'NAME': 'john', '"NickName"': 'johnny'})
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+
+        self.assertFalse(is_exception)
+        catalog = self.crud.load_catalog()
+        self.assertEqual(set(catalog.columns(self.table_name)), {'id', 'NickName', 'name'})
+        self.assertTrue(catalog.has_columns(f'"{self.table_name}"', ['ID', 'name', '"NickName"']))
+        self.assertFalse(catalog.has_columns(self.table_name, ['nickname']))
+
+
+class AdviseIndexes(unittest.TestCase):
+    crud = psql_crud
+    table_name = table_name
+
+    def test_advise(self):
+        try:
+            reset(create_table=True, insert_data=True)
+        except Exception as e:
+            print(e)
+
+        try:
+            result = self.crud.advise_indexes(min_seq_scans=0, min_table_rows=0)
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            result = None
+
+        self.assertFalse(is_exception)
+        self.assertIsInstance(result, list)
+        for rec in result:
+            self.assertIn(rec['action'], ('create_index', 'drop_index'))
+
+
+class CreateIndexConcurrently(unittest.TestCase):
+    crud = psql_crud
+    table_name = table_name
+
+    def test_concurrently(self):
+        try:
+            reset(create_table=True, insert_data=True)
+        except Exception as e:
+            print(e)
+
+        progress = []
+        try:
+            self.crud.create_index(
+                table_name=self.table_name,
+                columns=['name', 'family'],
+                index_name='name_family_index',
+                concurrently=True,
+                maintenance_work_mem='64MB',
+                max_parallel_maintenance_workers=2,
+                progress_callback=progress.append,
+                progress_interval=0.01,
+            )
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+
+        self.assertFalse(is_exception)
+
+    def test_cleanup_invalid_indexes(self):
+        try:
+            reset(create_table=True, insert_data=True)
+        except Exception as e:
+            print(e)
+
+        try:
+            result = self.crud.cleanup_invalid_indexes(table_name=self.table_name)
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            result = None
+
+        self.assertFalse(is_exception)
+        self.assertEqual(result, [])
+
+
+class PartitionedTable(unittest.TestCase):
+    crud = psql_crud
+    table_name = 'test_events'
+
+    def test_partition_maintenance(self):
+        try:
+            self.crud.drop_table(self.table_name)
+        except Exception as e:
+            print(e)
+
+        try:
+            self.crud.create_table(
+                table_name=self.table_name,
+                columns={'id': 'bigserial', 'created_at': 'timestamp NOT NULL', 'payload': 'text'},
+                partition_type=PartitionTypes.Range,
+                partition_key='created_at',
+            )
+            manager = PartitionManager(self.crud, self.table_name, interval='day', premake=2, retention=1)
+            now = datetime.datetime(2024, 1, 10, 12)
+            manager.run_maintenance(now=datetime.datetime(2024, 1, 5))
+            report = manager.run_maintenance(now=now)
+            self.crud.insert_from_dict(
+                table_name=self.table_name, data={'created_at': now.isoformat(sep=' '), 'payload': 'x'}
+            )
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            report = None
+
+        self.assertFalse(is_exception)
+        self.assertIn('test_events_p20240110', report['created'])
+        self.assertIn('test_events_p20240105', report['dropped'])
+
+
+class BufferedWrites(unittest.TestCase):
+    crud = psql_crud
+    table_name = table_name
+
+    def test_buffered_insert_and_update(self):
+        try:
+            reset(create_table=True)
+        except Exception as e:
+            print(e)
+
+        try:
+            self.crud.enable_write_buffer(max_rows=10, flush_interval=0.05)
+            self.crud.buffered_insert(table_name=self.table_name, data={'name': 'john', 'family': 'doe', 'age': 20})
+            self.crud.flush()
+            self.crud.buffered_update(table_name=self.table_name, data={'age': 21}, key={'family': 'doe'})
+            self.crud.buffered_update(table_name=self.table_name, data={'age': 22}, key={'family': 'doe'})
+            written = self.crud.flush()
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            written = None
+
+        self.assertFalse(is_exception)
+        self.assertEqual(written, 1)
+        self.assertEqual(
+            self.crud.select(table_name=self.table_name, columns='age', condition="family = 'doe'"), [(22,)]
+        )
+
+    @staticmethod
+    def new_crud() -> PostgresCrud:
+        return PostgresCrud(
+            host=os.getenv('DB_HOST'),
+            port=int(os.getenv('DB_PORT')),
+            dbname=os.getenv('DB_NAME'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+        )
+
+    def test_flush_evicts_select_cache(self):
+        try:
+            reset(create_table=True, insert_data=True)
+        except Exception as e:
+            print(e)
+
+        crud = self.new_crud()
+        try:
+            crud.enable_select_cache()
+            crud.enable_write_buffer(flush_interval=60)
+            self.assertEqual(len(crud.select(table_name=self.table_name, columns='name')), 1)
+
+            crud.buffered_insert(table_name=self.table_name, data={'name': 'jane', 'family': 'roe', 'age': 30})
+            crud.flush()
+            result = crud.select(table_name=self.table_name, columns='name')
+        finally:
+            crud.close()
+
+        self.assertEqual(len(result), 2)
+
+    def test_failed_flush_is_retried(self):
+        try:
+            reset(create_table=True, insert_data=True)
+        except Exception as e:
+            print(e)
+
+        crud = self.new_crud()
+        crud.enable_write_buffer(flush_interval=60)
+        crud.buffered_insert(table_name=self.table_name, data={'name': 'jane', 'family': 'doe', 'age': 30})
+        with self.assertRaises(WriteException):
+            crud.flush()
+
+        try:
+            crud.delete(table_name=self.table_name, condition="name = 'john'")
+            written = crud.flush()
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            written = None
+        finally:
+            crud.close()
+
+        self.assertFalse(is_exception)
+        self.assertEqual(written, 1)
+        self.assertEqual(
+            self.crud.select(table_name=self.table_name, columns='name', condition="family = 'doe'"), [('jane',)]
+        )
+
+    def test_failing_write_does_not_block_the_others(self):
+        try:
+            reset(create_table=True, insert_data=True)
+        except Exception as e:
+            print(e)
+
+        crud = self.new_crud()
+        write_buffer = crud.enable_write_buffer(flush_interval=60)
+        crud.buffered_insert(table_name=self.table_name, data={'name': 'jane', 'family': 'doe', 'age': 30})
+        for i in range(7):
+            crud.buffered_insert(
+                table_name=self.table_name, data={'name': f'name{i}', 'family': f'family{i}', 'age': i}
+            )
+
+        try:
+            crud.close()
+            is_exception = False
+        except WriteException as e:
+            print(e)
+            is_exception = True
+
+        self.assertTrue(is_exception)
+        self.assertIsNone(crud._conn)
+        self.assertEqual(self.crud.count(self.table_name), 8)
+        self.assertEqual(len(write_buffer.dead_letters), 1)
+        self.assertEqual(write_buffer.dead_letters[0]['data']['family'], 'doe')
+        self.assertEqual(write_buffer.dead_letters[0]['attempts'], 3)
+
+    def test_failed_flush_backs_off(self):
+        attempts = []
+
+        def connect():
+            attempts.append(time.monotonic())
+            raise psycopg2.OperationalError('connection refused')
+
+        write_buffer = buffer.WriteBuffer(connect, max_rows=1, flush_interval=60)
+        write_buffer.insert(self.table_name, {'name': 'jane'})
+        time.sleep(0.3)
+
+        # The re-queued row keeps the queue at max_rows: without a delay the thread would retry in a loop.
+        self.assertEqual(len(attempts), 1)
+        with self.assertRaises(WriteException):
+            write_buffer.close()
+
+
+class ParallelLoad(unittest.TestCase):
+    crud = psql_crud
+    table_name = table_name
+
+    def test_via_iterable(self):
+        try:
+            reset(create_table=True)
+        except Exception as e:
+            print(e)
+
+        try:
+            report = self.crud.parallel_load(
+                table_name=self.table_name,
+                source=((f'name{i}', f'family{i}', i) for i in range(1000)),
+                columns=['name', 'family', 'age'],
+                workers=2,
+                chunk_rows=100,
+                defer_indexes=True,
+            )
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            report = None
+
+        self.assertFalse(is_exception)
+        self.assertEqual(report['rows'], 1000)
+        self.assertEqual(report['errors'], [])
+
+    def test_deferred_index_failures_are_all_reported(self):
+        try:
+            reset(create_table=True)
+        except Exception as e:
+            print(e)
+
+        self.crud.manual_query(query='DROP TABLE IF EXISTS pl_parent CASCADE', type_='WRITE')
+        self.crud.create_table(table_name='pl_parent', columns={'age': 'integer'}, primary_key='age')
+        self.crud.copy_from('pl_parent', ((i,) for i in range(50)))
+        self.crud.manual_query(
+            query=f'ALTER TABLE "{self.table_name}" ADD CONSTRAINT pl_age_fk FOREIGN KEY (age) REFERENCES pl_parent',
+            type_='WRITE'
+        )
+        self.crud.create_index(table_name=self.table_name, columns=['name'], unique=True, index_name='pl_name_idx')
+        self.crud.create_index(table_name=self.table_name, columns=['age'], index_name='pl_age_idx')
+
+        try:
+            report = self.crud.parallel_load(
+                table_name=self.table_name,
+                source=((f'name{5 if i == 95 else i}', f'family{i}', i) for i in range(100)),
+                columns=['name', 'family', 'age'],
+                workers=2,
+                chunk_rows=10,
+                defer_indexes=True,
+            )
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            report = None
+
+        # The unique index is never dropped: the chunk holding the duplicate name fails and nothing else.
+        self.assertFalse(is_exception)
+        self.assertEqual(report['rows'], 90)
+        self.assertEqual(len(report['errors']), 2)
+        self.assertIn('pl_name_idx', report['errors'][0]['error'])
+        self.assertIn('pl_age_fk', report['errors'][1]['statement'])
+        self.assertEqual(self.crud.count(self.table_name, "name = 'name5'"), 1)
+
+        indexes = self.crud.manual_query(
+            query=f"SELECT indexname FROM pg_indexes WHERE tablename = '{self.table_name}'", type_='READ'
+        )
+        self.assertIn(('pl_name_idx',), indexes)
+        self.assertIn(('pl_age_idx',), indexes)
+        self.crud.manual_query(query='DROP TABLE IF EXISTS pl_parent CASCADE', type_='WRITE')
+
+    def test_binary_files_are_not_split(self):
+        try:
+            self.crud.parallel_load(table_name=self.table_name, source=__file__, format='binary', defer_indexes=True)
+            is_exception = False
+        except ValueError as e:
+            print(e)
+            is_exception = True
+
+        self.assertTrue(is_exception)
+
+
+@unittest.skipIf(arrow.pa is None, 'pyarrow is not installed')
+class ArrowRoundTrip(unittest.TestCase):
+    crud = psql_crud
+    table_name = table_name
+
+    def test_to_and_from_arrow(self):
+        try:
+            reset(create_table=True, insert_data=True)
+        except Exception as e:
+            print(e)
+
+        try:
+            result = self.crud.to_arrow(f'SELECT * FROM "{self.table_name}"')
+            self.crud.delete(table_name=self.table_name, condition='true')
+            copied = self.crud.from_arrow(self.table_name, result)
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            result = copied = None
+
+        self.assertFalse(is_exception)
+        self.assertEqual(result.to_pylist(), [{'id': 1, 'name': 'john', 'family': 'doe', 'age': 20}])
+        self.assertEqual(copied, 1)
+
+
+class AggregateTestData(unittest.TestCase):
+    crud = psql_crud
+    table_name = table_name
+
+    def test_count_and_exists(self):
+        try:
+            reset(create_table=True, insert_data=True)
+        except Exception as e:
+            print(e)
+
+        try:
+            count = self.crud.count(table_name=self.table_name, condition="name = 'john'")
+            found = self.crud.exists(table_name=self.table_name, condition=["name = 'john'", 'age = 20'])
+            missing = self.crud.exists(table_name=self.table_name, condition="name = 'jane'")
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            count = found = missing = None
+
+        self.assertFalse(is_exception)
+        self.assertEqual(count, 1)
+        self.assertTrue(found)
+        self.assertFalse(missing)
+
+    def test_aggregate(self):
+        try:
+            reset(create_table=True, insert_data=True)
+        except Exception as e:
+            print(e)
+
+        try:
+            result = self.crud.aggregate(
+                table_name=self.table_name,
+                aggregations={'age': ['min', 'max'], '*': 'count'},
+                group_by='family'
+            )
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            result = None
+
+        self.assertFalse(is_exception)
+        self.assertEqual(result, [('doe', 20, 20, 1)])
+
+    def test_estimated_count(self):
+        try:
+            reset(create_table=True, insert_data=True)
+        except Exception as e:
+            print(e)
+
+        try:
+            result = self.crud.estimated_count(table_name=self.table_name)
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            result = None
+
+        self.assertFalse(is_exception)
+        self.assertEqual(result, 1)
+
+
+class TimeoutAndCancel(unittest.TestCase):
+    crud = psql_crud
+
+    def test_statement_timeout(self):
+        try:
+            self.crud.manual_query(query='SELECT pg_sleep(2)', type_='READ', timeout=0.1)
+            exception = None
+        except Exception as e:
+            exception = e
+
+        self.assertIsInstance(exception, ReadTimeoutException)
+
+        # SET LOCAL must not leak into the next statement
+        result = self.crud.manual_query(query='SHOW statement_timeout', type_='READ')
+        self.assertEqual(result, [('0',)])
+
+    def test_zero_timeout_disables_it(self):
+        try:
+            result = self.crud.manual_query(query='SELECT pg_sleep(0.05), 1', type_='READ', timeout=0, lock_timeout=0)
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            result = None
+
+        self.assertFalse(is_exception)
+        self.assertEqual(result, [('', 1)])
+
+    def test_ddl_lock_timeout(self):
+        try:
+            reset(create_table=True)
+        except Exception as e:
+            print(e)
+
+        conn = self.crud._new_connection()
+        conn.cursor().execute(f'LOCK TABLE "{table_name}" IN ACCESS EXCLUSIVE MODE')
+        try:
+            for concurrently in (False, True):
+                with self.assertRaises(WriteException):
+                    self.crud.create_index(
+                        table_name=table_name, columns=['age'], index_name='timeout_idx', concurrently=concurrently,
+                        lock_timeout=0.1
+                    )
+        finally:
+            conn.rollback()
+            conn.close()
+
+    def test_cancel_from_other_thread(self):
+        handle = self.crud.cancel_handle()
+        timer = handle.cancel_after(0.2)
+
+        try:
+            self.crud.manual_query(query='SELECT pg_sleep(5)', type_='READ')
+            exception = None
+        except Exception as e:
+            exception = e
+        finally:
+            timer.cancel()
+
+        self.assertIsInstance(exception, ReadCancelledException)
+        self.assertFalse(handle.cancel())
+
+
+class ErrorReports(unittest.TestCase):
+    crud = psql_crud
+
+    def test_reports_arguments_as_passed(self):
+        try:
+            self.crud.copy_from('missing_table', [('a',)], format='text', header=True)
+            exception = None
+        except Exception as e:
+            exception = e
+
+        self.assertIsInstance(exception, WriteException)
+        self.assertIn("'format': 'text', 'header': True", str(exception))
+
+    def test_reports_arguments_of_helpers(self):
+        try:
+            self.crud.stream_changes(('missing_table',), 'missing_slot', plugin='test_decoding', create_slot=False)
+            exception = None
+        except Exception as e:
+            exception = e
+
+        self.assertIsInstance(exception, ReadException)
+        self.assertIn("'tables': ('missing_table',), 'slot_name': 'missing_slot'", str(exception))
+
+    def test_reports_arguments_through_private_helpers(self):
+        for concurrently in (False, True):
+            try:
+                self.crud.create_index('missing_table', 'id', index_name='missing_idx', concurrently=concurrently)
+                exception = None
+            except Exception as e:
+                exception = e
+
+            self.assertIsInstance(exception, WriteException)
+            self.assertIn("'index_name': 'missing_idx'", str(exception))
+            self.assertIn(f"'concurrently': {concurrently}", str(exception))
+
+
+class ConcurrentUse(unittest.TestCase):
+    def test_threads_share_one_instance(self):
+        crud = PostgresCrud(
+            host=os.getenv('DB_HOST'),
+            port=int(os.getenv('DB_PORT')),
+            dbname=os.getenv('DB_NAME'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+        )
+        wrong, errors = [], []
+
+        def read(n):
+            for _ in range(200):
+                try:
+                    rows = crud.manual_query(query=f'SELECT {n}', type_='READ')
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                if rows != [(n,)]:
+                    wrong.append((n, rows))
+
+        threads = [threading.Thread(target=read, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        crud.close()
+
+        self.assertEqual(wrong, [])
+        self.assertEqual(errors, [])
+
+
+class CrossNodeInvalidation(unittest.TestCase):
+    table_name = table_name
+
+    @staticmethod
+    def new_crud(**kwargs) -> PostgresCrud:
+        return PostgresCrud(
+            host=os.getenv('DB_HOST'),
+            port=int(os.getenv('DB_PORT')),
+            dbname=os.getenv('DB_NAME'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+            **kwargs
+        )
+
+    def test_write_on_other_node_evicts_cache(self):
+        try:
+            reset(create_table=True, insert_data=True)
+        except Exception as e:
+            print(e)
+
+        reader, writer = self.new_crud(), self.new_crud()
+        try:
+            cache = reader.enable_select_cache()
+            listener = reader.enable_invalidation(batch_interval=0.01)
+            writer.enable_invalidation(listen=False)
+
+            self.assertEqual(len(reader.select(table_name=self.table_name, columns='name')), 1)
+            self.assertEqual(len(reader.select(table_name=self.table_name, columns='name')), 1)
+            self.assertEqual(cache.hits, 1)
+
+            writer.insert_from_dict(table_name=self.table_name, data={'name': 'jane', 'family': 'roe', 'age': 30})
+            writer.delete(table_name=self.table_name, condition="family = 'nobody'")
+
+            for _ in range(100):
+                if listener.batches:
+                    break
+                time.sleep(0.02)
+
+            self.assertEqual(len(cache), 0)
+            self.assertEqual(len(reader.select(table_name=self.table_name, columns='name')), 2)
+        finally:
+            reader.close()
+            writer.close()
+
+    def test_only_ddl_invalidates_catalog(self):
+        try:
+            reset(create_table=True, insert_data=True)
+        except Exception as e:
+            print(e)
+
+        self.assertEqual(invalidation.parse_payload('ddl:t'), ('ddl', 't'))
+        self.assertEqual(invalidation.parse_payload('t'), ('data', 't'))
+        self.assertEqual(invalidation.statement_kind('SET LOCAL lock_timeout = 5; CREATE INDEX i ON t (a)'), 'ddl')
+
+        reader, writer = self.new_crud(catalog_cache=True), self.new_crud()
+        try:
+            reader.load_catalog()
+            listener = reader.enable_invalidation(batch_interval=0.01)
+            writer.enable_invalidation(listen=False)
+
+            def wait_batches(count: int) -> None:
+                for _ in range(100):
+                    if listener.batches >= count:
+                        break
+                    time.sleep(0.02)
+
+            writer.insert_from_dict(table_name=self.table_name, data={'name': 'jane', 'family': 'roe', 'age': 30})
+            wait_batches(1)
+            self.assertIsNotNone(reader._catalog)
+            self.assertTrue(reader._catalog.has_table(self.table_name))
+            with self.assertRaises(WriteException):
+                reader.insert_from_dict(table_name=self.table_name, data={'nickname': 'johnny'})
+
+            writer.create_index(table_name=self.table_name, columns=['age'], index_name='kinds_age_idx')
+            wait_batches(2)
+            self.assertIsNone(reader._catalog)
+            self.assertTrue(reader.load_catalog().has_index('kinds_age_idx'))
+        finally:
+            reader.close()
+            writer.close()
+
+    def test_drop_index_evicts_its_table(self):
+        try:
+            reset(create_table=True, insert_data=True)
+        except Exception as e:
+            print(e)
+
+        writer = self.new_crud()
+        writer.create_index(table_name=self.table_name, columns=['age'], index_name='kinds_age_idx')
+
+        reader = self.new_crud()
+        try:
+            cache = reader.enable_select_cache()
+            listener = reader.enable_invalidation(batch_interval=0.01)
+            writer.enable_invalidation(listen=False)
+
+            reader.select(table_name=self.table_name, columns='name')
+            self.assertEqual(len(cache), 1)
+            # reads leave their transaction open, which would hold back the lock DROP INDEX needs
+            reader._connect().rollback()
+
+            writer.drop_index(index_name='kinds_age_idx')
+            writer.drop_index(index_name='kinds_age_idx', if_exists=True)
+
+            for _ in range(100):
+                if listener.batches:
+                    break
+                time.sleep(0.02)
+
+            self.assertEqual(listener.batches, 1)
+            self.assertEqual(len(cache), 0)
+        finally:
+            reader.close()
+            writer.close()
+
+
+class MaterializedViews(unittest.TestCase):
+    crud = psql_crud
+    table_name = table_name
+    view_name = 'test_table_by_family'
+
+    def test_refresh_and_schedule(self):
+        try:
+            reset(create_table=True, insert_data=True)
+        except Exception as e:
+            print(e)
+
+        try:
+            self.crud.create_materialized_view(
+                name=self.view_name,
+                query=f'SELECT family, count(*) AS people FROM "{self.table_name}" GROUP BY family',
+                indexes=[{'columns': 'family', 'unique': True}],
+            )
+            self.crud.insert_from_dict(table_name=self.table_name, data={'name': 'jane', 'family': 'roe', 'age': 30})
+            self.assertEqual(len(self.crud.select(table_name=self.view_name, columns='*')), 1)
+
+            duration = self.crud.refresh_materialized_view(name=self.view_name, concurrently=True)
+            self.assertGreaterEqual(duration, 0)
+            self.assertEqual(len(self.crud.select(table_name=self.view_name, columns='*')), 2)
+
+            self.crud.schedule_refresh(name=self.view_name, on_change=True, tick=0.1)
+            time.sleep(0.3)
+            self.crud.insert_from_dict(table_name=self.table_name, data={'name': 'max', 'family': 'poe', 'age': 40})
+            # idle sessions report their statistics only every few seconds otherwise
+            self.crud.manual_query(query='SELECT pg_stat_force_next_flush()', type_='WRITE')
+
+            for _ in range(100):
+                if self.crud.materialized_view_stats(self.view_name)['refresh_count'] >= 2:
+                    break
+                time.sleep(0.1)
+
+            stats = self.crud.materialized_view_stats(self.view_name)
+            self.assertEqual(stats['refresh_count'], 2)
+            self.assertEqual(stats['error_count'], 0)
+            self.assertIsNotNone(stats['staleness'])
+            self.assertEqual(len(self.crud.select(table_name=self.view_name, columns='*')), 3)
+        finally:
+            self.crud.unschedule_refresh(self.view_name)
+            self.crud.drop_materialized_view(self.view_name)
+
+
+class Sharding(unittest.TestCase):
+    databases = ['nice_crud_shard_0', 'nice_crud_shard_1', 'nice_crud_shard_2']
+    table_name = 'sharded_users'
+
+    @staticmethod
+    def new_crud(dbname: str) -> PostgresCrud:
+        return PostgresCrud(
+            host=os.getenv('DB_HOST'),
+            port=int(os.getenv('DB_PORT')),
+            dbname=dbname,
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+        )
+
+    @classmethod
+    def setUpClass(cls):
+        conn = psql_crud._new_connection()
+        conn.autocommit = True
+        try:
+            cur = conn.cursor()
+            for dbname in cls.databases:
+                cur.execute('SELECT 1 FROM pg_database WHERE datname = %s', (dbname,))
+                if cur.fetchone() is None:
+                    cur.execute(f'CREATE DATABASE "{dbname}"')
+        except Exception as e:
+            raise unittest.SkipTest(f'Can not create shard databases: {e}')
+        finally:
+            conn.close()
+
+    def test_routing_merge_and_reshard(self):
+        shards = {f's{i}': self.new_crud(dbname) for i, dbname in enumerate(self.databases)}
+        crud = ShardedPostgresCrud({'s0': shards['s0'], 's1': shards['s1']}, shard_key='user_id')
+
+        try:
+            for shard in shards.values():
+                shard.drop_table(self.table_name)
+                shard.create_table(
+                    table_name=self.table_name,
+                    columns={'user_id': 'integer NOT NULL', 'name': 'text', 'age': 'integer'},
+                    primary_key='user_id',
+                )
+
+            for user_id in range(1, 41):
+                crud.insert_from_dict(
+                    table_name=self.table_name, data={'user_id': user_id, 'name': f'user{user_id}', 'age': user_id % 7}
+                )
+            crud.insert(table_name=self.table_name, columns=['user_id', 'name', 'age'], values=[41, "'o''neil'", 1])
+
+            counts = [shard.count(self.table_name) for shard in (shards['s0'], shards['s1'])]
+            self.assertEqual(sum(counts), 41)
+            self.assertTrue(all(counts))
+            self.assertEqual(
+                crud.select(table_name=self.table_name, columns='name', condition='user_id = 41', shard_key_value=41),
+                [("o'neil",)]
+            )
+
+            rows = crud.select(
+                table_name=self.table_name, columns=['user_id', 'age'], order_by='age DESC, user_id', limit=5, offset=2
+            )
+            expected = sorted(((i, i % 7) for i in range(1, 41)), key=lambda row: (-row[1], row[0]))
+            expected = sorted(expected + [(41, 1)], key=lambda row: (-row[1], row[0]))[2:7]
+            self.assertEqual(rows, expected)
+
+            crud.update_via_dict(
+                table_name=self.table_name, data={'age': 99}, condition='user_id = 7', shard_key_value=7
+            )
+            crud.delete(table_name=self.table_name, condition='user_id = 8')
+            self.assertEqual(crud.select(table_name=self.table_name, columns='age', condition='user_id = 7'), [(99,)])
+            self.assertEqual(crud.select(table_name=self.table_name, columns='*', condition='user_id = 8'), [])
+
+            report = crud.reshard(shards, tables=[self.table_name])
+            moved = sum(report[self.table_name].values())
+            self.assertTrue(moved > 0)
+            self.assertEqual(sum(shard.count(self.table_name) for shard in shards.values()), 40)
+            for user_id in (1, 7, 20, 41):
+                self.assertEqual(
+                    len(crud.select(
+                        table_name=self.table_name, columns='*', condition=f'user_id = {user_id}',
+                        shard_key_value=user_id
+                    )), 1
+                )
+        finally:
+            crud.close()
+            for shard in shards.values():
+                shard.close()
+
+
+class LoadTestCli(unittest.TestCase):
+    def test_helpers(self):
+        self.assertEqual(percentile([5, 1, 3, 2, 4], 50), 3)
+        self.assertEqual(percentile([5, 1, 3, 2, 4], 100), 5)
+        self.assertEqual(parse_mix('select=3,count'), [('select', 3.0), ('count', 1.0)])
+        with self.assertRaises(ValueError):
+            parse_mix('truncate=1')
+
+    def test_short_run(self):
+        args = [
+            '--host', os.getenv('DB_HOST'), '--port', os.getenv('DB_PORT'), '--dbname', os.getenv('DB_NAME'),
+            '--user', os.getenv('DB_USER'), '--password', os.getenv('DB_PASSWORD'),
+        ]
+        setup_table(psql_crud, 'nice_crud_bench', 100)
+
+        config = {
+            'connection': {
+                'host': os.getenv('DB_HOST'), 'port': int(os.getenv('DB_PORT')), 'dbname': os.getenv('DB_NAME'),
+                'user': os.getenv('DB_USER'), 'password': os.getenv('DB_PASSWORD'),
+            },
+            'mode': 'threads', 'workers': 2, 'connections': 1, 'rate': 100, 'duration': 1.0, 'interval': 0.5,
+            'mix': 'select=2,update_via_dict=1', 'replay': None, 'table': 'nice_crud_bench', 'rows': 100, 'seed': 0,
+        }
+        report = run_benchmark(config)
+
+        self.assertGreater(report['total']['ops'], 50)
+        self.assertEqual(report['total']['error_rate'], 0)
+        self.assertEqual(len(report['intervals']), 2)
+        self.assertEqual(bench_main(args + ['--duration', '0.5', '--json', '--rows', '100']), 0)
+
+        psql_crud.drop_table('nice_crud_bench')
+
+
+class TableMaintenance(unittest.TestCase):
+    crud = psql_crud
+    table_name = table_name
+
+    def test_vacuum_analyze_and_health(self):
+        try:
+            reset(create_table=True)
+        except Exception as e:
+            print(e)
+
+        self.crud.copy_from(self.table_name, ((f'name{i}', f'family{i}', i % 90) for i in range(2000)),
+                            columns=['name', 'family', 'age'])
+        self.crud.delete(table_name=self.table_name, condition='age < 45')
+
+        try:
+            self.crud.analyze(table_name=self.table_name)
+            self.crud.vacuum(table_name=self.table_name)
+            health = self.crud.table_health(table_name=self.table_name)
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            health = None
+
+        self.assertFalse(is_exception)
+        self.assertEqual(len(health), 1)
+        self.assertEqual(health[0]['table_name'], self.table_name)
+        self.assertIsNotNone(health[0]['last_vacuum'])
+        self.assertIsNotNone(health[0]['estimated_bloat'])
+        self.assertIn(f'{self.table_name}_pkey', health[0]['index_sizes'])
+        self.assertTrue(0 <= health[0]['dead_ratio'] <= 1)
+
+    def test_auto_analyze_after_bulk_load(self):
+        try:
+            reset(create_table=True)
+        except Exception as e:
+            print(e)
+
+        crud = PostgresCrud(
+            host=os.getenv('DB_HOST'),
+            port=int(os.getenv('DB_PORT')),
+            dbname=os.getenv('DB_NAME'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+        )
+        try:
+            crud.enable_auto_analyze(fraction=0.1, min_rows=100)
+            crud.copy_from(self.table_name, ((f'name{i}', f'family{i}', i) for i in range(500)),
+                           columns=['name', 'family', 'age'])
+            self.assertEqual(crud.estimated_count(self.table_name, fallback=False), 500)
+        finally:
+            crud.close()
+
+
+class ReplaceTable(unittest.TestCase):
+    crud = psql_crud
+    table_name = table_name
+
+    def test_replace_table(self):
+        try:
+            reset(create_table=True, insert_data=True)
+        except Exception as e:
+            print(e)
+
+        self.crud.create_index(table_name=self.table_name, columns='age')
+
+        try:
+            rows = self.crud.replace_table(
+                self.table_name, ((i, f'name{i}', f'family{i}', i % 90) for i in range(1, 1001)),
+                columns=['id', 'name', 'family', 'age'], index_workers=2
+            )
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            rows = None
+
+        self.assertFalse(is_exception)
+        self.assertEqual(rows, 1000)
+
+        for thread in self.crud._background_drops:
+            thread.join()
+
+        count = self.crud.manual_query(query=f'SELECT count(*) FROM {self.table_name}', type_='READ')
+        self.assertEqual(count[0][0], 1000)
+        self.assertEqual(
+            self.crud.select(table_name=self.table_name, columns='*', condition="family = 'doe'"), []
+        )
+
+        constraints = self.crud.manual_query(
+            query=f"SELECT conname FROM pg_constraint WHERE conrelid = '{self.table_name}'::regclass ORDER BY 1",
+            type_='READ'
+        )
+        self.assertEqual([row[0] for row in constraints], [f'{self.table_name}_family_key', f'{self.table_name}_pkey'])
+
+        persistence = self.crud.manual_query(
+            query=f"SELECT relpersistence FROM pg_class WHERE oid = '{self.table_name}'::regclass", type_='READ'
+        )
+        self.assertEqual(persistence[0][0], 'p')
+
+        old_table = self.crud.manual_query(query=f"SELECT to_regclass('{self.table_name}__old')", type_='READ')
+        self.assertIsNone(old_table[0][0])
+
+        self.crud.insert_from_dict(table_name=self.table_name, data={'name': 'jane', 'family': 'roe', 'age': 30})
+        inserted = self.crud.select(table_name=self.table_name, columns='*', condition="family = 'roe'")
+        self.assertEqual(inserted[0][0], 1001)
+
+        try:
+            self.crud.replace_table(self.table_name, [(1, 'a', 'dup', 1), (2, 'b', 'dup', 2)],
+                                    columns=['id', 'name', 'family', 'age'])
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+
+        self.assertTrue(is_exception)
+        count = self.crud.manual_query(query=f'SELECT count(*) FROM {self.table_name}', type_='READ')
+        self.assertEqual(count[0][0], 1001)
+        staging = self.crud.manual_query(query=f"SELECT to_regclass('{self.table_name}__new')", type_='READ')
+        self.assertIsNone(staging[0][0])
+
+
+class BlobStreaming(unittest.TestCase):
+    crud = psql_crud
+    table_name = 'nice_crud_blobs'
+
+    def test_bytea_and_large_object(self):
+        self.crud.drop_table(self.table_name)
+        self.crud.create_table(
+            table_name=self.table_name, columns={'id': 'integer', 'data': 'bytea', 'lo': 'oid'}, primary_key='id'
+        )
+        self.crud.insert_from_dict(table_name=self.table_name, data={'id': 1})
+
+        payload = os.urandom(300_000)
+        try:
+            written = self.crud.write_blob(self.table_name, 1, io.BytesIO(payload), chunk_size=64 * 1024)
+            chunks = list(self.crud.read_blob(self.table_name, 1, chunk_size=64 * 1024))
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            written, chunks = None, []
+
+        self.assertFalse(is_exception)
+        self.assertEqual(written, len(payload))
+        self.assertEqual(b''.join(chunks), payload)
+        self.assertTrue(all(len(chunk) <= 64 * 1024 for chunk in chunks))
+        self.assertEqual(len(chunks), 5)
+
+        for _ in range(2):
+            self.crud.write_blob(self.table_name, 1, io.BytesIO(payload), column='lo', large_object=True,
+                                 chunk_size=100_000)
+        data = b''.join(self.crud.read_blob(self.table_name, 1, column='lo', large_object=True))
+        self.assertEqual(data, payload)
+
+        # The large object replaced by the second write was unlinked.
+        objects = self.crud.manual_query(query='SELECT count(*) FROM pg_largeobject_metadata', type_='READ')
+        oid = self.crud.select(table_name=self.table_name, columns=['lo'], condition='id = 1')[0][0]
+        self.assertEqual(objects[0][0], 1)
+        self.crud.manual_query(query=f'SELECT lo_unlink({oid})', type_='WRITE')
+
+        try:
+            self.crud.write_blob(self.table_name, 2, io.BytesIO(payload))
+            is_exception = False
+        except WriteException as e:
+            print(e)
+            is_exception = True
+
+        self.assertTrue(is_exception)
+
+        try:
+            list(self.crud.read_blob(self.table_name, 2))
+            is_exception = False
+        except ReadException as e:
+            print(e)
+            is_exception = True
+
+        self.assertTrue(is_exception)
+        self.crud.drop_table(self.table_name)
+
+
+class JsonbSupport(unittest.TestCase):
+    crud = psql_crud
+    table_name = 'nice_crud_documents'
+
+    def test_adaptation_and_conditions(self):
+        self.crud.drop_table(self.table_name)
+        self.crud.create_table(
+            table_name=self.table_name, columns={'id': 'serial', 'doc': 'jsonb NOT NULL'}, primary_key='id'
+        )
+
+        documents = [
+            {'kind': 'order', 'customer': {'name': "o'hara", 'tier': 'gold'}, 'tags': ['a', 'b']},
+            {'kind': 'order', 'customer': {'name': 'doe', 'tier': 'silver'}, 'tags': ['b'], 'discount': 5},
+            {'kind': 'refund', 'customer': {'name': 'roe', 'tier': 'gold'}, 'tags': []},
+        ]
+        try:
+            for document in documents:
+                self.crud.insert_from_dict(table_name=self.table_name, data={'doc': document})
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+
+        self.assertFalse(is_exception)
+
+        rows = self.crud.select(table_name=self.table_name, columns=['doc'], order_by='id')
+        self.assertEqual([row[0] for row in rows], documents)
+
+        def ids(condition):
+            return [row[0] for row in self.crud.select(
+                table_name=self.table_name, columns=['id'], condition=condition, order_by='id'
+            )]
+
+        self.assertEqual(ids(jsonb.contains('doc', {'kind': 'order'})), [1, 2])
+        self.assertEqual(ids(jsonb.has_key('doc', 'discount')), [2])
+        self.assertEqual(ids(jsonb.has_key('doc', 'discount', path_ops=True)), [2])
+        self.assertEqual(ids(jsonb.path_equals('doc', 'customer.tier', 'gold')), [1, 3])
+        self.assertEqual(ids(jsonb.path_equals('doc', ['customer', 'name'], "o'hara")), [1])
+        self.assertEqual(ids(jsonb.path_equals('doc', ['tags', 0], 'a')), [1])
+        self.assertEqual(ids([jsonb.contains('doc', {'kind': 'order'}), jsonb.path_equals('doc', 'tags', ['b'])]),
+                         [1, 2])
+
+        self.crud.update_via_dict(table_name=self.table_name, data={'doc': {'kind': 'void'}}, condition='id = 3')
+        self.assertEqual(ids(jsonb.contains('doc', {'kind': 'void'})), [3])
+
+        self.crud.create_jsonb_index(self.table_name, 'doc')
+        self.crud.manual_query(query='SET enable_seqscan = off', type_='WRITE')
+        try:
+            plan = self.crud.manual_query(
+                query=f'EXPLAIN SELECT id FROM {self.table_name} WHERE {jsonb.path_equals("doc", "kind", "order")}',
+                type_='READ'
+            )
+        finally:
+            self.crud.manual_query(query='RESET enable_seqscan', type_='WRITE')
+
+        self.assertIn(f'{self.table_name}_doc_gin', ' '.join(row[0] for row in plan))
+        self.crud.drop_table(self.table_name)
+
+    def test_lists_follow_the_column_type(self):
+        cached = PostgresCrud(
+            host=os.getenv('DB_HOST'),
+            port=int(os.getenv('DB_PORT')),
+            dbname=os.getenv('DB_NAME'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+            catalog_cache=True,
+        )
+
+        for crud in (self.crud, cached):
+            crud.drop_table(self.table_name)
+            crud.create_table(
+                table_name=self.table_name,
+                columns={'id': 'serial', 'tags': 'text[]', 'scores': 'integer[]', 'doc': 'jsonb'}, primary_key='id'
+            )
+
+            try:
+                crud.insert_from_dict(
+                    table_name=self.table_name, data={'tags': ["o'hara", 'b'], 'scores': [1, 2], 'doc': ['a', 1]}
+                )
+                crud.update_via_dict(table_name=self.table_name, data={'tags': [], 'scores': [3]}, condition='id = 1')
+                crud.update(table_name=self.table_name, columns=['doc'], values=[[{'x': 1}]], condition='id = 1')
+                is_exception = False
+            except Exception as e:
+                print(e)
+                is_exception = True
+
+            self.assertFalse(is_exception)
+            self.assertEqual(
+                crud.select(table_name=self.table_name, columns=['tags', 'scores', 'doc']), [([], [3], [{'x': 1}])]
+            )
+            crud.drop_table(self.table_name)
+
+        cached.close()
+
+
+class FullTextSearch(unittest.TestCase):
+    crud = psql_crud
+    table_name = 'nice_crud_articles'
+
+    def test_enable_fulltext_and_search(self):
+        self.crud.drop_table(self.table_name)
+        self.crud.create_table(
+            table_name=self.table_name, columns={'id': 'serial', 'title': 'text', 'body': 'text'}, primary_key='id'
+        )
+        articles = [
+            ('Postgres indexing', 'GIN indexes make full text search fast.'),
+            ('Cooking pasta', 'Boil water, add salt, then cook the pasta; no indexes involved.'),
+            ('Search engines', 'Ranking documents by relevance when searching postgres tables.'),
+        ]
+        for title, body in articles:
+            self.crud.insert_from_dict(table_name=self.table_name, data={'title': title, 'body': body})
+
+        try:
+            self.crud.enable_fulltext(self.table_name, {'title': 'A', 'body': 'B'})
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+
+        self.assertFalse(is_exception)
+
+        rows = self.crud.search(self.table_name, 'postgres', columns=['id'])
+        self.assertEqual([row[0] for row in rows], [1, 3])
+        self.assertGreater(rows[0][1], rows[1][1])
+
+        rows = self.crud.search(self.table_name, 'indexes -pasta', columns=['id'], rank=False)
+        self.assertEqual(rows, [(1,)])
+
+        rows = self.crud.search(self.table_name, '"full text"', columns=['id'], headline='body', rank=False,
+                                headline_options='StartSel=[, StopSel=]')
+        self.assertEqual(rows[0][0], 1)
+        self.assertIn('[full] [text]', rows[0][1])
+
+        rows = self.crud.search(self.table_name, 'postgres', columns=['id'], condition="title LIKE 'Search%'")
+        self.assertEqual([row[0] for row in rows], [3])
+
+        self.crud.insert_from_dict(table_name=self.table_name, data={'title': 'More postgres', 'body': 'again'})
+        self.assertEqual(len(self.crud.search(self.table_name, 'postgres', limit=None)), 3)
+
+        self.crud.manual_query(query='SET enable_seqscan = off', type_='WRITE')
+        try:
+            plan = self.crud.manual_query(
+                query=f"EXPLAIN SELECT id FROM {self.table_name} "
+                      f"WHERE search_vector @@ websearch_to_tsquery('english', 'postgres')",
+                type_='READ'
+            )
+        finally:
+            self.crud.manual_query(query='RESET enable_seqscan', type_='WRITE')
+
+        self.assertIn(f'{self.table_name}_search_vector_gin', ' '.join(row[0] for row in plan))
+        self.crud.drop_table(self.table_name)
+
+
+class SelectMany(unittest.TestCase):
+    crud = psql_crud
+    table_name = table_name
+
+    def test_select_many(self):
+        try:
+            reset(create_table=True)
+        except Exception as e:
+            print(e)
+
+        self.crud.copy_from(self.table_name, ((f'name{i}', f'family{i}', i % 90) for i in range(1, 501)),
+                            columns=['name', 'family', 'age'])
+
+        keys = [5, 3, 5, 999, 250, 3]
+        try:
+            rows = self.crud.select_many(self.table_name, 'id', keys, columns=['name', 'age'])
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            rows = None
+
+        self.assertFalse(is_exception)
+        self.assertEqual(list(rows), [5, 3, 250])
+        self.assertEqual(rows[250], ('name250', 250 % 90))
+
+        rows = self.crud.select_many(self.table_name, 'id', keys, missing='none')
+        self.assertEqual(list(rows), [5, 3, 999, 250])
+        self.assertIsNone(rows[999])
+        self.assertEqual(rows[3][:2], (3, 'name3'))
+
+        rows = self.crud.select_many(self.table_name, 'family', [f'family{i}' for i in range(1, 501)],
+                                     columns='id', chunk_size=64, workers=4)
+        self.assertEqual(len(rows), 500)
+        self.assertEqual(rows['family42'], (42,))
+
+        try:
+            self.crud.select_many(self.table_name, 'id', [1, 1000, 1001], missing='raise')
+            is_exception = False
+        except ReadException as e:
+            print(e)
+            is_exception = True
+
+        self.assertTrue(is_exception)
+        self.assertEqual(self.crud.select_many(self.table_name, 'id', []), {})
+
+    def test_string_keys_on_integer_column(self):
+        try:
+            reset(create_table=True)
+        except Exception as e:
+            print(e)
+
+        self.crud.copy_from(self.table_name, ((f'name{i}', f'family{i}', i % 90) for i in range(1, 101)),
+                            columns=['name', 'family', 'age'])
+        crud = PostgresCrud(
+            host=os.getenv('DB_HOST'),
+            port=int(os.getenv('DB_PORT')),
+            dbname=os.getenv('DB_NAME'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+            catalog_cache=True,
+        )
+        crud.load_catalog()
+
+        try:
+            rows = crud.select_many(self.table_name, 'id', ['7', '42', '7', '999'], columns='name', missing='none')
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            rows = None
+
+        self.assertFalse(is_exception)
+        self.assertEqual(rows, {'7': ('name7',), '42': ('name42',), '999': None})
+
+        try:
+            crud.select_many(self.table_name, 'id', ['7', '42'], missing='raise')
+            is_exception = False
+        except ReadException as e:
+            print(e)
+            is_exception = True
+
+        self.assertFalse(is_exception)
+        crud.close()
+
+
+class DataLoaderCoalescing(unittest.TestCase):
+    crud = psql_crud
+    table_name = table_name
+
+    def test_coalesces_concurrent_gets(self):
+        try:
+            reset(create_table=True)
+        except Exception as e:
+            print(e)
+
+        self.crud.copy_from(self.table_name, ((f'name{i}', f'family{i}', i % 90) for i in range(1, 101)),
+                            columns=['name', 'family', 'age'])
+
+        async def render(loader):
+            first = await asyncio.gather(*[loader.get(self.table_name, key) for key in (1, 2, 3, 2, 500)])
+            again = await loader.get(self.table_name, 3)
+            names = await loader.get_many(self.table_name, ['family7', 'family8'], key_column='family',
+                                          columns=['name'])
+            return first, again, names
+
+        async def staggered(loader):
+            async def delayed(key, delay):
+                await asyncio.sleep(delay)
+                return await loader.get(self.table_name, key)
+
+            return await asyncio.gather(delayed(10, 0), delayed(11, 0.001), delayed(12, 0.002))
+
+        async def run():
+            async with DataLoader(self.crud) as loader:
+                result = await render(loader)
+                batches = loader.batches
+
+            async with DataLoader(self.crud, window=0.05) as loader:
+                rows = await staggered(loader)
+                windowed = loader.batches
+
+            return result, batches, rows, windowed
+
+        (first, again, names), batches, rows, windowed = asyncio.run(run())
+
+        self.assertEqual([row[0] if row else None for row in first], [1, 2, 3, 2, None])
+        self.assertEqual(again, first[2])
+        self.assertEqual(names, [('name7',), ('name8',)])
+        self.assertEqual(batches, 2)
+        self.assertEqual([row[0] for row in rows], [10, 11, 12])
+        self.assertEqual(windowed, 1)
+
+
+class ChangeStream(unittest.TestCase):
+    crud = psql_crud
+    table_name = table_name
+
+    def consume(self, changes):
+        events = []
+        for change in changes:
+            events.append(change)
+        return events
+
+    def check_plugin(self, plugin):
+        slot_name = f'nice_crud_test_{plugin}'
+        try:
+            reset(create_table=True)
+            self.crud.drop_change_stream(slot_name)
+        except Exception as e:
+            print(e)
+
+        try:
+            changes = self.crud.stream_changes([self.table_name], slot_name, plugin=plugin, idle_timeout=1.0,
+                                               ack_interval=0.1)
+            self.crud.insert_from_dict(table_name=self.table_name, data={'name': 'john', 'family': 'doe', 'age': 20})
+            self.crud.update_via_dict(table_name=self.table_name, data={'age': 21}, condition="family = 'doe'")
+            self.crud.delete(table_name=self.table_name, condition="family = 'doe'")
+            events = self.consume(changes)
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            events = []
+
+        self.assertFalse(is_exception)
+        self.assertEqual([event['operation'] for event in events], ['insert', 'update', 'delete'])
+        self.assertEqual({event['table'] for event in events}, {self.table_name})
+        self.assertEqual(events[0]['new']['family'], 'doe')
+        self.assertEqual(str(events[1]['new']['age']), '21')
+        self.assertEqual(str(events[2]['old']['id']), str(events[0]['new']['id']))
+        self.assertIsNotNone(events[0]['xid'])
+
+        # Everything was acknowledged: a restarted stream resumes after the last change.
+        self.crud.insert_from_dict(table_name=self.table_name, data={'name': 'jane', 'family': 'roe', 'age': 30})
+        events = self.consume(self.crud.stream_changes([self.table_name], slot_name, idle_timeout=1.0))
+        self.assertEqual([(event['operation'], event['new']['family']) for event in events], [('insert', 'roe')])
+
+        self.crud.drop_change_stream(slot_name)
+
+    def test_pgoutput(self):
+        self.check_plugin('pgoutput')
+
+    def test_test_decoding_decoder(self):
+        decoder = cdc.TestDecodingDecoder()
+        decoder.options([self.table_name], '')
+        lines = [
+            'BEGIN 731',
+            f"table public.{self.table_name}: INSERT: id[integer]:1 name[text]:'o''hara' family[text]:'doe' "
+            f"age[integer]:null",
+            'table public.other: INSERT: id[integer]:5',
+            f"table public.{self.table_name}: UPDATE: old-key: id[integer]:1 new-tuple: id[integer]:2 "
+            f"name[text]:'a b' family[character varying]:'doe' age[integer]:21",
+            f'table public.{self.table_name}: DELETE: id[integer]:2',
+            'COMMIT 731',
+        ]
+        events = [event for line in lines for event in decoder.decode(line.encode())]
+
+        self.assertEqual([event['operation'] for event in events], ['insert', 'update', 'delete'])
+        self.assertEqual(events[0]['new'], {'id': '1', 'name': "o'hara", 'family': 'doe', 'age': None})
+        self.assertEqual(events[1]['old'], {'id': '1'})
+        self.assertEqual(events[1]['new']['name'], 'a b')
+        self.assertEqual(events[2]['old'], {'id': '2'})
+        self.assertEqual(events[0]['xid'], 731)
+        self.assertFalse(decoder.in_transaction)
+
+
+class IncrementalExtraction(unittest.TestCase):
+    crud = psql_crud
+    table_name = 'nice_crud_delta'
+
+    def extract(self, *args, **kwargs):
+        with self.crud.select_changed_since(self.table_name, *args, **kwargs) as changes:
+            rows = [row for batch in changes for row in batch]
+        return sorted(rows), changes.watermark, changes.full
+
+    def test_xmin_and_column_strategies(self):
+        self.crud.drop_table(self.table_name)
+        self.crud.create_table(
+            table_name=self.table_name, primary_key='id',
+            columns={'id': 'serial', 'name': 'text', 'updated_at': 'timestamptz NOT NULL DEFAULT clock_timestamp()'},
+        )
+        self.crud.copy_from(self.table_name, ((f'name{i}',) for i in range(250)), columns=['name'])
+
+        try:
+            rows, xmin_watermark, full = self.extract(columns=['id', 'name'], batch_size=100)
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            rows, xmin_watermark, full = [], None, None
+
+        self.assertFalse(is_exception)
+        self.assertTrue(full)
+        self.assertEqual(len(rows), 250)
+        _, column_watermark, _ = self.extract(strategy='column', columns=['id'])
+
+        self.crud.update_via_dict(table_name=self.table_name, data={'name': 'changed'}, condition='id IN (3, 7)')
+        self.crud.manual_query(query=f"UPDATE {self.table_name} SET updated_at = clock_timestamp() WHERE id = 3",
+                               type_='WRITE')
+        self.crud.insert_from_dict(table_name=self.table_name, data={'name': 'new'})
+
+        rows, next_watermark, full = self.extract(xmin_watermark, columns=['id', 'name'])
+        self.assertFalse(full)
+        self.assertEqual(rows, [(3, 'changed'), (7, 'changed'), (251, 'new')])
+        self.assertGreater(next_watermark, xmin_watermark)
+        self.assertEqual(self.extract(next_watermark)[0], [])
+
+        rows, next_column_watermark, full = self.extract(column_watermark, strategy='column', columns=['id'],
+                                                         condition="name LIKE 'n%'")
+        self.assertEqual(rows, [(251,)])
+        self.assertGreater(next_column_watermark, column_watermark)
+        self.assertEqual(self.extract(next_column_watermark, strategy='column')[0], [])
+
+        # A watermark older than 2^31 transactions falls back to a full extraction.
+        rows, _, full = self.extract(next_watermark - (1 << 31))
+        self.assertTrue(full)
+        self.assertEqual(len(rows), 251)
+        self.crud.drop_table(self.table_name)
+
+    def test_column_strategy_holds_back_open_transactions(self):
+        self.crud.drop_table(self.table_name)
+        self.crud.create_table(
+            table_name=self.table_name, primary_key='id',
+            columns={'id': 'serial', 'name': 'text', 'updated_at': 'timestamptz NOT NULL DEFAULT clock_timestamp()'},
+        )
+        self.crud.insert_from_dict(table_name=self.table_name, data={'name': 'first'})
+        _, watermark, _ = self.extract(strategy='column', columns=['id'])
+
+        # Written before the extraction, committed after it, with an earlier timestamp than the rows it reads.
+        late = self.crud._new_connection()
+        late_cur = late.cursor()
+        late_cur.execute(f"INSERT INTO {self.table_name} (name) VALUES ('late')")
+        self.crud.insert_from_dict(table_name=self.table_name, data={'name': 'second'})
+
+        try:
+            rows, watermark, _ = self.extract(watermark, strategy='column', columns=['name'])
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            rows = []
+
+        late.commit()
+        late.close()
+
+        self.assertFalse(is_exception)
+        self.assertEqual(rows, [('second',)])
+        self.assertIn(('late',), self.extract(watermark, strategy='column', columns=['name'])[0])
+        self.crud.drop_table(self.table_name)
+
+
+class JobQueue(unittest.TestCase):
+    crud = psql_crud
+    queue_name = 'nice_crud_jobs'
+
+    def new_crud(self):
+        return PostgresCrud(
+            host=os.getenv('DB_HOST'),
+            port=int(os.getenv('DB_PORT')),
+            dbname=os.getenv('DB_NAME'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+        )
+
+    def setUp(self):
+        self.crud.drop_table(self.queue_name)
+        self.crud.create_queue(self.queue_name)
+
+    def test_lease_ack_nack(self):
+        try:
+            ids = self.crud.enqueue_many(self.queue_name, [{'n': i} for i in range(5)])
+            first = self.crud.dequeue(self.queue_name, batch=3, visibility_timeout=0.5)
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            ids, first = [], []
+
+        self.assertFalse(is_exception)
+        self.assertEqual(len(ids), 5)
+        self.assertEqual([job['payload'] for job in first], [{'n': 0}, {'n': 1}, {'n': 2}])
+
+        second = self.crud.dequeue(self.queue_name, batch=10, visibility_timeout=0.5)
+        self.assertEqual([job['id'] for job in second], ids[3:])
+
+        self.assertEqual(self.crud.ack(self.queue_name, first[:2]), 2)
+        self.assertEqual(self.crud.nack(self.queue_name, second), 2)
+        again = self.crud.dequeue(self.queue_name, batch=10, visibility_timeout=30.0)
+        self.assertEqual([(job['id'], job['attempts']) for job in again], [(ids[3], 2), (ids[4], 2)])
+        self.assertEqual(self.crud.ack(self.queue_name, again), 2)
+
+        # The lease of the third job expires: it is delivered again, and the stale receipt no longer acks it.
+        retried = self.crud.dequeue(self.queue_name, batch=10, wait=2.0)
+        self.assertEqual([job['id'] for job in retried], [first[2]['id']])
+        self.assertEqual(retried[0]['attempts'], 2)
+        self.assertEqual(self.crud.ack(self.queue_name, first[2:]), 0)
+        self.assertEqual(self.crud.ack(self.queue_name, retried), 1)
+
+    def test_concurrent_consumers_and_wakeup(self):
+        consumers = [self.new_crud() for _ in range(4)]
+        leased = []
+        lock = threading.Lock()
+
+        def consume(crud):
+            while True:
+                jobs = crud.dequeue(self.queue_name, batch=20, wait=1.0)
+                if not jobs:
+                    return
+                with lock:
+                    leased.extend(job['id'] for job in jobs)
+                crud.ack(self.queue_name, jobs)
+
+        ids = self.crud.enqueue_many(self.queue_name, range(1000))
+        threads = [threading.Thread(target=consume, args=(crud,)) for crud in consumers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(leased), ids)
+
+        # A waiting consumer is woken up by the notification rather than by its timeout.
+        waiter = consumers[0]
+        timer = threading.Timer(0.3, lambda: self.crud.enqueue_many(self.queue_name, ['late']))
+        started = time.monotonic()
+        timer.start()
+        jobs = waiter.dequeue(self.queue_name, wait=10.0)
+        self.assertEqual([job['payload'] for job in jobs], ['late'])
+        self.assertLess(time.monotonic() - started, 5.0)
+
+        for crud in consumers:
+            crud.close()
+
+
+class MemoryBudget(unittest.TestCase):
+    crud = psql_crud
+    table_name = table_name
+
+    def test_spill_to_mmap(self):
+        try:
+            reset(create_table=True)
+        except Exception as e:
+            print(e)
+
+        self.crud.copy_from(self.table_name, ((f'name{i}', f'family{i}', i % 90) for i in range(5000)),
+                            columns=['name', 'family', 'age'])
+
+        try:
+            rows = self.crud.select(table_name=self.table_name, columns='*', order_by='id', memory_budget=50_000)
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+            rows = None
+
+        self.assertFalse(is_exception)
+        self.assertEqual(len(rows), 5000)
+        self.assertEqual(rows[0], (1, 'name0', 'family0', 0))
+        self.assertEqual(rows[-1], (5000, 'name4999', 'family4999', 4999 % 90))
+        self.assertEqual(rows[10:12], [(11, 'name10', 'family10', 10), (12, 'name11', 'family11', 11)])
+        self.assertEqual(sum(1 for _ in rows), 5000)
+
+        metrics = self.crud.last_query_metrics
+        self.assertTrue(metrics['spilled'])
+        self.assertEqual(metrics['rows'], 5000)
+        self.assertGreater(metrics['spill_bytes'], 0)
+        self.assertGreater(metrics['peak_rss'], 0)
+        self.assertLess(metrics['peak_in_memory_bytes'], 50_000 + 2 * 2000 * 200)
+
+        expected = self.crud.manual_query(query=f'SELECT * FROM {self.table_name} ORDER BY id', type_='READ')
+        self.assertEqual(rows, expected)
+        path = rows.path
+        rows.close()
+        self.assertFalse(os.path.exists(path))
+
+        small = self.crud.manual_query(query=f'SELECT id FROM {self.table_name} WHERE id <= 3 ORDER BY id',
+                                       type_='READ', memory_budget=1 << 20)
+        self.assertEqual(small, [(1,), (2,), (3,)])
+        self.assertFalse(self.crud.last_query_metrics['spilled'])
+
+        try:
+            self.crud.manual_query(query='SELECT * FROM nice_crud_missing_table', type_='READ', memory_budget=1000)
+            is_exception = False
+        except ReadException as e:
+            print(e)
+            is_exception = True
+
+        self.assertTrue(is_exception)
+        self.assertIsNone(self.crud.last_query_metrics)
+
+    def test_metrics_and_default_budget_scope(self):
+        crud = PostgresCrud(
+            host=os.getenv('DB_HOST'),
+            port=int(os.getenv('DB_PORT')),
+            dbname=os.getenv('DB_NAME'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+            memory_budget=1000,
+        )
+
+        try:
+            crud.load_catalog()
+            is_exception = False
+        except Exception as e:
+            print(e)
+            is_exception = True
+
+        # Internal lookups are fetched whole, without the instance's default budget.
+        self.assertFalse(is_exception)
+        self.assertIsNone(crud.last_query_metrics)
+
+        crud.manual_query(query='SELECT 1', type_='READ')
+        self.assertEqual(crud.last_query_metrics['rows'], 1)
+
+        # Not a query a server-side cursor accepts: fetched whole, but still measured.
+        self.assertEqual(len(crud.manual_query(query='SHOW server_version', type_='READ')), 1)
+        self.assertEqual(crud.last_query_metrics['batches'], 1)
+        self.assertFalse(crud.last_query_metrics['spilled'])
+        crud.close()
+
+
 if __name__ == '__main__':
     unittest.main()